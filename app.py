@@ -1,24 +1,36 @@
 import argparse
+import atexit
 import sys
+import time
 import traceback
 from functools import partial
 from pathlib import PurePosixPath
 
-from ext4.core import open_img
-from ext4.dump import dump
+from ext4.core import open_img, DEFAULT_CACHE_SIZE
+from ext4.dump import dump, copy_inode
+from ext4.extract import extract, format_extract_stats, DEFAULT_JOBS
 from ext4.inode import get_inode, format_inode_stat
-from ext4.cat import cat_by_blocks, travers_extent_tree
+from ext4.cat import travers_extent_tree
 from ext4.ls import ls, path_to_inode, format_ls_output_by_lines
 from ext4.mv import mv
 from ext4.rm import rm
 from ext4.fsck import fsck
-from ext4.utils import print_error
+from ext4.group_cache import get_cache_path, CACHE_SUFFIX
+from ext4.io_stats import IoStatsBuffer, find_io_stats, format_io_stats
+from ext4.progress import FsckProgress, TtyProgress, write_json_report
+from ext4.utils import print_error, get_block_size
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('image_path')
     parser.add_argument('--debug', '-d', action='store_true', help='Enable debug mode')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the image (zero-copy reads)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help='Block cache size in blocks, 0 to disable (default: %(default)s)')
+    parser.add_argument('--io-stats', action='store_true',
+                        help='Print reads, writes and seeks to the image by kind of data and a histogram of read '
+                             'sizes on stderr at exit (accesses of fsck --jobs workers are not counted)')
     subparsers = parser.add_subparsers(dest='command')
 
     stat_parser = subparsers.add_parser('stat', help='Show inode information')
@@ -38,6 +50,12 @@ def main():
     dump_parser.add_argument('file_path', type=PurePosixPath)
     dump_parser.add_argument('dest', help='Destination file path')
 
+    extract_parser = subparsers.add_parser('extract', help='Copy a directory tree out to a host directory')
+    extract_parser.add_argument('file_path', type=PurePosixPath)
+    extract_parser.add_argument('dest', help='Destination directory path')
+    extract_parser.add_argument('--jobs', '-j', type=int, default=DEFAULT_JOBS,
+                                help='Number of copying threads (default: %(default)s)')
+
     mv_parser = subparsers.add_parser('mv', help='Move file', aliases=['rename'])
     mv_parser.add_argument('source', type=PurePosixPath)
     mv_parser.add_argument('dest', type=PurePosixPath)
@@ -45,7 +63,15 @@ def main():
     rm_parser = subparsers.add_parser('rm', help='Remove file')
     rm_parser.add_argument('file_path', type=PurePosixPath)
 
-    subparsers.add_parser('fsck', help='Check file system')
+    fsck_parser = subparsers.add_parser('fsck', help='Check file system')
+    fsck_parser.add_argument('--jobs', '-j', type=int, default=1,
+                             help='Number of processes checking block groups (default: %(default)s)')
+    fsck_parser.add_argument('--report', choices=('text', 'json'), default='text',
+                             help='text: problems as they are found, json: problems and metrics at the end')
+    fsck_parser.add_argument('--quiet', '-q', action='store_true', help='No progress on stderr')
+    fsck_parser.add_argument('--incremental', action='store_true',
+                             help='Check only block groups changed since the last incremental run '
+                                  '(reports are cached in IMAGE{})'.format(CACHE_SUFFIX))
 
     args = parser.parse_args()
     sys.excepthook = partial(general_excepthook, args.debug)
@@ -53,15 +79,19 @@ def main():
     if not args.command:
         parser.print_help()
     write = args.command in ('mv', 'rm')
-    with open_img(args.image_path, write) as img:
+    with open_img(args.image_path, write, use_mmap=args.mmap, cache_size=args.cache_size,
+                  io_stats=args.io_stats) as img:
+        if args.io_stats:
+            atexit.register(print_io_stats, find_io_stats(img.buffer))
         if args.command == 'stat':
             inode_no = path_to_inode(*img, args.file_path) if args.file_path else args.inode_number
             inode = get_inode(*img, inode_no)
-            print(format_inode_stat(inode, inode_no, travers_extent_tree(img, inode.i_block)))
+            print(format_inode_stat(inode, inode_no, travers_extent_tree(img.buffer, inode.i_block, get_block_size(img))))
         elif args.command == 'cat':
             inode_no = path_to_inode(*img, args.file_path) if args.file_path else args.inode_number
-            for block in cat_by_blocks(*img, inode_no):
-                print(block.decode('utf-8', errors='ignore'), end='')
+            sys.stdout.flush()
+            copy_inode(*img, inode_no, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
         elif args.command == 'ls':
             inode_no = path_to_inode(*img, args.file_path) if args.file_path else args.inode_number
             for line in format_ls_output_by_lines(ls(*img, inode_no, recursively=args.r)):
@@ -71,6 +101,12 @@ def main():
         elif args.command == 'dump':
             inode_no = path_to_inode(*img, args.file_path) if args.file_path else args.inode_number
             dump(*img, inode_no, args.dest)
+        elif args.command == 'extract':
+            inode_no = path_to_inode(*img, args.file_path)
+            start = time.perf_counter()
+            extracted = extract(*img, inode_no, args.dest, args.file_path.name, jobs=args.jobs)
+            for line in format_extract_stats(extracted, time.perf_counter() - start):
+                print(line)
         elif args.command == 'path_to_inode':
             print(path_to_inode(*img, args.file_path))
         elif args.command == 'mv':
@@ -78,9 +114,22 @@ def main():
         elif args.command == 'rm':
             rm(img, args.file_path)
         elif args.command == 'fsck':
-            for exc in fsck(img):
-                msg = '{}'.format(str(exc))
-                print_error(msg)
+            progress = FsckProgress() if args.quiet else TtyProgress(sys.stderr)
+            cache_path = get_cache_path(args.image_path) if args.incremental else None
+            if args.report == 'json':
+                write_json_report(sys.stdout, list(fsck(img, args.jobs, progress, cache_path)), progress)
+            else:
+                for exc in fsck(img, args.jobs, progress, cache_path):
+                    msg = '{}'.format(str(exc))
+                    print_error(msg)
+
+        if args.debug and args.cache_size:
+            print('Block cache: {}'.format(img.buffer.stats()), file=sys.stderr)
+
+
+def print_io_stats(io_stats_buffer: IoStatsBuffer):
+    for line in format_io_stats(io_stats_buffer.stats()):
+        print(line, file=sys.stderr)
 
 
 def general_excepthook(is_debug_mode, errtype, value, tb):
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of record decoding: the old per-call path (format string rebuilt, input sliced and copied)
+against the precompiled codecs.
+
+Usage: python -m benchmarks.bench_structures
+"""
+import timeit
+from struct import unpack
+
+from ext4.structures import get_struct_format, ext4_inode_struct, ext4_extent_struct, ext4_dir_entry_2, \
+    ext4_inode_codec, ext4_extent_codec, ext4_dir_entry_2_codec, get_codec
+
+N = 20_000
+
+
+def old_parse_struct(struct, raw):
+    return get_codec(struct).record(*unpack(get_struct_format(struct), raw))
+
+
+def bench(name, stmt, records_per_call=1):
+    seconds = min(timeit.repeat(stmt, number=N, repeat=3))
+    print('{: <40} {: >8.1f} ns/record'.format(name, seconds / N / records_per_call * 1e9))
+
+
+def main():
+    inode_raw = bytes(range(256))
+    extents_raw = bytes(12 * 340)  # one 4K extent block
+    dirents_raw = bytes(range(64))
+
+    bench('inode: slice + parse', lambda: old_parse_struct(ext4_inode_struct, inode_raw[0:0x80]))
+    bench('inode: codec.unpack_from', lambda: ext4_inode_codec.unpack_from(inode_raw))
+    bench('inode: codec.unpack_field (i_mode)', lambda: ext4_inode_codec.unpack_field(inode_raw, 'i_mode'))
+
+    bench('extent: slice + parse', lambda: [old_parse_struct(ext4_extent_struct, extents_raw[12 * i:12 * (i + 1)])
+                                            for i in range(340)], 340)
+    bench('extent: codec.iter_unpack', lambda: list(ext4_extent_codec.iter_unpack(extents_raw)), 340)
+
+    bench('dirent: slice + parse', lambda: old_parse_struct(ext4_dir_entry_2, dirents_raw[8:16]))
+    bench('dirent: codec.unpack_from', lambda: ext4_dir_entry_2_codec.unpack_from(dirents_raw, 8))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Benchmark suite on a generated image (see `make_image`): path lookups, recursive listing, file copies, fsck
+passes, moves and removals. Every benchmark records its best wall time of `--repeat` runs, the read/write
+syscalls and bytes of the last run (Linux `/proc/self/io`) and its peak RSS, into a JSON file which a later run
+compares against (`--compare`) to show regressions.
+
+Usage: python -m benchmarks.bench_suite [--files N ...] [--repeat N] [--output RESULTS.json]
+                                        [--compare BASELINE.json] [--threshold 0.1] [--only NAME ...]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import PurePosixPath
+from typing import Callable, Dict, List, Optional, NamedTuple
+
+from benchmarks.make_image import make_image, add_spec_arguments, get_spec, plan_tree, get_file_path, \
+    GeneratedImage
+from ext4.core import open_img
+from ext4.dump import dump, copy_inode
+from ext4.fsck import fsck
+from ext4.inode import get_inode, get_inode_size
+from ext4.ls import ls, path_to_inode
+from ext4.mv import mv
+from ext4.progress import FsckProgress, get_peak_rss
+from ext4.rm import rm
+
+RESULTS_VERSION = 1
+# files looked up, copied, moved and removed by one run
+SAMPLE_FILES = 200
+
+Benchmark = NamedTuple('Benchmark', [('name', str), ('setup', Callable), ('run', Callable)])
+
+
+def read_proc_io() -> Optional[Dict[str, int]]:
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except OSError:  # not Linux
+        return None
+
+
+def reset_peak_rss():
+    """
+    Restart the peak RSS (VmHWM) from the current RSS, Linux only
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def read_peak_rss() -> Optional[int]:
+    """
+    Returns:
+        Peak RSS in KiB since `reset_peak_rss`, or of the whole process where it can't be reset
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    peak_rss = get_peak_rss()
+    return peak_rss and peak_rss['self']
+
+
+def get_sample_paths(image: GeneratedImage, spec: dict) -> List[PurePosixPath]:
+    dirs = plan_tree(spec['fanout'], spec['depth'])
+    step = max(image.files // SAMPLE_FILES, 1)
+    return [PurePosixPath(get_file_path(dirs, file_idx)) for file_idx in range(0, image.files, step)][:SAMPLE_FILES]
+
+
+def bench_path_to_inode(img, paths: List[PurePosixPath]) -> dict:
+    for path in paths:
+        path_to_inode(*img, path)
+    return {'items': len(paths)}
+
+
+def bench_ls_recursive(img) -> dict:
+    def count(entries) -> int:
+        return sum(1 + count(children) for _, _, children in entries)
+
+    return {'items': count(ls(*img, 2, recursively=True))}
+
+
+def bench_cat(img, paths: List[PurePosixPath]) -> dict:
+    size = 0
+    with open(os.devnull, 'wb') as devnull:
+        for path in paths:
+            inode_no = path_to_inode(*img, path)
+            copy_inode(*img, inode_no, devnull)
+            size += get_inode_size(get_inode(*img, inode_no))
+    return {'items': len(paths), 'bytes': size}
+
+
+def bench_dump(img, paths: List[PurePosixPath], dest_dir: str) -> dict:
+    for idx, path in enumerate(paths):
+        dump(*img, path_to_inode(*img, path), os.path.join(dest_dir, str(idx)))
+    return {'items': len(paths), 'bytes': sum(entry.stat().st_size for entry in os.scandir(dest_dir))}
+
+
+def bench_fsck(img) -> dict:
+    progress = FsckProgress()
+    exceptions = list(fsck(img, 1, progress))
+    return {'exceptions': len(exceptions),
+            'passes': {metrics.pass_no: round(metrics.seconds, 6) for metrics in progress.passes}}
+
+
+def bench_mv(img, paths: List[PurePosixPath]) -> dict:
+    for path in paths:
+        mv(img, path, path.with_name('moved_' + path.name[len('file_'):]))
+    return {'items': len(paths)}
+
+
+def bench_rm(img, paths: List[PurePosixPath]) -> dict:
+    for path in paths:
+        rm(img, path)
+    return {'items': len(paths)}
+
+
+def get_benchmarks(image: GeneratedImage, paths: List[PurePosixPath], work_dir: str) -> List[Benchmark]:
+    """
+    `setup` returns the image to open (a fresh copy for the writing benchmarks) and more arguments of `run`,
+    out of the timed part. `run` returns extra metrics
+    """
+    def open_image():
+        return open_img(image.path), (paths,)
+
+    def open_copy():
+        copy_path = os.path.join(work_dir, 'copy.img')
+        shutil.copyfile(image.path, copy_path)
+        return open_img(copy_path, True), (paths,)
+
+    def open_image_and_dest():
+        dest_dir = os.path.join(work_dir, 'dump')
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.mkdir(dest_dir)
+        return open_img(image.path), (paths, dest_dir)
+
+    def open_image_only():
+        return open_img(image.path), ()
+
+    return [
+        Benchmark('path_to_inode', open_image, bench_path_to_inode),
+        Benchmark('ls -r', open_image_only, bench_ls_recursive),
+        Benchmark('cat', open_image, bench_cat),
+        Benchmark('dump', open_image_and_dest, bench_dump),
+        Benchmark('fsck', open_image_only, bench_fsck),
+        Benchmark('mv', open_copy, bench_mv),
+        Benchmark('rm', open_copy, bench_rm),
+    ]
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        img_context, args = benchmark.setup()
+        with img_context as img:
+            io_before = read_proc_io()
+            reset_peak_rss()
+            start = time.perf_counter()
+            extra = benchmark.run(img, *args)
+            seconds = time.perf_counter() - start
+            peak_rss = read_peak_rss()
+            io_after = read_proc_io()
+        runs.append(seconds)
+
+    result = {'seconds': round(min(runs), 6), 'runs': [round(seconds, 6) for seconds in runs],
+              'peak_rss_kib': peak_rss}
+    if io_before is not None and io_after is not None:
+        result['syscalls'] = {'read': io_after['syscr'] - io_before['syscr'],
+                              'write': io_after['syscw'] - io_before['syscw']}
+        result['io_bytes'] = {'read': io_after['rchar'] - io_before['rchar'],
+                              'write': io_after['wchar'] - io_before['wchar']}
+    result.update(extra)
+    if 'bytes' in extra and result['seconds'] > 0:
+        result['bytes_per_second'] = round(extra['bytes'] / result['seconds'], 1)
+    return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Print time and syscall changes against `baseline` results
+
+    Returns:
+        Names of benchmarks slower (or doing more syscalls) by more than `threshold`
+    """
+    regressions = []
+    if baseline.get('spec') != results['spec']:
+        print('warning: the baseline was run on another image spec: {}'.format(baseline.get('spec')))
+    for name, result in results['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.
+        line = '{: <16} {: >10.4f}s -> {: >10.4f}s  {:+7.1%}'.format(name, old['seconds'], result['seconds'],
+                                                                  ratio - 1)
+        regressed = ratio > 1 + threshold
+        if 'syscalls' in result and 'syscalls' in old:
+            old_calls, calls = sum(old['syscalls'].values()), sum(result['syscalls'].values())
+            line += '  syscalls {} -> {}'.format(old_calls, calls)
+            regressed |= calls > old_calls * (1 + threshold)
+        if regressed:
+            line += '  REGRESSION'
+            regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tools on a generated image')
+    add_spec_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the best time is kept')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Compare with results of a previous run (baseline)')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown reported as a regression (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', help='Run only these benchmarks')
+    args = parser.parse_args()
+    spec = get_spec(args)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        start = time.perf_counter()
+        image = make_image(os.path.join(work_dir, 'bench.img'), **spec)
+        print('generated {} files in {} directories ({} blocks) in {:.1f}s'.format(
+            image.files, image.directories, image.blocks, time.perf_counter() - start))
+        paths = get_sample_paths(image, spec)
+        results = {
+            'version': RESULTS_VERSION,
+            'spec': spec,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': {},
+        }
+        for benchmark in get_benchmarks(image, paths, work_dir):
+            if args.only and benchmark.name not in args.only:
+                continue
+            result = measure(benchmark, args.repeat)
+            results['benchmarks'][benchmark.name] = result
+            print('{: <16} {: >10.4f}s  {}'.format(benchmark.name, result['seconds'], ', '.join(
+                '{}: {}'.format(key, value) for key, value in result.items()
+                if key not in ('seconds', 'runs', 'passes'))))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
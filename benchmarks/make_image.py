@@ -0,0 +1,556 @@
+"""
+Generator of valid ext4 images with a synthetic tree, to benchmark at scale. Pure Python, no mkfs needed.
+
+Layout: 4 KiB blocks, 256-byte inodes, features dir_index, filetype, extent, 64bit, sparse_super, large_file,
+dir_nlink, extra_isize and metadata_csum (no journal, no flex_bg, no resize inode). Directories form a tree of
+`depth` levels with `fanout` subdirectories each, files are spread over all of them. Every file gets
+`fragments` extents separated by free blocks and an extent tree of at least `extent_depth` levels. Directories
+of more than one block are indexed (one level htree) unless `htree` is off. The result passes `e2fsck -fn`.
+
+Usage: python -m benchmarks.make_image IMAGE [--files N] [--fanout N] [--depth N] [--file-size BYTES]
+                                             [--fragments N] [--extent-depth N] [--no-htree] [--no-fill]
+"""
+import argparse
+import os
+from hashlib import blake2b
+from struct import pack, pack_into
+from typing import List, NamedTuple, Tuple, Iterator
+
+from crc32c import crc32c
+
+from ext4.bitmap import set_range, count_set_bits
+from ext4.htree import dirhash, DX_HASH_HALF_MD4
+from ext4.inode import calc_inode_checksum, get_inode_checksum_seed
+
+BLOCK_SIZE = 4096
+BLOCKS_PER_GROUP = BLOCK_SIZE * 8
+INODE_SIZE = 256
+INODES_PER_BLOCK = BLOCK_SIZE // INODE_SIZE
+EXTRA_ISIZE = 32
+DESC_SIZE = 64
+ROOT_INO = 2
+LOST_FOUND_INO = 11
+FIRST_INO = 11
+TIMESTAMP = 1_700_000_000
+
+COMPAT_DIR_INDEX = 0x20
+INCOMPAT = 0x2 | 0x40 | 0x80  # filetype, extent, 64bit
+RO_COMPAT = 0x1 | 0x2 | 0x20 | 0x40 | 0x400  # sparse_super, large_file, dir_nlink, extra_isize, metadata_csum
+EXT2_FLAGS_SIGNED_HASH = 0x1
+BG_INODE_ZEROED = 0x4
+
+EXTENTS_FL = 0x80000
+INDEX_FL = 0x1000
+S_IFDIR = 0o040000
+S_IFREG = 0o100000
+FT_REG_FILE = 1
+FT_DIR = 2
+
+EXTENT_MAGIC = 0xF30A
+EXTENTS_IN_INODE = 4
+# (block - header - ext4_extent_tail) / sizeof(ext4_extent)
+EXTENTS_PER_BLOCK = (BLOCK_SIZE - 12 - 4) // 12
+MAX_EXTENT_LEN = 32768
+# dirent tail of leaf blocks and dx_tail of the htree root
+DIR_TAIL_SIZE = 12
+DX_LIMIT = (BLOCK_SIZE - 0x20 - 8) // 8
+
+MASK = 0xff_ff_ff_ff
+
+DEFAULT_SPEC = dict(files=1000, fanout=8, depth=2, file_size=16 * 1024, fragments=1, extent_depth=0, htree=True,
+                    fill=True, seed=0)
+
+GeneratedImage = NamedTuple('GeneratedImage', [('path', str), ('groups', int), ('blocks', int), ('inodes', int),
+                                               ('directories', int), ('files', int), ('deepest_file', str),
+                                               ('deepest_dir', str)])
+
+
+class OutOfSpace(Exception):
+    pass
+
+
+class BlockAllocator:
+    """
+    Hands out data blocks in ascending order, around group metadata
+    """
+
+    def __init__(self, groups: int, data_starts: List[int]):
+        self.groups = groups
+        self.data_starts = data_starts
+        self.group = 0
+        self.next_block = data_starts[0]
+        # used block bitmaps of groups, metadata included
+        self.bitmaps = [bytearray(BLOCKS_PER_GROUP // 8) for _ in range(groups)]
+        for group, data_start in enumerate(data_starts):
+            self.mark(group * BLOCKS_PER_GROUP, data_start - group * BLOCKS_PER_GROUP)
+
+    def mark(self, start: int, length: int):
+        group, offset = divmod(start, BLOCKS_PER_GROUP)
+        set_range(self.bitmaps[group], offset, length)
+
+    def allocate(self, count: int) -> List[Tuple[int, int]]:
+        """
+        Returns:
+            `(start, length)` runs of `count` blocks, split at group metadata
+        """
+        runs = []
+        while count:
+            group_end = (self.group + 1) * BLOCKS_PER_GROUP
+            if self.next_block >= group_end:
+                self.group += 1
+                if self.group >= self.groups:
+                    raise OutOfSpace()
+                self.next_block = self.data_starts[self.group]
+                continue
+            length = min(count, group_end - self.next_block, MAX_EXTENT_LEN)
+            runs.append((self.next_block, length))
+            self.mark(self.next_block, length)
+            self.next_block += length
+            count -= length
+        return runs
+
+    def allocate_block(self) -> int:
+        (block, _), = self.allocate(1)
+        return block
+
+    def skip(self, count: int):
+        self.next_block += count
+
+    def used_blocks(self, group: int) -> int:
+        return count_set_bits(self.bitmaps[group])
+
+
+def has_super(group: int) -> bool:
+    """
+    sparse_super: groups 0, 1 and powers of 3, 5 and 7 hold superblock and group descriptor copies
+    """
+    if group <= 1:
+        return True
+    for base in (3, 5, 7):
+        power = base
+        while power < group:
+            power *= base
+        if power == group:
+            return True
+    return False
+
+
+def plan_tree(fanout: int, depth: int) -> List[Tuple[int, str]]:
+    """
+    Returns:
+        Directories in breadth-first order as `(parent index, name)`, the root first (parent -1)
+    """
+    dirs = [(-1, '')]
+    level = [0]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for k in range(fanout):
+                dirs.append((parent, 'dir_{}'.format(k)))
+                next_level.append(len(dirs) - 1)
+        level = next_level
+    return dirs
+
+
+def get_dir_path(dirs: List[Tuple[int, str]], idx: int) -> str:
+    parts = []
+    while idx > 0:
+        idx, name = dirs[idx]
+        parts.append(name)
+    return '/' + '/'.join(reversed(parts))
+
+
+def get_file_path(dirs: List[Tuple[int, str]], file_idx: int) -> str:
+    """
+    Returns:
+        Path of file `file_idx`, files are dealt to directories in turn
+    """
+    return '{}/file_{}'.format(get_dir_path(dirs, file_idx % len(dirs)).rstrip('/'), file_idx)
+
+
+def pack_dir_entry(block: bytearray, offset: int, inode: int, name: bytes, file_type: int, rec_len: int):
+    pack_into('<LHBB', block, offset, inode, rec_len, len(name), file_type)
+    block[offset + 8:offset + 8 + len(name)] = name
+
+
+def dir_entry_size(name: bytes) -> int:
+    return (8 + len(name) + 3) // 4 * 4
+
+
+def pack_dir_blocks(entries: List[Tuple[int, bytes, int]]) -> Iterator[Tuple[bytearray, int]]:
+    """
+    Fill leaf blocks with `(inode, name, file_type)` entries in order, the last entry of a block spans up to
+    the dirent tail.
+
+    Returns:
+        Iterator over `(block, index of its first entry)`
+    """
+    end = BLOCK_SIZE - DIR_TAIL_SIZE
+    block, offset, last_offset, first = bytearray(BLOCK_SIZE), 0, None, 0
+    for idx, (inode, name, file_type) in enumerate(entries):
+        size = dir_entry_size(name)
+        if offset + size > end:
+            pack_into('<H', block, last_offset + 4, end - last_offset)
+            yield block, first
+            block, offset, first = bytearray(BLOCK_SIZE), 0, idx
+        pack_dir_entry(block, offset, inode, name, file_type, size)
+        last_offset, offset = offset, offset + size
+    if last_offset is None:  # an empty leaf: one unused entry
+        pack_dir_entry(block, 0, 0, b'', 0, end)
+    else:
+        pack_into('<H', block, last_offset + 4, end - last_offset)
+    yield block, first
+
+
+def seal_dir_block(block: bytearray, inode_seed: int):
+    end = BLOCK_SIZE - DIR_TAIL_SIZE
+    pack_into('<LHBBL', block, end, 0, DIR_TAIL_SIZE, 0, 0xDE, ~crc32c(bytes(block[:end]), inode_seed) & MASK)
+
+
+def build_dir(inode_no: int, parent_no: int, children: List[Tuple[int, bytes, int]], htree: bool,
+              hash_seed: bytes, inode_seed: int) -> Tuple[List[bytearray], bool]:
+    """
+    Returns:
+        Directory blocks in logical order and whether they are an htree
+    """
+    dots = [(inode_no, b'.', FT_DIR), (parent_no, b'..', FT_DIR)]
+    blocks = [block for block, _ in pack_dir_blocks(dots + children)]
+    if len(blocks) == 1 or not htree:
+        for block in blocks:
+            seal_dir_block(block, inode_seed)
+        return blocks, False
+
+    hashes = [dirhash(name, DX_HASH_HALF_MD4, hash_seed)[0] for _, name, _ in children]
+    order = sorted(range(len(children)), key=hashes.__getitem__)
+    leaves = list(pack_dir_blocks([children[idx] for idx in order]))
+    if len(leaves) > DX_LIMIT:
+        raise ValueError('directory {} needs {} leaves, more than a one level htree holds'.format(inode_no,
+                                                                                              len(leaves)))
+    root = bytearray(BLOCK_SIZE)
+    pack_dir_entry(root, 0, inode_no, b'.', FT_DIR, 12)
+    pack_dir_entry(root, 12, parent_no, b'..', FT_DIR, BLOCK_SIZE - 12)
+    pack_into('<LBBBB', root, 0x18, 0, DX_HASH_HALF_MD4, 8, 0, 0)  # dx_root_info
+    pack_into('<HHL', root, 0x20, DX_LIMIT, len(leaves), 1)
+    for leaf_idx in range(1, len(leaves)):
+        first = order[leaves[leaf_idx][1]]
+        leaf_hash = hashes[first]
+        # a hash continued from the previous leaf is flagged by the low bit
+        if hashes[order[leaves[leaf_idx][1] - 1]] == leaf_hash:
+            leaf_hash |= 1
+        pack_into('<LL', root, 0x20 + 8 * leaf_idx, leaf_hash, 1 + leaf_idx)
+    tail = 0x20 + 8 * DX_LIMIT
+    crc = crc32c(bytes(root[:0x20 + 8 * len(leaves)]) + bytes(8), inode_seed)
+    pack_into('<L', root, tail + 4, ~crc & MASK)
+    for leaf, _ in leaves:
+        seal_dir_block(leaf, inode_seed)
+    return [root] + [leaf for leaf, _ in leaves], True
+
+
+def build_extent_tree(extents: List[Tuple[int, int, int]], min_depth: int, allocator: BlockAllocator,
+                      inode_seed: int) -> Tuple[bytes, List[Tuple[int, bytearray]]]:
+    """
+    Args:
+        extents: `(logical block, physical block, length)` in logical order
+
+    Returns:
+        i_block (60 bytes) and `(block number, raw)` of tree blocks
+    """
+    entries = [pack('<LHHL', lblk, length, phys >> 32, phys & MASK) for lblk, phys, length in extents]
+    first_lblks = [lblk for lblk, _, _ in extents]
+    depth, tree_blocks = 0, []
+    while entries and (len(entries) > EXTENTS_IN_INODE or depth < min_depth):
+        upper_entries, upper_first_lblks = [], []
+        for start in range(0, len(entries), EXTENTS_PER_BLOCK):
+            chunk = entries[start:start + EXTENTS_PER_BLOCK]
+            block_no = allocator.allocate_block()
+            node = bytearray(BLOCK_SIZE)
+            pack_into('<HHHHL', node, 0, EXTENT_MAGIC, len(chunk), EXTENTS_PER_BLOCK, depth, 0)
+            node[12:12 + 12 * len(chunk)] = b''.join(chunk)
+            tail = 12 + 12 * EXTENTS_PER_BLOCK
+            pack_into('<L', node, tail, ~crc32c(bytes(node[:tail]), inode_seed) & MASK)
+            tree_blocks.append((block_no, node))
+            upper_entries.append(pack('<LLHH', first_lblks[start], block_no & MASK, block_no >> 32, 0))
+            upper_first_lblks.append(first_lblks[start])
+        entries, first_lblks = upper_entries, upper_first_lblks
+        depth += 1
+    i_block = pack('<HHHHL', EXTENT_MAGIC, len(entries), EXTENTS_IN_INODE, depth, 0) + b''.join(entries)
+    return i_block.ljust(60, b'\0'), tree_blocks
+
+
+def pack_inode(inode_no: int, seed: int, mode: int = 0, size: int = 0, links: int = 0, blocks: int = 0,
+               flags: int = 0, i_block: bytes = bytes(60)) -> bytearray:
+    """
+    Args:
+        blocks: number of filesystem blocks (data and extent tree)
+    """
+    raw = bytearray(INODE_SIZE)
+    timestamp = TIMESTAMP if mode else 0
+    pack_into('<HHLLLLLHHLLL', raw, 0, mode, 0, size & MASK, timestamp, timestamp, timestamp, 0, 0, links,
+              blocks * (BLOCK_SIZE // 512), flags, 0)
+    raw[0x28:0x64] = i_block
+    pack_into('<LLL', raw, 0x64, 0, 0, size >> 32)
+    pack_into('<H', raw, 0x80, EXTRA_ISIZE)
+    pack_into('<L', raw, 0x90, timestamp)  # i_crtime
+    csum = calc_inode_checksum(seed, inode_no, 0, raw, True)
+    pack_into('<H', raw, 0x7c, csum & 0xffff)
+    pack_into('<H', raw, 0x82, csum >> 16)
+    return raw
+
+
+class ImageWriter:
+    """
+    Writes inodes in ascending order, one inode table at a time
+    """
+
+    def __init__(self, fd: int, inodes_per_group: int, inode_tables: List[int]):
+        self.fd = fd
+        self.inodes_per_group = inodes_per_group
+        self.inode_tables = inode_tables
+        self.group = 0
+        self.table = bytearray(inodes_per_group * INODE_SIZE)
+
+    def write_inode(self, inode_no: int, raw: bytes):
+        group, idx = divmod(inode_no - 1, self.inodes_per_group)
+        if group != self.group:
+            self.flush()
+            self.group = group
+        self.table[idx * INODE_SIZE:(idx + 1) * INODE_SIZE] = raw
+
+    def flush(self):
+        os.pwrite(self.fd, self.table, self.inode_tables[self.group] * BLOCK_SIZE)
+        self.table = bytearray(len(self.table))
+
+    def write_blocks(self, block_no: int, data: bytes):
+        os.pwrite(self.fd, data, block_no * BLOCK_SIZE)
+
+
+def estimate_groups(files: int, dirs: int, file_size: int, fragments: int, extent_depth: int) -> int:
+    file_blocks = -(-file_size // BLOCK_SIZE)
+    extents = min(fragments, file_blocks)
+    tree_blocks = (-(-extents // EXTENTS_PER_BLOCK) + extent_depth) if extents > EXTENTS_IN_INODE or extent_depth \
+        else 0
+    dir_blocks = -(-(files + dirs) * 24 // (BLOCK_SIZE - 2 * DIR_TAIL_SIZE)) + 2 * dirs
+    blocks = files * (file_blocks + extents + tree_blocks) + dir_blocks + 16
+    inode_table_blocks = -(-(files + dirs + FIRST_INO) // INODES_PER_BLOCK)
+    return -(-(blocks + inode_table_blocks) * 5 // 4 // (BLOCKS_PER_GROUP - 64)) + 1
+
+
+def make_image(path: str, files: int = DEFAULT_SPEC['files'], fanout: int = DEFAULT_SPEC['fanout'],
+               depth: int = DEFAULT_SPEC['depth'], file_size: int = DEFAULT_SPEC['file_size'],
+               fragments: int = DEFAULT_SPEC['fragments'], extent_depth: int = DEFAULT_SPEC['extent_depth'],
+               htree: bool = DEFAULT_SPEC['htree'], fill: bool = DEFAULT_SPEC['fill'],
+               seed: int = DEFAULT_SPEC['seed'], groups: int = None) -> GeneratedImage:
+    """
+    Write a new image to `path`, sized to fit (the estimate of `groups` grows until everything fits).
+
+    Args:
+        fragments: extents per file (up to one per block), separated by a free block
+        extent_depth: minimal depth of file extent trees (0 keeps up to 4 extents in the inode)
+        fill: write file content (a pattern of the file number), otherwise data blocks are holes of the image
+        seed: UUID and directory hash seed source
+    """
+    dirs = plan_tree(fanout, depth)
+    groups = groups or estimate_groups(files, len(dirs), file_size, fragments, extent_depth)
+    while True:
+        try:
+            return write_image(path, dirs, files, file_size, fragments, extent_depth, htree, fill, seed, groups)
+        except OutOfSpace:
+            groups += max(1, groups // 2)
+
+
+def write_image(path: str, dirs: List[Tuple[int, str]], files: int, file_size: int, fragments: int,
+                extent_depth: int, htree: bool, fill: bool, seed: int, groups: int) -> GeneratedImage:
+    ndirs = len(dirs)
+    inodes_used = FIRST_INO - 1 + ndirs + files  # lost+found is inode 11, the root is 2
+    inodes_per_group = max(INODES_PER_BLOCK, -(-inodes_used // groups // INODES_PER_BLOCK) * INODES_PER_BLOCK)
+    if inodes_per_group > BLOCKS_PER_GROUP:
+        raise OutOfSpace()
+    inode_table_blocks = inodes_per_group // INODES_PER_BLOCK
+    gdt_blocks = -(-groups * DESC_SIZE // BLOCK_SIZE)
+
+    digest = blake2b(pack('<Q', seed), digest_size=32).digest()
+    uuid, hash_seed = digest[:16], digest[16:]
+    fs_seed = crc32c(uuid)  # get_checksum_seed
+
+    block_bitmaps, inode_bitmaps, inode_tables, data_starts = [], [], [], []
+    for group in range(groups):
+        block = group * BLOCKS_PER_GROUP + (1 + gdt_blocks if has_super(group) else 0)
+        block_bitmaps.append(block)
+        inode_bitmaps.append(block + 1)
+        inode_tables.append(block + 2)
+        data_starts.append(block + 2 + inode_table_blocks)
+    allocator = BlockAllocator(groups, data_starts)
+
+    def dir_inode_no(idx: int) -> int:
+        return ROOT_INO if idx == 0 else LOST_FOUND_INO + idx
+
+    first_file_ino = LOST_FOUND_INO + ndirs
+    subdirs = [[] for _ in dirs]
+    for idx, (parent, _) in enumerate(dirs[1:], 1):
+        subdirs[parent].append(idx)
+    used_dirs = [0] * groups
+
+    with open(path, 'wb') as f:
+        f.truncate(groups * BLOCKS_PER_GROUP * BLOCK_SIZE)
+        writer = ImageWriter(f.fileno(), inodes_per_group, inode_tables)
+
+        def write_dir(inode_no: int, parent_no: int, children: List[Tuple[int, bytes, int]]):
+            inode_seed = get_inode_checksum_seed(fs_seed, inode_no, 0)
+            blocks, indexed = build_dir(inode_no, parent_no, children, htree, hash_seed, inode_seed)
+            extents, lblk = [], 0
+            for start, length in allocator.allocate(len(blocks)):
+                extents.append((lblk, start, length))
+                writer.write_blocks(start, b''.join(blocks[lblk:lblk + length]))
+                lblk += length
+            i_block, tree_blocks = build_extent_tree(extents, 0, allocator, inode_seed)
+            for block_no, node in tree_blocks:
+                writer.write_blocks(block_no, node)
+            links = 2 + sum(1 for _, _, file_type in children if file_type == FT_DIR)
+            writer.write_inode(inode_no, pack_inode(
+                inode_no, fs_seed, S_IFDIR | 0o755, len(blocks) * BLOCK_SIZE, links, len(blocks) + len(tree_blocks),
+                EXTENTS_FL | (INDEX_FL if indexed else 0), i_block))
+            used_dirs[(inode_no - 1) // inodes_per_group] += 1
+
+        for inode_no in range(1, FIRST_INO):
+            if inode_no != ROOT_INO:
+                writer.write_inode(inode_no, pack_inode(inode_no, fs_seed))
+            else:
+                children = [(LOST_FOUND_INO, b'lost+found', FT_DIR)]
+                children += [(dir_inode_no(sub), dirs[sub][1].encode(), FT_DIR) for sub in subdirs[0]]
+                children += [(first_file_ino + j, 'file_{}'.format(j).encode(), FT_REG_FILE)
+                             for j in range(0, files, ndirs)]
+                write_dir(ROOT_INO, ROOT_INO, children)
+        write_dir(LOST_FOUND_INO, ROOT_INO, [])
+
+        for idx in range(1, ndirs):
+            children = [(dir_inode_no(sub), dirs[sub][1].encode(), FT_DIR) for sub in subdirs[idx]]
+            children += [(first_file_ino + j, 'file_{}'.format(j).encode(), FT_REG_FILE)
+                         for j in range(idx, files, ndirs)]
+            write_dir(dir_inode_no(idx), dir_inode_no(dirs[idx][0]), children)
+
+        file_blocks = -(-file_size // BLOCK_SIZE)
+        pieces = max(1, min(fragments, file_blocks))
+        for j in range(files):
+            inode_no = first_file_ino + j
+            inode_seed = get_inode_checksum_seed(fs_seed, inode_no, 0)
+            pattern = ('{:08}\n'.format(j).encode() * (BLOCK_SIZE // 9 + 1))[:BLOCK_SIZE]
+            extents, lblk = [], 0
+            for piece in range(pieces if file_blocks else 0):
+                length = file_blocks // pieces + (piece < file_blocks % pieces)
+                for start, run_length in allocator.allocate(length):
+                    extents.append((lblk, start, run_length))
+                    lblk += run_length
+                    if fill:
+                        for chunk_start in range(0, run_length, 256):
+                            chunk_length = min(256, run_length - chunk_start)
+                            writer.write_blocks(start + chunk_start, pattern * chunk_length)
+                if pieces > 1:
+                    allocator.skip(1)
+            i_block, tree_blocks = build_extent_tree(extents, extent_depth, allocator, inode_seed)
+            for block_no, node in tree_blocks:
+                writer.write_blocks(block_no, node)
+            writer.write_inode(inode_no, pack_inode(inode_no, fs_seed, S_IFREG | 0o644, file_size, 1,
+                                                    file_blocks + len(tree_blocks), EXTENTS_FL, i_block))
+        writer.flush()
+
+        write_metadata(writer, groups, inodes_per_group, inodes_used, gdt_blocks, allocator, block_bitmaps,
+                       inode_bitmaps, inode_tables, used_dirs, uuid, hash_seed)
+
+    deepest = ndirs - 1
+    return GeneratedImage(path, groups, groups * BLOCKS_PER_GROUP, groups * inodes_per_group, ndirs, files,
+                          get_file_path(dirs, deepest) if deepest < files else None, get_dir_path(dirs, deepest))
+
+
+def write_metadata(writer: ImageWriter, groups: int, inodes_per_group: int, inodes_used: int, gdt_blocks: int,
+                   allocator: BlockAllocator, block_bitmaps: List[int], inode_bitmaps: List[int],
+                   inode_tables: List[int], used_dirs: List[int], uuid: bytes, hash_seed: bytes):
+    """
+    Bitmaps, group descriptors and superblock copies, once all inodes and blocks are allocated
+    """
+    gdt = bytearray(gdt_blocks * BLOCK_SIZE)
+    free_blocks_total = free_inodes_total = 0
+    for group in range(groups):
+        inode_bitmap = bytearray(BLOCK_SIZE)
+        used_inodes = min(max(inodes_used - group * inodes_per_group, 0), inodes_per_group)
+        set_range(inode_bitmap, 0, used_inodes)
+        set_range(inode_bitmap, inodes_per_group, BLOCK_SIZE * 8 - inodes_per_group)  # padding past the table
+        block_bitmap = allocator.bitmaps[group]
+        writer.write_blocks(block_bitmaps[group], block_bitmap)
+        writer.write_blocks(inode_bitmaps[group], inode_bitmap)
+
+        free_blocks = BLOCKS_PER_GROUP - allocator.used_blocks(group)
+        free_inodes = inodes_per_group - used_inodes
+        free_blocks_total += free_blocks
+        free_inodes_total += free_inodes
+        block_bitmap_csum = ~crc32c(uuid + bytes(block_bitmap)) & MASK
+        inode_bitmap_csum = ~crc32c(uuid + bytes(inode_bitmap[:inodes_per_group // 8])) & MASK
+        offset = group * DESC_SIZE
+        pack_into('<LLLHHHHLHHHH', gdt, offset, block_bitmaps[group], inode_bitmaps[group], inode_tables[group],
+                  free_blocks & 0xffff, free_inodes & 0xffff, used_dirs[group] & 0xffff, BG_INODE_ZEROED, 0,
+                  block_bitmap_csum & 0xffff, inode_bitmap_csum & 0xffff, 0, 0)
+        pack_into('<LLLHHHHLHH', gdt, offset + 0x20, 0, 0, 0, free_blocks >> 16, free_inodes >> 16,
+                  used_dirs[group] >> 16, 0, 0, block_bitmap_csum >> 16, inode_bitmap_csum >> 16)
+        bg_csum = ~crc32c(uuid + pack('<L', group) + bytes(gdt[offset:offset + DESC_SIZE])) & 0xffff
+        pack_into('<H', gdt, offset + 0x1e, bg_csum)
+
+    for group in range(groups):
+        if not has_super(group):
+            continue
+        sb = pack_superblock(group, groups, inodes_per_group, free_blocks_total, free_inodes_total, uuid, hash_seed)
+        first_block = group * BLOCKS_PER_GROUP
+        if group == 0:
+            os.pwrite(writer.fd, sb, 1024)
+        else:
+            writer.write_blocks(first_block, sb)
+        writer.write_blocks(first_block + 1, gdt)
+
+
+def pack_superblock(group: int, groups: int, inodes_per_group: int, free_blocks: int, free_inodes: int,
+                    uuid: bytes, hash_seed: bytes) -> bytearray:
+    sb = bytearray(1024)
+    blocks = groups * BLOCKS_PER_GROUP
+    pack_into('<LLLLLLLLLLLLLHHHHHHLLLLHHLHHLLL', sb, 0,
+              groups * inodes_per_group, blocks & MASK, 0, free_blocks & MASK, free_inodes,
+              0, BLOCK_SIZE.bit_length() - 11, BLOCK_SIZE.bit_length() - 11, BLOCKS_PER_GROUP, BLOCKS_PER_GROUP,
+              inodes_per_group, 0, TIMESTAMP,  # s_mtime, s_wtime
+              0, 0xffff, 0xEF53, 1, 1, 0,  # mount counts, magic, state clean, errors continue, minor rev
+              TIMESTAMP, 0, 0, 1, 0, 0,  # last check, interval, creator Linux, rev 1 (dynamic), resuid/gid
+              FIRST_INO, INODE_SIZE, group, COMPAT_DIR_INDEX, INCOMPAT, RO_COMPAT)
+    sb[0x68:0x78] = uuid
+    sb[0xEC:0xFC] = hash_seed
+    pack_into('<BBH', sb, 0xFC, DX_HASH_HALF_MD4, 0, DESC_SIZE)
+    pack_into('<L', sb, 0x108, TIMESTAMP)  # s_mkfs_time
+    pack_into('<LLL', sb, 0x150, blocks >> 32, 0, free_blocks >> 32)
+    pack_into('<HHL', sb, 0x15C, EXTRA_ISIZE, EXTRA_ISIZE, EXT2_FLAGS_SIGNED_HASH)
+    pack_into('<B', sb, 0x175, 1)  # s_checksum_type: crc32c
+    pack_into('<L', sb, 0x3FC, ~crc32c(bytes(sb[:0x3FC])) & MASK)
+    return sb
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--files', type=int, default=DEFAULT_SPEC['files'])
+    parser.add_argument('--fanout', type=int, default=DEFAULT_SPEC['fanout'], help='Subdirectories per directory')
+    parser.add_argument('--depth', type=int, default=DEFAULT_SPEC['depth'], help='Levels of subdirectories')
+    parser.add_argument('--file-size', type=int, default=DEFAULT_SPEC['file_size'], help='Bytes per file')
+    parser.add_argument('--fragments', type=int, default=DEFAULT_SPEC['fragments'], help='Extents per file')
+    parser.add_argument('--extent-depth', type=int, default=DEFAULT_SPEC['extent_depth'],
+                        help='Minimal depth of file extent trees')
+    parser.add_argument('--no-htree', dest='htree', action='store_false', help='Linear directories only')
+    parser.add_argument('--no-fill', dest='fill', action='store_false', help="Don't write file content")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SPEC['seed'])
+
+
+def get_spec(args: argparse.Namespace) -> dict:
+    return {key: getattr(args, key) for key in DEFAULT_SPEC}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic ext4 image')
+    parser.add_argument('path')
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+    print(make_image(args.path, **get_spec(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Bitmap engine for block and inode bitmaps (bit `i` is bit `i % 8` of byte `i // 8`).
+
+Uses NumPy (`unpackbits`/`flatnonzero`) when it is installed and byte lookup tables otherwise.
+All functions accept any bytes-like object and an optional `limit`: number of meaningful bits
+(the last group of a filesystem has fewer blocks than its bitmap can describe).
+"""
+from typing import Iterator, Tuple, NamedTuple, List, Optional
+
+try:
+    import numpy
+except ImportError:  # optional
+    numpy = None
+
+# positions of set bits of every byte value, lowest first
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256))
+# number of set bits of every byte value, as a `bytes.translate` table
+POPCOUNT = bytes(len(bits) for bits in BYTE_BITS)
+
+BitmapDifference = NamedTuple('BitmapDifference', [('missing', List[Tuple[int, int]]),
+                                                   ('extra', List[Tuple[int, int]])])
+
+
+def get_bit(bitmap, idx: int) -> bool:
+    return bool(bitmap[idx // 8] >> (idx % 8) & 1)
+
+
+def set_bit(bitmap: bytearray, idx: int, value: bool) -> None:
+    mask = 1 << (idx % 8)
+    if value:
+        bitmap[idx // 8] |= mask
+    else:
+        bitmap[idx // 8] &= ~mask
+
+
+def set_range(bitmap: bytearray, start: int, length: int) -> None:
+    """
+    Set bits `[start, start + length)`, whole bytes at once
+    """
+    end = start + length
+    while start < end and start % 8:
+        set_bit(bitmap, start, True)
+        start += 1
+    whole_end = end - end % 8
+    if start < whole_end:
+        bitmap[start // 8:whole_end // 8] = b'\xff' * ((whole_end - start) // 8)
+        start = whole_end
+    while start < end:
+        set_bit(bitmap, start, True)
+        start += 1
+
+
+def iter_set_bits(bitmap, limit: int = None) -> Iterator[int]:
+    """
+    Returns:
+        Iterator over indexes of set bits in ascending order
+    """
+    bitmap = truncate(bitmap, limit)
+    if numpy is not None:
+        bits = unpack(bitmap, limit)
+        yield from numpy.flatnonzero(bits).tolist()
+        return
+
+    for byte_idx, byte in enumerate(bitmap):
+        if byte:
+            for bit in BYTE_BITS[byte]:
+                idx = byte_idx * 8 + bit
+                if limit is not None and idx >= limit:
+                    return
+                yield idx
+
+
+def count_set_bits(bitmap, limit: int = None) -> int:
+    bitmap = truncate(bitmap, limit)
+    # mask the last byte only if the limit falls inside it (not for an empty or shorter bitmap)
+    if limit is not None and limit < len(bitmap) * 8:
+        last = bitmap[-1] & ((1 << limit % 8) - 1)
+        return count_set_bits(bitmap[:-1]) + POPCOUNT[last]
+    if numpy is not None:
+        return int(numpy.count_nonzero(unpack(bitmap)))
+    return sum(bytes(bitmap).translate(POPCOUNT))
+
+
+def iter_runs(bitmap, value: bool = True, limit: int = None) -> Iterator[Tuple[int, int]]:
+    """
+    Returns:
+        Iterator over `(start, length)` of maximal runs of bits equal to `value` (used or free ranges)
+    """
+    bitmap = truncate(bitmap, limit)
+    end = len(bitmap) * 8 if limit is None else min(limit, len(bitmap) * 8)
+    if numpy is not None:
+        bits = unpack(bitmap, end) == value
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], bits, [False])).astype(numpy.int8)))
+        for start, stop in zip(edges[::2].tolist(), edges[1::2].tolist()):
+            yield start, stop - start
+        return
+
+    full, empty = (0xff, 0x00) if value else (0x00, 0xff)
+    start = None
+    for byte_idx, byte in enumerate(bitmap):
+        if byte == full:
+            if start is None:
+                start = byte_idx * 8
+        elif byte == empty:
+            if start is not None:
+                yield start, byte_idx * 8 - start
+                start = None
+        else:
+            for bit in range(8):
+                idx = byte_idx * 8 + bit
+                if idx >= end:
+                    break
+                if bool(byte >> bit & 1) == value:
+                    if start is None:
+                        start = idx
+                elif start is not None:
+                    yield start, idx - start
+                    start = None
+    if start is not None and start < end:
+        yield start, end - start
+
+
+def compare_bitmaps(expected, actual, limit: int = None) -> BitmapDifference:
+    """
+    Returns:
+        Runs set only in `expected` (`missing` in `actual`) and runs set only in `actual` (`extra`)
+    """
+    size = len(expected)
+    expected_int = int.from_bytes(expected, 'little')
+    actual_int = int.from_bytes(actual[:size], 'little')
+    missing = (expected_int & ~actual_int).to_bytes(size, 'little')
+    extra = (actual_int & ~expected_int).to_bytes(size, 'little')
+    return BitmapDifference(list(iter_runs(missing, True, limit)), list(iter_runs(extra, True, limit)))
+
+
+def truncate(bitmap, limit: Optional[int]):
+    if limit is None:
+        return bitmap
+    return bitmap[:(limit + 7) // 8]
+
+
+def unpack(bitmap, limit: int = None):
+    bits = numpy.unpackbits(numpy.frombuffer(bitmap, dtype=numpy.uint8), bitorder='little')
+    return bits if limit is None else bits[:limit]
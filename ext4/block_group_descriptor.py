@@ -3,7 +3,8 @@ from typing import NamedTuple
 
 from crc32c import crc32c
 
-from ext4.core import Image
+from ext4.buffers import read_at
+from ext4.core import Image, get_gdt_offset
 from ext4.utils import get_block_size, merge_hi_lo
 
 
@@ -15,20 +16,20 @@ def read_block_bitmap(img: Image, bg: NamedTuple) -> bytes:
     sb_block_size = get_block_size(img)
     block_bitmap_start = merge_hi_lo(bg.bg_block_bitmap_hi, bg.bg_block_bitmap_lo)
     block_bitmap_length = img.sb.s_blocks_per_group // 8
-    img.buffer.seek(block_bitmap_start * sb_block_size)
-    return img.buffer.read(block_bitmap_length)
+    return read_at(img.buffer, block_bitmap_start * sb_block_size, block_bitmap_length)
 
 
 def read_inode_bitmap(img: Image, bg: NamedTuple) -> bytes:
     sb_block_size = get_block_size(img)
     inode_bitmap_start = merge_hi_lo(bg.bg_inode_bitmap_hi, bg.bg_inode_bitmap_lo)
     inode_bitmap_length = img.sb.s_inodes_per_group // 8
-    img.buffer.seek(inode_bitmap_start * sb_block_size)
-    return img.buffer.read(inode_bitmap_length)
+    return read_at(img.buffer, inode_bitmap_start * sb_block_size, inode_bitmap_length)
 
 
-def locate_block_group_descriptor(img: Image, bg_no: int):
-    sb_block_size = get_block_size(img)
-    img.buffer.seek(sb_block_size)
-    img.buffer.seek(img.sb.s_desc_size * bg_no, 1)
+def locate_block_group_descriptor(img: Image, bg_no: int) -> int:
+    """
+    Returns:
+        Offset of block group descriptor `bg_no`
+    """
+    return get_gdt_offset(img.sb) + img.sb.s_desc_size * bg_no
 
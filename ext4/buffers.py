@@ -0,0 +1,244 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import BinaryIO, NamedTuple, Union, Callable
+
+# kind of data being accessed (one of `io_stats.CATEGORIES`), for buffers counting I/O. Set by the `category`
+# argument of the functions below for the duration of one call: a reader suspended between reads (a generator)
+# can't leak it to others
+io_category = ContextVar('io_category', default=None)
+
+
+def read_at(buffer, offset: int, length: int, category: str = None) -> Union[bytes, memoryview]:
+    """
+    Read `length` bytes at absolute `offset`.
+
+    Returns a zero-copy `memoryview` when the buffer supports it (see `MmapBuffer`), `bytes` otherwise.
+    """
+    if category is not None:
+        return call_with_category(category, read_at, buffer, offset, length)
+    if hasattr(buffer, 'read_at'):
+        return buffer.read_at(offset, length)
+    buffer.seek(offset)
+    return buffer.read(length)
+
+
+def readinto_at(buffer, offset: int, view: memoryview, category: str = None) -> int:
+    """
+    Fill `view` with bytes at absolute `offset`, without allocating a new object.
+
+    Returns:
+        Number of bytes read
+    """
+    if category is not None:
+        return call_with_category(category, readinto_at, buffer, offset, view)
+    if hasattr(buffer, 'readinto_at'):
+        return buffer.readinto_at(offset, view)
+    buffer.seek(offset)
+    return buffer.readinto(view)
+
+
+def write_at(buffer, offset: int, data: bytes, category: str = None) -> int:
+    """
+    Write `data` at absolute `offset`.
+
+    Returns:
+        Number of bytes written
+    """
+    if category is not None:
+        return call_with_category(category, write_at, buffer, offset, data)
+    if hasattr(buffer, 'write_at'):
+        return buffer.write_at(offset, data)
+    buffer.seek(offset)
+    return buffer.write(data)
+
+
+def note_read(buffer, offset: int, length: int, category: str = None) -> None:
+    """
+    Account `length` bytes at `offset` read without the buffer, by the kernel from its file descriptor
+    (see `dump.copy_inode`). Only buffers counting I/O care.
+    """
+    if category is not None:
+        call_with_category(category, note_read, buffer, offset, length)
+    elif hasattr(buffer, 'note_read'):
+        buffer.note_read(offset, length)
+
+
+def call_with_category(category: str, func: Callable, *args):
+    token = io_category.set(category)
+    try:
+        return func(*args)
+    finally:
+        io_category.reset(token)
+
+
+class FileBuffer:
+    """
+    Positional wrapper over an image file: `read_at`, `readinto_at` and `write_at` are `os.pread`, `os.preadv`
+    and `os.pwrite`. There is no file position to share, so one buffer can be used from many threads.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.name = file.name
+        self._file = file
+        self._fd = file.fileno()
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def writable(self) -> bool:
+        return self._file.writable()
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        return os.pread(self._fd, length, offset)
+
+    def readinto_at(self, offset: int, view: memoryview) -> int:
+        return os.preadv(self._fd, [view], offset)
+
+    def write_at(self, offset: int, data: bytes) -> int:
+        written = 0
+        while written < len(data):
+            written += os.pwrite(self._fd, data[written:], offset + written)
+        return written
+
+
+class MmapBuffer:
+    """
+    Positional wrapper over a memory-mapped image.
+
+    `read_at` returns a `memoryview` into the mapping instead of copying bytes.
+    """
+
+    def __init__(self, file: BinaryIO, write=False):
+        self.name = file.name
+        self._file = file
+        self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def writable(self) -> bool:
+        return self._file.writable()
+
+    def write_at(self, offset: int, data: bytes) -> int:
+        self._mmap[offset:offset + len(data)] = data
+        return len(data)
+
+    def read_at(self, offset: int, length: int) -> memoryview:
+        return self._view[offset:offset + length]
+
+    def readinto_at(self, offset: int, view: memoryview) -> int:
+        data = self._view[offset:offset + len(view)]
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # somebody still holds a view, the mapping will be released with it
+            pass
+
+
+CacheStats = NamedTuple('CacheStats', [('hits', int), ('misses', int), ('evictions', int), ('size', int)])
+
+
+class BlockCache:
+    """
+    Positional wrapper which keeps up to `capacity` recently used image blocks in memory (LRU).
+
+    Small reads (metadata: inode table, extent index, directory blocks...) are served block by block from the cache.
+    Reads longer than `bypass_blocks` blocks (bulk file data) go straight to the underlying buffer, so they
+    don't flush the metadata out. Writes go through to the underlying buffer and drop the touched blocks.
+    The cache is thread-safe: its bookkeeping is guarded by a lock, reads of missing blocks run outside of it.
+    """
+
+    def __init__(self, buffer, block_size: int, capacity: int, bypass_blocks: int = 8):
+        self.name = buffer.name
+        self.buffer = buffer
+        self.block_size = block_size
+        self.capacity = capacity
+        self.bypass_blocks = bypass_blocks
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every write, a block read before the write must not be cached after it
+        self._generation = 0
+
+    def fileno(self) -> int:
+        return self.buffer.fileno()
+
+    def writable(self) -> bool:
+        return self.buffer.writable()
+
+    def write_at(self, offset: int, data: bytes) -> int:
+        written = write_at(self.buffer, offset, data)
+        self.invalidate(offset, len(data))
+        return written
+
+    def note_read(self, offset: int, length: int):
+        note_read(self.buffer, offset, length)
+
+    def read_at(self, offset: int, length: int) -> Union[bytes, memoryview]:
+        if length <= 0:
+            return b''
+        first_block = offset // self.block_size
+        last_block = (offset + length - 1) // self.block_size
+        if last_block - first_block >= self.bypass_blocks:
+            return read_at(self.buffer, offset, length)
+
+        start = offset - first_block * self.block_size
+        if first_block == last_block:
+            return self.get_block(first_block)[start:start + length]
+        data = b''.join(self.get_block(block_no) for block_no in range(first_block, last_block + 1))
+        return data[start:start + length]
+
+    def readinto_at(self, offset: int, view: memoryview) -> int:
+        if len(view) > self.bypass_blocks * self.block_size:
+            return readinto_at(self.buffer, offset, view)
+        data = self.read_at(offset, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def get_block(self, block_no: int) -> Union[bytes, memoryview]:
+        with self._lock:
+            block = self._blocks.get(block_no)
+            if block is not None:
+                self.hits += 1
+                self._blocks.move_to_end(block_no)
+                return block
+            self.misses += 1
+            generation = self._generation
+
+        block = read_at(self.buffer, block_no * self.block_size, self.block_size)
+
+        with self._lock:
+            if generation == self._generation:
+                self._blocks[block_no] = block
+                if len(self._blocks) > self.capacity:
+                    self._blocks.popitem(last=False)
+                    self.evictions += 1
+        return block
+
+    def invalidate(self, offset: int, length: int):
+        first_block = offset // self.block_size
+        last_block = (offset + max(length, 1) - 1) // self.block_size
+        with self._lock:
+            self._generation += 1
+            for block_no in range(first_block, last_block + 1):
+                self._blocks.pop(block_no, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._blocks.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._blocks))
@@ -1,7 +1,16 @@
-from typing import List, Iterator
+from typing import List, Iterator, Optional, NamedTuple, Tuple, Callable
 
-from ext4.inode import get_inode, parse_inode_mode
-from ext4.structures import ext4_extent_header_struct, parse_struct, ext4_extent_struct, ext4_extent_idx_struct
+from ext4.buffers import read_at, readinto_at
+from ext4.inode import get_inode, get_inode_size, get_inline_content
+from ext4.structures import ext4_extent_header_codec, ext4_extent_codec, ext4_extent_idx_codec
+
+EXTENT_MAGIC = bytes.fromhex('0A F3')
+
+
+# upper bound of a single read, in bytes
+MAX_READ_CHUNK = 1 << 20
+
+ReadSegment = NamedTuple('ReadSegment', [('physical_offset', Optional[int]), ('length', int)])
 
 
 def cat_by_blocks(buffer, sb, bg_descriptors, inode_no: int) -> Iterator[bytes]:
@@ -11,48 +20,278 @@ def cat_by_blocks(buffer, sb, bg_descriptors, inode_no: int) -> Iterator[bytes]:
         inode_no: Inode number
 
     Returns:
-        Iterator over inode blocks
+        Iterator over inode content, in chunks of at most `MAX_READ_CHUNK` bytes. Holes and unwritten
+        (preallocated) extents are returned as zeros without reading the image.
 
     Notes:
         - only extents (no indirect)
-        - no inline_data
+        - inline data and fast symlinks are returned from `i_block` in one chunk
     """
-    sb_block_size = (1024 << sb.s_log_block_size)
     inode = get_inode(buffer, sb, bg_descriptors, inode_no)
-    _, filetype = parse_inode_mode(inode.i_mode)
-    if filetype.SYMBOLIC_LINK and inode.i_flags == 0x10000000:
-        yield inode.i_block[:inode.i_size_lo]
+    inline_content = get_inline_content(inode)
+    if inline_content is not None:
+        yield inline_content
         return
 
-    extents = travers_extent_tree(buffer, inode.i_block, sb_block_size)
+    for segment in plan_inode_reads(buffer, sb, inode):
+        if segment.physical_offset is None:
+            yield bytes(segment.length)
+        else:
+            yield read_at(buffer, segment.physical_offset, segment.length, category='file data')
+
+
+def readinto_by_chunks(buffer, sb, bg_descriptors, inode_no: int, chunk: bytearray = None) -> Iterator[memoryview]:
+    """
+    Same as `cat_by_blocks`, but every chunk is read into one preallocated buffer.
+
+    Returns:
+        Iterator over views of `chunk`, each view is valid only until the next iteration
+    """
+    inode = get_inode(buffer, sb, bg_descriptors, inode_no)
+    inline_content = get_inline_content(inode)
+    if inline_content is not None:
+        yield memoryview(inline_content)
+        return
+
+    view = memoryview(chunk if chunk is not None else bytearray(MAX_READ_CHUNK))
+    zeros = None
+    for segment in plan_inode_reads(buffer, sb, inode, len(view)):
+        if segment.physical_offset is None:
+            zeros = zeros or bytes(len(view))
+            view[:segment.length] = zeros[:segment.length]
+            read = segment.length
+        else:
+            read = readinto_at(buffer, segment.physical_offset, view[:segment.length], category='file data')
+        yield view[:read]
+
+
+def plan_inode_reads(buffer, sb, inode, max_chunk: int = MAX_READ_CHUNK) -> Iterator[ReadSegment]:
+    sb_block_size = 1024 << sb.s_log_block_size
+    return plan_reads(iter_extents(buffer, inode.i_block, sb_block_size), sb_block_size, get_inode_size(inode),
+                      max_chunk)
+
+
+def plan_reads(extents: Iterator, sb_block_size: int, size: int,
+               max_chunk: int = MAX_READ_CHUNK) -> Iterator[ReadSegment]:
+    """
+    Turn extents into reads covering the file from 0 to `size`.
 
-    to_read_bytes = inode.i_size_lo
+    Logical gaps between extents and unwritten extents become holes (`physical_offset` is None).
+    Adjacent holes and physically contiguous data are merged, then split into chunks of at most `max_chunk` bytes.
+    """
+    pending = None  # [physical_offset, length]
+    position = 0
     for extent in extents:
-        phys_block_no = (extent.ee_start_hi << 32) + extent.ee_start_lo
-        buffer.seek(phys_block_no * sb_block_size)
-        new_content = buffer.read(sb_block_size * extent.ee_len)
-        to_read_bytes -= sb_block_size * extent.ee_len
-        if to_read_bytes < 0:
-            yield new_content[:to_read_bytes + sb_block_size * extent.ee_len]
+        extent_start = extent.ee_block * sb_block_size
+        pieces = []
+        if extent_start > position:
+            pieces.append((None, extent_start - position))
+        phys_offset = None
+        if is_extent_initialized(extent):
+            phys_offset = ((extent.ee_start_hi << 32) + extent.ee_start_lo) * sb_block_size
+        pieces.append((phys_offset, get_extent_len(extent) * sb_block_size))
+
+        for phys_offset, length in pieces:
+            length = min(length, size - position)
+            if length <= 0:
+                break
+            if pending and can_merge(pending, phys_offset):
+                pending[1] += length
+            else:
+                if pending:
+                    yield from split_run(pending[0], pending[1], max_chunk)
+                pending = [phys_offset, length]
+            position += length
+        if position >= size:
+            break
+
+    if position < size:
+        if pending and pending[0] is None:
+            pending[1] += size - position
         else:
-            yield new_content
+            if pending:
+                yield from split_run(pending[0], pending[1], max_chunk)
+            pending = [None, size - position]
+    if pending:
+        yield from split_run(pending[0], pending[1], max_chunk)
+
+
+def can_merge(pending: list, phys_offset: Optional[int]) -> bool:
+    if pending[0] is None or phys_offset is None:
+        return pending[0] is None and phys_offset is None
+    return pending[0] + pending[1] == phys_offset
+
+
+def split_run(phys_offset: Optional[int], length: int, max_chunk: int) -> Iterator[ReadSegment]:
+    for start in range(0, length, max_chunk):
+        yield ReadSegment(None if phys_offset is None else phys_offset + start, min(max_chunk, length - start))
 
 
 def travers_extent_tree(buffer, i_block: bytes, sb_block_size=4096) -> List:
-    extent_header = parse_struct(ext4_extent_header_struct, i_block[:12])
+    return list(iter_extents(buffer, i_block, sb_block_size))
 
-    if extent_header.eh_magic != bytes.fromhex('0A F3'):
-        return []
 
-    extents = []
-    for entry_idx in range(extent_header.eh_entries):
+def iter_extents(buffer, i_block: bytes, sb_block_size=4096, start: int = 0, end: int = None,
+                 on_node: Callable[[int, bytes], None] = None, blocks_count: int = None) -> Iterator[NamedTuple]:
+    """
+    Lazily walk the extent tree (any depth), reading one index block per level at a time. Tree blocks past
+    `blocks_count` (not read) or past the end of the image (read short) are not descended into.
+
+    Args:
+        i_block: root node (inode.i_block) or an extent tree block
+        start, end: optional logical block range `[start, end)`, subtrees outside of it aren't read
+        on_node: called with `(physical block number, raw block)` of every tree block referenced (not the root),
+            e.g. to check or account for index and leaf blocks without another walk. The raw block is shorter
+            than `sb_block_size` (empty if not read) when it is out of the image
+        blocks_count: number of blocks of the filesystem, if known
+
+    Returns:
+        Iterator over leaf extents in logical order
+    """
+    extent_header = ext4_extent_header_codec.unpack_from(i_block)
+
+    if extent_header.eh_magic != EXTENT_MAGIC:
+        return
+
+    if extent_header.eh_depth == 0:
+        first = max(bisect_entries(i_block, extent_header.eh_entries, ext4_extent_codec, 'ee_block', start), 0)
+        for extent in ext4_extent_codec.iter_unpack(i_block, 12 * (first + 1), extent_header.eh_entries - first):
+            if end is not None and extent.ee_block >= end:
+                return
+            if extent.ee_block + get_extent_len(extent) > start:
+                yield extent
+        return
+
+    first = max(bisect_entries(i_block, extent_header.eh_entries, ext4_extent_idx_codec, 'ei_block', start), 0)
+    for idx in ext4_extent_idx_codec.iter_unpack(i_block, 12 * (first + 1), extent_header.eh_entries - first):
+        if end is not None and idx.ei_block >= end:
+            return
+        phys_block_no = (idx.ei_leaf_hi << 32) + idx.ei_leaf_lo
+        if blocks_count is not None and phys_block_no >= blocks_count:
+            node = b''
+        else:
+            node = read_at(buffer, phys_block_no * sb_block_size, sb_block_size, category='extent index')
+        if on_node is not None:
+            on_node(phys_block_no, node)
+        if len(node) < sb_block_size:
+            continue
+        yield from iter_extents(buffer, node, sb_block_size, start, end, on_node, blocks_count)
+
+
+def bisect_entries(node, entries_count: int, codec, field_name: str, logical_block_no: int) -> int:
+    """
+    Binary search over extent tree node entries (sorted by `ee_block`/`ei_block`), decoding only the key field.
+
+    Returns:
+        Index of the last entry starting at or before `logical_block_no`, -1 if there is no such entry
+    """
+    lo, hi = 0, entries_count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if codec.unpack_field(node, field_name, 12 * (mid + 1)) <= logical_block_no:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo - 1
+
+
+def find_extent(buffer, i_block: bytes, logical_block_no: int, sb_block_size=4096) -> Optional[NamedTuple]:
+    """
+    Descend the extent tree only along the path to `logical_block_no`.
+
+    Returns:
+        Leaf extent which maps `logical_block_no` or None if it is a hole (or its tree block is out of the image)
+    """
+    node = i_block
+    while True:
+        extent_header = ext4_extent_header_codec.unpack_from(node)
+        if extent_header.eh_magic != EXTENT_MAGIC:
+            return None
         if extent_header.eh_depth == 0:
-            extents.append(
-                parse_struct(ext4_extent_struct, i_block[12 * (entry_idx + 1):12 * (entry_idx + 2)])
-            )
+            idx = bisect_entries(node, extent_header.eh_entries, ext4_extent_codec, 'ee_block', logical_block_no)
+            if idx < 0:
+                return None
+            extent = ext4_extent_codec.unpack_from(node, 12 * (idx + 1))
+            if logical_block_no < extent.ee_block + get_extent_len(extent):
+                return extent
+            return None
+        idx = bisect_entries(node, extent_header.eh_entries, ext4_extent_idx_codec, 'ei_block', logical_block_no)
+        if idx < 0:
+            return None
+        extent_idx = ext4_extent_idx_codec.unpack_from(node, 12 * (idx + 1))
+        phys_block_no = (extent_idx.ei_leaf_hi << 32) + extent_idx.ei_leaf_lo
+        node = read_at(buffer, phys_block_no * sb_block_size, sb_block_size, category='extent index')
+        if len(node) < sb_block_size:
+            return None
+
+
+def get_extent_len(extent) -> int:
+    # ee_len > 32768 marks uninitialized (preallocated) extent
+    return extent.ee_len if extent.ee_len <= 32768 else extent.ee_len - 32768
+
+
+def is_extent_initialized(extent) -> bool:
+    return extent.ee_len <= 32768
+
+
+def get_physical_block(buffer, i_block: bytes, logical_block_no: int, sb_block_size=4096) -> Optional[int]:
+    """
+    Returns:
+        Physical block number of the file's `logical_block_no` or None if it is a hole
+    """
+    extent = find_extent(buffer, i_block, logical_block_no, sb_block_size)
+    if extent is None:
+        return None
+    return (extent.ee_start_hi << 32) + extent.ee_start_lo + logical_block_no - extent.ee_block
+
+
+def iter_mapped_range(buffer, i_block: bytes, offset: int, length: int,
+                      sb_block_size=4096) -> Iterator[Tuple[Optional[int], int]]:
+    """
+    Map the byte range `[offset, offset + length)` of a file to the image.
+
+    Returns:
+        Iterator over segments `(physical_offset, segment_length)`, `physical_offset` is None for holes
+        and unwritten extents (they read as zeros)
+    """
+    position = offset
+    end = offset + length
+    if position >= end:
+        return
+    # one walk over the extents in range, a hole spans up to the next extent
+    for extent in iter_extents(buffer, i_block, sb_block_size, offset // sb_block_size, -(-end // sb_block_size)):
+        extent_start = extent.ee_block * sb_block_size
+        segment_end = min(end, extent_start + get_extent_len(extent) * sb_block_size)
+        if segment_end <= position:
+            continue
+        if extent_start > position:
+            yield None, extent_start - position
+            position = extent_start
+        if is_extent_initialized(extent):
+            phys_block_no = (extent.ee_start_hi << 32) + extent.ee_start_lo
+            yield phys_block_no * sb_block_size + position - extent_start, segment_end - position
+        else:
+            yield None, segment_end - position
+        position = segment_end
+    if position < end:
+        yield None, end - position
+
+
+def pread(buffer, sb, bg_descriptors, inode_no: int, offset: int, length: int) -> bytes:
+    """
+    Read up to `length` bytes of the file at `offset` without walking the whole extent tree.
+    """
+    sb_block_size = 1024 << sb.s_log_block_size
+    inode = get_inode(buffer, sb, bg_descriptors, inode_no)
+    length = max(min(length, get_inode_size(inode) - offset), 0)
+    inline_content = get_inline_content(inode)
+    if inline_content is not None:
+        return bytes(inline_content[offset:offset + length])
+
+    data = []
+    for phys_offset, segment_length in iter_mapped_range(buffer, inode.i_block, offset, length, sb_block_size):
+        if phys_offset is None:
+            data.append(bytes(segment_length))
         else:
-            idx = parse_struct(ext4_extent_idx_struct, i_block[12 * (entry_idx + 1):12 * (entry_idx + 2)])
-            phys_block_no = (idx.ei_leaf_hi << 32) + idx.ei_leaf_lo
-            buffer.seek(phys_block_no * sb_block_size)
-            extents.extend(travers_extent_tree(buffer, buffer.read(sb_block_size)))
-    return extents
+            data.append(read_at(buffer, phys_offset, segment_length, category='file data'))
+    return b''.join(data)
@@ -1,23 +1,48 @@
 import contextlib
 from typing import NamedTuple, BinaryIO, List, ContextManager
 
+from ext4.buffers import FileBuffer, MmapBuffer, BlockCache, read_at
+from ext4.io_stats import IoStatsBuffer
 from ext4.structures import parse_struct, superblock_struct, block_group_descriptor_struct
 
 
 Image = NamedTuple('Image', [('buffer', BinaryIO), ('sb', NamedTuple), ('bg_descriptors', List[NamedTuple])])
 
 
+# in blocks
+DEFAULT_CACHE_SIZE = 4096
+
+
 @contextlib.contextmanager
-def open_img(img_path, write=False) -> ContextManager[Image]:
+def open_img(img_path, write=False, use_mmap=False, cache_size=DEFAULT_CACHE_SIZE,
+             io_stats=False) -> ContextManager[Image]:
+    """
+    Args:
+        use_mmap: memory-map the image, see `MmapBuffer`
+        cache_size: how many blocks keep in `BlockCache` (0 disables the cache)
+        io_stats: count accesses to the image, see `IoStatsBuffer` (found by `io_stats.find_io_stats`)
+
+    The buffer has no file position: it is accessed only through `read_at`, `readinto_at` and `write_at`,
+    so the image can be used from several threads at once.
+    """
     mode = 'rb' if not write else 'r+b'
     with open(img_path, mode) as f:
-        sb, bg_descriptors = parse_static(f)
-        yield Image(f, sb, bg_descriptors)
+        raw_buffer = MmapBuffer(f, write) if use_mmap else FileBuffer(f)
+        try:
+            buffer = IoStatsBuffer(raw_buffer) if io_stats else raw_buffer
+            sb, bg_descriptors = parse_static(buffer)
+            if io_stats:
+                buffer.set_layout(sb, bg_descriptors, get_gdt_offset(sb))
+            if cache_size:
+                buffer = BlockCache(buffer, 1024 << sb.s_log_block_size, cache_size)
+            yield Image(buffer, sb, bg_descriptors)
+        finally:
+            if use_mmap:
+                raw_buffer.close()
 
 
 def parse_static(buffer):
-    buffer.seek(0x400)
-    superblock_raw = buffer.read(0x400)
+    superblock_raw = read_at(buffer, 0x400, 0x400)
     sb = parse_struct(superblock_struct, superblock_raw)
 
     # validate
@@ -28,16 +53,22 @@ def parse_static(buffer):
     # if sb.s_feature_incompat & 0x80:
     #     raise NotImplementedError("This program don't support 64bit feature\nConsider to disable it by command: resize2fs -s <img>")
 
-    s_block_size = 1024 << sb.s_log_block_size
-
-    if s_block_size != 1024:
-        buffer.seek(s_block_size - 0x800, 1)
-
     bg_descriptors = []
-    bg_desc_count = ((sb.s_blocks_count_hi << 32) + sb.s_blocks_count_lo) // sb.s_blocks_per_group
+    # the last group may be partial
+    blocks_count = (sb.s_blocks_count_hi << 32) + sb.s_blocks_count_lo
+    bg_desc_count = -(-(blocks_count - sb.s_first_data_block) // sb.s_blocks_per_group)
+    # read before the place of the table is known to `IoStatsBuffer`
+    gdt_raw = read_at(buffer, get_gdt_offset(sb), bg_desc_count * sb.s_desc_size, category='descriptors')
     for bg_desc_idx in range(bg_desc_count):
-        bg_desc_raw = buffer.read(sb.s_desc_size)
         bg_descriptors.append(
-            parse_struct(block_group_descriptor_struct, bg_desc_raw)
+            parse_struct(block_group_descriptor_struct, gdt_raw, bg_desc_idx * sb.s_desc_size)
         )
     return sb, bg_descriptors
+
+
+def get_gdt_offset(sb) -> int:
+    """
+    Returns:
+        Offset of the group descriptor table: the block right after the superblock
+    """
+    return (sb.s_first_data_block + 1) * (1024 << sb.s_log_block_size)
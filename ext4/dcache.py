@@ -0,0 +1,75 @@
+from typing import Dict, Optional, Set, Tuple
+from weakref import WeakKeyDictionary
+
+
+class DentryCache:
+    """
+    Per-image cache of directory entries: (parent inode, name) -> inode.
+
+    `None` is stored for names known to be absent (negative entries). A directory scanned from start to end is
+    marked complete, so any name missing from it is a negative hit without reading the directory again.
+    Resolved path prefixes are memoized too, so sibling paths under the same prefix are resolved from the
+    deepest known ancestor.
+    """
+
+    def __init__(self):
+        self.entries: Dict[int, Dict[str, Optional[int]]] = {}
+        self.complete_dirs: Set[int] = set()
+        self.paths: Dict[Tuple[str, ...], int] = {}
+
+    def lookup(self, parent_inode: int, name: str) -> Tuple[bool, Optional[int]]:
+        """
+        Returns:
+            A tuple `(hit, inode)`, `inode` is None for a negative entry
+        """
+        names = self.entries.get(parent_inode)
+        if names is not None and name in names:
+            return True, names[name]
+        if parent_inode in self.complete_dirs:
+            return True, None
+        return False, None
+
+    def add(self, parent_inode: int, name: str, inode: Optional[int]):
+        self.entries.setdefault(parent_inode, {})[name] = inode
+
+    def add_directory(self, parent_inode: int, names: Dict[str, int]):
+        self.entries[parent_inode] = dict(names)
+        self.complete_dirs.add(parent_inode)
+
+    def resolve_prefix(self, parts: Tuple[str, ...]) -> Tuple[int, int]:
+        """
+        Returns:
+            A tuple `(inode, length)` for the longest memoized prefix of `parts` (root inode and 0 if none)
+        """
+        for length in range(len(parts), 0, -1):
+            inode = self.paths.get(parts[:length])
+            if inode is not None:
+                return inode, length
+        return 2, 0
+
+    def add_path(self, parts: Tuple[str, ...], inode: int):
+        self.paths[parts] = inode
+
+    def invalidate_directory(self, parent_inode: int):
+        self.entries.pop(parent_inode, None)
+        self.complete_dirs.discard(parent_inode)
+        # a changed directory may be anywhere in the memoized paths
+        self.paths.clear()
+
+    def clear(self):
+        self.entries.clear()
+        self.complete_dirs.clear()
+        self.paths.clear()
+
+
+dentry_caches = WeakKeyDictionary()
+
+
+def get_dentry_cache(buffer) -> DentryCache:
+    """
+    Dentry cache of the image opened as `buffer` (created on first use, dropped with the buffer)
+    """
+    dcache = dentry_caches.get(buffer)
+    if dcache is None:
+        dcache = dentry_caches[buffer] = DentryCache()
+    return dcache
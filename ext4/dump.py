@@ -1,4 +1,16 @@
-from ext4.cat import cat_by_blocks
+import io
+import os
+from itertools import chain
+from typing import BinaryIO, Iterable
+
+from ext4.cat import plan_inode_reads, ReadSegment, MAX_READ_CHUNK
+from ext4.buffers import read_at, readinto_at, note_read
+from ext4.inode import get_inode, get_inline_content
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
 
 
 def dump(buffer, sb, bg_descriptors, inode_no, dest):
@@ -9,5 +21,141 @@ def dump(buffer, sb, bg_descriptors, inode_no, dest):
         dest: dump destination
     """
     with open(dest, 'wb') as dest_buffer:
-        for block in cat_by_blocks(buffer, sb, bg_descriptors, inode_no):
-            dest_buffer.write(block)
+        copy_inode(buffer, sb, bg_descriptors, inode_no, dest_buffer)
+
+
+def copy_inode(buffer, sb, bg_descriptors, inode_no, dest_buffer: BinaryIO):
+    """
+    Write content of inode `inode_no` to `dest_buffer` (e.g. a file or `sys.stdout.buffer`).
+
+    Extents are copied by the kernel (`os.copy_file_range`, then `os.sendfile`) straight from the image
+    when both ends are real file descriptors, otherwise through a buffered copy.
+    Holes and unwritten extents are not read: they are left as holes where `dest_buffer` allows it
+    (see `can_seek_over_holes`), written as zeros otherwise.
+    """
+    inode = get_inode(buffer, sb, bg_descriptors, inode_no)
+    inline_content = get_inline_content(inode)
+    if inline_content is not None:
+        dest_buffer.write(inline_content)
+        return
+
+    segments = plan_inode_reads(buffer, sb, inode)
+    src_fd, dest_fd = get_fileno(buffer), get_fileno(dest_buffer)
+    if src_fd is None or dest_fd is None:
+        buffered_copy(buffer, segments, dest_buffer)
+        return
+
+    dest_buffer.flush()
+    seekable = can_seek_over_holes(dest_buffer)
+    copy_segment = kernel_copy_file_range
+    in_hole = False
+    for segment in segments:
+        in_hole = segment.physical_offset is None
+        if in_hole:
+            if seekable:
+                os.lseek(dest_fd, segment.length, os.SEEK_CUR)
+            else:
+                write_zeros(dest_buffer, segment.length)
+                dest_buffer.flush()
+            continue
+        copied = copy_segment(src_fd, dest_fd, segment)
+        if copied is None and copy_segment is kernel_copy_file_range:
+            copy_segment = kernel_sendfile
+            copied = copy_segment(src_fd, dest_fd, segment)
+        if copied is None:
+            # neither is supported for these descriptors, copy the rest in user space
+            if seekable:
+                dest_buffer.seek(os.lseek(dest_fd, 0, os.SEEK_CUR))
+            buffered_copy(buffer, chain([segment], segments), dest_buffer)
+            return
+        note_read(buffer, segment.physical_offset, copied, category='file data')
+        if copied < segment.length:
+            write_segment(buffer, dest_buffer, ReadSegment(segment.physical_offset + copied, segment.length - copied))
+            dest_buffer.flush()
+    if in_hole and seekable:
+        # a trailing hole: seeking doesn't change the file size, the last byte does
+        os.lseek(dest_fd, -1, os.SEEK_CUR)
+        os.write(dest_fd, b'\0')
+
+
+def buffered_copy(buffer, segments: Iterable[ReadSegment], dest_buffer: BinaryIO):
+    seekable = can_seek_over_holes(dest_buffer)
+    chunk = memoryview(bytearray(MAX_READ_CHUNK))
+    in_hole = False
+    for segment in segments:
+        in_hole = segment.physical_offset is None
+        if in_hole:
+            if seekable:
+                dest_buffer.seek(segment.length, os.SEEK_CUR)
+            else:
+                write_zeros(dest_buffer, segment.length)
+            continue
+        for start in range(0, segment.length, len(chunk)):
+            length = min(len(chunk), segment.length - start)
+            read = readinto_at(buffer, segment.physical_offset + start, chunk[:length], category='file data')
+            dest_buffer.write(chunk[:read])
+    if in_hole and seekable:
+        dest_buffer.seek(-1, os.SEEK_CUR)
+        dest_buffer.write(b'\0')
+
+
+def can_seek_over_holes(dest_buffer: BinaryIO) -> bool:
+    """
+    Returns:
+        Whether a hole can be made by seeking forward: `dest_buffer` is seekable, not opened with O_APPEND
+        (every write would go to the end) and positioned at its end (old content would show through)
+    """
+    if not dest_buffer.seekable():
+        return False
+    fd = get_fileno(dest_buffer)
+    if fd is not None and fcntl is not None and fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_APPEND:
+        return False
+    position = dest_buffer.tell()
+    end = dest_buffer.seek(0, os.SEEK_END)
+    dest_buffer.seek(position)
+    return position == end
+
+
+def write_segment(buffer, dest_buffer: BinaryIO, segment: ReadSegment):
+    dest_buffer.write(read_at(buffer, segment.physical_offset, segment.length, category='file data'))
+
+
+def write_zeros(dest_buffer: BinaryIO, length: int):
+    zeros = bytes(min(length, MAX_READ_CHUNK))
+    for start in range(0, length, len(zeros)):
+        dest_buffer.write(zeros[:length - start])
+
+
+def get_fileno(buffer):
+    try:
+        return buffer.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def kernel_copy_file_range(src_fd: int, dest_fd: int, segment: ReadSegment):
+    """
+    Returns:
+        Number of bytes copied (less than requested only at the end of the image) or None if not supported
+    """
+    return kernel_copy(lambda offset, count: os.copy_file_range(src_fd, dest_fd, count, offset), segment)
+
+
+def kernel_sendfile(src_fd: int, dest_fd: int, segment: ReadSegment):
+    return kernel_copy(lambda offset, count: os.sendfile(dest_fd, src_fd, offset, count), segment)
+
+
+def kernel_copy(copy, segment: ReadSegment):
+    copied = 0
+    while copied < segment.length:
+        try:
+            n = copy(segment.physical_offset + copied, segment.length - copied)
+        except (OSError, AttributeError):
+            # AttributeError: platform without copy_file_range/sendfile; OSError: EXDEV, EINVAL, ENOSYS...
+            if copied:
+                return copied
+            return None
+        if n == 0:
+            break
+        copied += n
+    return copied
@@ -1,8 +1,11 @@
 from struct import pack
-from typing import NamedTuple, Set
+from typing import NamedTuple, Set, List, Tuple
 
 
 class FsckException(BaseException):
+    # fsck pass which finds it
+    pass_no = None
+
     def __eq__(self, other):
         if isinstance(self, other.__class__):
             return self.args == other.args
@@ -11,9 +14,19 @@ class FsckException(BaseException):
     def __hash__(self):
         return hash(self.args)
 
+    def __reduce__(self):
+        # subclasses format the message in __init__, so rebuild from `args` without calling it (fsck workers)
+        return restore_exception, (self.__class__, self.args)
+
+
+def restore_exception(cls, args):
+    exc = cls.__new__(cls)
+    exc.args = args
+    return exc
+
 
 class Pass0Exception(FsckException):
-    pass
+    pass_no = 0
 
 
 class WrongSuperBlockChecksum(Pass0Exception):
@@ -28,7 +41,7 @@ class WrongBlockGroupDescriptorChecksum(Pass0Exception):
 
 
 class Pass1Exception(FsckException):
-    pass
+    pass_no = 1
 
 
 class WrongInodeChecksum(Pass1Exception):
@@ -70,8 +83,102 @@ class SharedBlock(Pass1Exception):
         ))
 
 
+class Pass2Exception(FsckException):
+    pass_no = 2
+
+
+class WrongExtentBlockChecksum(Pass2Exception):
+    def __init__(self, inode_num: int, block_no: int, expected_csum: int, actual_csum: int):
+        super().__init__('[Inode {}] extent block {} expected/actual csum: 0x{}/0x{}'.format(
+            inode_num, block_no, pack('<L', expected_csum).hex(), pack('<L', actual_csum).hex()
+        ))
+
+
+class CorruptedExtentBlock(Pass2Exception):
+    """
+    Problem:
+        Extent tree block is out of the image, has no extent header or no room for its tail (eh_max too big).
+        A block out of the image is not descended into
+    Possible solutions:
+        1. rebuild the extent tree
+    """
+
+    def __init__(self, inode_num: int, block_no: int):
+        super().__init__('[Inode {}] extent block {} is corrupted'.format(inode_num, block_no))
+
+
+class WrongDirBlockChecksum(Pass2Exception):
+    def __init__(self, inode_num: int, block_idx: int, expected_csum: int, actual_csum: int):
+        super().__init__('[Inode {}] directory block {} expected/actual csum: 0x{}/0x{}'.format(
+            inode_num, block_idx, pack('<L', expected_csum).hex(), pack('<L', actual_csum).hex()
+        ))
+
+
+class WrongDxNodeChecksum(Pass2Exception):
+    def __init__(self, inode_num: int, block_idx: int, expected_csum: int, actual_csum: int):
+        super().__init__('[Inode {}] htree node {} expected/actual csum: 0x{}/0x{}'.format(
+            inode_num, block_idx, pack('<L', expected_csum).hex(), pack('<L', actual_csum).hex()
+        ))
+
+
+class MissingDirBlockTail(Pass2Exception):
+    """
+    Problem:
+        Directory block (or htree node) has no room for its checksum while metadata_csum is enabled
+    Possible solutions:
+        1. rehash the directory
+    """
+
+    def __init__(self, inode_num: int, block_idx: int):
+        super().__init__('[Inode {}] directory block {} has no checksum tail'.format(inode_num, block_idx))
+
+
+class CorruptedDirEntry(Pass2Exception):
+    """
+    Problem:
+        Directory entry with a bad rec_len (zero, unaligned, past the block end) or a name_len over rec_len.
+        The rest of the block is not read
+    Possible solutions:
+        1. salvage the directory block
+    """
+
+    def __init__(self, inode_num: int, block_idx: int, offset: int, rec_len: int, name_len: int):
+        super().__init__('[Inode {}] directory block {} entry at {}: rec_len {}, name_len {}'.format(
+            inode_num, block_idx, offset, rec_len, name_len
+        ))
+
+
+class InvalidDirEntryInode(Pass2Exception):
+    """
+    Problem:
+        Directory entry refers to an inode past s_inodes_count or to a free inode. The entry is not followed,
+        a free inode is also reported by pass 5 (InodeBitmapDifference)
+    Possible solutions:
+        1. clear the entry
+    """
+
+    def __init__(self, inode_num: int, name: str, entry_inode: int):
+        super().__init__("[Inode {}] entry '{}' refers to invalid or free inode {}".format(
+            inode_num, name, entry_inode
+        ))
+
+
+class WrongDirEntryFileType(Pass2Exception):
+    """
+    Problem:
+        Directory entry has the directory file type but its inode is not a directory. The entry is not followed
+    Possible solutions:
+        1. set the file type from the inode mode
+    """
+
+    def __init__(self, inode_num: int, name: str, entry_inode: int):
+        super().__init__("[Inode {}] entry '{}' has the directory file type, inode {} is not a directory".format(
+            inode_num, name, entry_inode
+        ))
+
+
 class Pass3Exception(FsckException):
-    pass
+    pass_no = 3
 
 
 class UnconnectedInode(Pass3Exception):
@@ -87,7 +194,7 @@ class UnconnectedInode(Pass3Exception):
 
 
 class Pass4Exception(FsckException):
-    pass
+    pass_no = 4
 
 
 class InvalidReferenceCount(Pass4Exception):
@@ -97,4 +204,45 @@ class InvalidReferenceCount(Pass4Exception):
     Possible solutions:
         1. correct
     """
-    pass
+
+    def __init__(self, inode_num: int, expected_count: int, actual_count: int):
+        super().__init__('[Inode {}] expected/actual links count: {}/{}'.format(
+            inode_num, expected_count, actual_count
+        ))
+
+
+class Pass5Exception(FsckException):
+    pass_no = 5
+
+
+def format_ranges(sign: str, ranges: List[Tuple[int, int]]) -> List[str]:
+    return [sign + (str(start) if length == 1 else '({}--{})'.format(start, start + length - 1))
+            for start, length in ranges]
+
+
+class BlockBitmapDifference(Pass5Exception):
+    """
+    Problem:
+        Block bitmap doesn't match blocks in use: used blocks aren't marked (+) or free blocks are marked (-)
+    Possible solutions:
+        1. rewrite the bitmap from the computed usage
+    """
+
+    def __init__(self, bg_num: int, not_marked: List[Tuple[int, int]], not_used: List[Tuple[int, int]]):
+        super().__init__('[Group {}] block bitmap differences: {}'.format(
+            bg_num, ' '.join(format_ranges('+', not_marked) + format_ranges('-', not_used))
+        ))
+
+
+class InodeBitmapDifference(Pass5Exception):
+    """
+    Problem:
+        Inode bitmap doesn't match inodes in use: used inodes aren't marked (+) or free inodes are marked (-)
+    Possible solutions:
+        1. rewrite the bitmap from the computed usage
+    """
+
+    def __init__(self, bg_num: int, not_marked: List[Tuple[int, int]], not_used: List[Tuple[int, int]]):
+        super().__init__('[Group {}] inode bitmap differences: {}'.format(
+            bg_num, ' '.join(format_ranges('+', not_marked) + format_ranges('-', not_used))
+        ))
@@ -0,0 +1,136 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Iterator, Tuple
+
+from ext4.cat import plan_inode_reads, ReadSegment, cat_by_blocks
+from ext4.buffers import note_read
+from ext4.dump import get_fileno, kernel_copy_file_range
+from ext4.inode import get_inode, get_inode_size, get_inline_content, parse_inode_mode, FileType
+from ext4.ls import ls
+from ext4.utils import format_rate
+
+DEFAULT_JOBS = 8
+
+ExtractedFile = NamedTuple('ExtractedFile', [('path', str), ('size', int), ('seconds', float)])
+
+
+def extract(buffer, sb, bg_descriptors, inode_no: int, dest_dir: str, name: str = None,
+            jobs: int = DEFAULT_JOBS) -> List[ExtractedFile]:
+    """
+    Recreate inode `inode_no` (a directory recursively, a regular file or a symlink) under host directory `dest_dir`.
+
+    The tree is walked and extent maps are planned in the calling thread; file data is copied by a pool of `jobs`
+    threads with positional I/O only (`os.copy_file_range` with an offset or `os.pread`), so the workers never
+    touch the shared image buffer. Modes and mtimes are preserved, other file types (devices, fifos, sockets)
+    are skipped.
+
+    Args:
+        name: host name of a non-directory inode (directory content goes straight into `dest_dir`)
+
+    Returns:
+        Copied regular files with their throughput figures
+    """
+    src_fd = get_fileno(buffer)
+    if src_fd is None:
+        raise ValueError('extract needs an image backed by a file descriptor')
+    os.makedirs(dest_dir, exist_ok=True)
+
+    inode = get_inode(buffer, sb, bg_descriptors, inode_no)
+    _, filetype = parse_inode_mode(inode.i_mode)
+    if filetype == FileType.DIRECTORY:
+        entries = iter_tree(ls(buffer, sb, bg_descriptors, inode_no, recursively=True), dest_dir)
+    else:
+        entries = [(inode_no, os.path.join(dest_dir, name or str(inode_no)))]
+
+    directories = [(inode, dest_dir)] if filetype == FileType.DIRECTORY else []
+    with ThreadPoolExecutor(jobs) as executor:
+        futures = []
+        for entry_inode_no, host_path in entries:
+            inode = get_inode(buffer, sb, bg_descriptors, entry_inode_no)
+            _, filetype = parse_inode_mode(inode.i_mode)
+            if filetype == FileType.DIRECTORY:
+                os.makedirs(host_path, exist_ok=True)
+                directories.append((inode, host_path))
+            elif filetype == FileType.SYMBOLIC_LINK:
+                target = b''.join(cat_by_blocks(buffer, sb, bg_descriptors, entry_inode_no))  # fast or slow
+                os.symlink(target, host_path)
+                os.utime(host_path, (inode.i_atime, inode.i_mtime), follow_symlinks=False)
+            elif filetype == FileType.REGULAR:
+                inline_content = get_inline_content(inode)
+                segments = [] if inline_content is not None else list(plan_inode_reads(buffer, sb, inode))
+                for segment in segments:  # read by the workers from `src_fd`
+                    if segment.physical_offset is not None:
+                        note_read(buffer, segment.physical_offset, segment.length, category='file data')
+                futures.append(executor.submit(extract_file, src_fd, inode, segments, host_path, inline_content))
+        extracted = [future.result() for future in futures]
+
+    # after all files are written: children would change mtime, a read-only mode would block them
+    for inode, host_path in reversed(directories):
+        set_attributes(host_path, inode)
+    return extracted
+
+
+def iter_tree(entries, host_dir: str) -> Iterator[Tuple[int, str]]:
+    """
+    Returns:
+        Iterator over `(inode_no, host_path)` of `ls(..., recursively=True)` output, parents before children
+    """
+    for dir_entry, name, children in entries:
+        if name in ('.', '..'):
+            continue
+        host_path = os.path.join(host_dir, name)
+        yield dir_entry.inode, host_path
+        if children:
+            yield from iter_tree(children, host_path)
+
+
+def extract_file(src_fd: int, inode, segments: List[ReadSegment], host_path: str,
+                 inline_content: bytes = None) -> ExtractedFile:
+    start = time.perf_counter()
+    dest_fd = os.open(host_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        if inline_content is not None:
+            os.write(dest_fd, inline_content)
+        else:
+            copy_segments_at(src_fd, dest_fd, segments)
+            os.ftruncate(dest_fd, get_inode_size(inode))  # a trailing hole
+    finally:
+        os.close(dest_fd)
+    set_attributes(host_path, inode)
+    return ExtractedFile(host_path, get_inode_size(inode), time.perf_counter() - start)
+
+
+def copy_segments_at(src_fd: int, dest_fd: int, segments: List[ReadSegment]):
+    """
+    Copy `segments` of the image to the current position of `dest_fd` without moving the image file position
+    """
+    for segment in segments:
+        if segment.physical_offset is None:
+            os.lseek(dest_fd, segment.length, os.SEEK_CUR)
+            continue
+        copied = kernel_copy_file_range(src_fd, dest_fd, segment) or 0
+        while copied < segment.length:
+            data = os.pread(src_fd, segment.length - copied, segment.physical_offset + copied)
+            if not data:
+                break
+            copied += os.write(dest_fd, data)
+
+
+def set_attributes(host_path: str, inode):
+    mode, _ = parse_inode_mode(inode.i_mode)
+    os.chmod(host_path, int(mode, 8))
+    os.utime(host_path, (inode.i_atime, inode.i_mtime))
+
+
+def format_extract_stats(extracted: List[ExtractedFile], seconds: float) -> Iterator[str]:
+    """
+    Returns:
+        Iterator over lines: one per file, then the aggregate throughput
+    """
+    for file in extracted:
+        yield '{}: {} bytes in {:.3f}s ({})'.format(file.path, file.size, file.seconds,
+                                                   format_rate(file.size, file.seconds))
+    total = sum(file.size for file in extracted)
+    yield 'Total: {} files, {} bytes in {:.3f}s ({})'.format(len(extracted), total, seconds,
+                                                             format_rate(total, seconds))
@@ -1,80 +1,214 @@
-from collections import defaultdict
-from itertools import chain
-from struct import pack
-from typing import Iterator
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from heapq import heappush, heappop
+from itertools import compress, count
+from struct import pack, unpack_from
+from typing import Iterator, List, NamedTuple, Tuple, Iterable, Dict, Optional, Callable
 
 from crc32c import crc32c
 
+from ext4.bitmap import get_bit, set_bit, set_range, compare_bitmaps, count_set_bits, iter_set_bits
 from ext4.block_group_descriptor import calc_bitmap_checksum, read_block_bitmap, read_inode_bitmap
-from ext4.cat import travers_extent_tree
-from ext4.core import Image
+from ext4.cat import iter_extents, get_extent_len, EXTENT_MAGIC
+from ext4.core import Image, open_img
 from ext4.exceptions import WrongSuperBlockChecksum, WrongBlockGroupDescriptorChecksum, WrongBlockBitmapChecksum, \
-    WrongInodeBitmapChecksum, WrongInodeChecksum, SharedBlock, Coincidences, FsckException, UnconnectedInode
-from ext4.inode import calc_checksum
-from ext4.ls import ls
-from ext4.structures import superblock_struct, repack_struct, block_group_descriptor_struct, parse_struct, \
-    ext4_inode_struct, ext4_inode_extra_struct
-from ext4.utils import zero_range, merge_hi_lo, get_block_size, iter_used_values_in_bitmap, iter_blocks_in_leaf, \
-    get_groups_count
+    WrongInodeBitmapChecksum, WrongInodeChecksum, SharedBlock, Coincidences, FsckException, UnconnectedInode, \
+    InvalidReferenceCount, BlockBitmapDifference, InodeBitmapDifference, WrongExtentBlockChecksum, \
+    CorruptedExtentBlock, WrongDirBlockChecksum, WrongDxNodeChecksum, MissingDirBlockTail, CorruptedDirEntry, \
+    InvalidDirEntryInode, WrongDirEntryFileType
+from ext4.inode import FileType, calc_inode_checksum, get_checksum_seed, iter_inode_table, get_inode, \
+    get_inode_checksum_seed
+from ext4.ls import iter_dir_blocks, iter_dir_block_entries
+from ext4.progress import FsckProgress
+from ext4.group_cache import GroupCache, get_image_key, digest_group
+from ext4.htree import is_indexed
+from ext4.structures import superblock_struct, repack_struct, block_group_descriptor_struct, ext4_inode_codec, \
+    ext4_inode_extra_codec, ext4_extent_header_codec, ext4_dir_entry_2_codec, dx_root_info_codec, \
+    dx_countlimit_codec
+from ext4.utils import zero_range, merge_hi_lo, get_block_size, iter_used_values_in_bitmap, get_groups_count
+
+RO_COMPAT_DIR_NLINK = 0x20
+# links count of a directory which is set to 1 instead (with dir_nlink)
+EXT4_LINK_MAX = 65000
+COMPAT_RESIZE_INODE = 0x10
+COMPAT_SPARSE_SUPER2 = 0x200
+INCOMPAT_META_BG = 0x10
+RO_COMPAT_SPARSE_SUPER = 0x1
+RO_COMPAT_BIGALLOC = 0x200
+RO_COMPAT_METADATA_CSUM = 0x400
+BG_INODE_UNINIT = 0x1
+BG_BLOCK_UNINIT = 0x2
+RESIZE_INODE = 7
+EXT4_INLINE_DATA_FL = 0x10000000
+# ext4_dir_entry_tail: a fake entry (inode 0, rec_len 12, name_len 0, file_type 0xDE) and the checksum
+DIR_TAIL_SIZE = 12
+DIR_TAIL_FILE_TYPE = 0xDE
+# ext4_dir_entry_2 header and the shortest entry
+DIR_ENTRY_HEADER_SIZE = 8
+DIR_ENTRY_MIN_SIZE = 12
 
 
 class SharedBlocksExcFactory:
+    """
+    Block ownership is kept per extent in flat arrays (memory scales with the number of extents, not blocks),
+    overlaps are found by a sweep over extents sorted by start.
+    """
+
     def __init__(self):
-        self.block_to_inode = defaultdict(lambda: set())  # need optimization
-        self.inodes_to_coincidences = defaultdict(lambda: Coincidences(set(), set()))
-
-    def record_inode(self, inode: int, blocks: Iterator[int]):
-        blocks = list(blocks)
-        assert len(blocks) == len(set(blocks)), blocks
-        for block in blocks:
-            if block not in self.block_to_inode:
-                self.block_to_inode[block].add(inode)
-                continue
-            other_inodes = self.block_to_inode[block]
-            self.inodes_to_coincidences[inode].blocks.add(block)
-            self.inodes_to_coincidences[inode].inodes.update(other_inodes)
-            for other_inode in other_inodes:
-                self.inodes_to_coincidences[other_inode].blocks.add(block)
-                self.inodes_to_coincidences[other_inode].inodes.add(inode)
+        self.starts = array('Q')
+        self.lengths = array('L')
+        self.owners = array('L')
+
+    def record_inode(self, inode: int, extents: Iterable[Tuple[int, int]]):
+        """
+        Args:
+            extents: `(start block, length)` runs owned by `inode`
+        """
+        for start, length in extents:
+            self.starts.append(start)
+            self.lengths.append(length)
+            self.owners.append(inode)
+
+    def iter_overlaps(self) -> Iterator[Tuple[int, int, int, int]]:
+        """
+        Returns:
+            Iterator over `(idx, other_idx, start, end)`: extents `idx` and `other_idx` of different inodes
+            share blocks `[start, end)`
+        """
+        active = []  # heap of (end, idx) of extents which may still overlap
+        for idx in sorted(range(len(self.starts)), key=self.starts.__getitem__):
+            start = self.starts[idx]
+            end = start + self.lengths[idx]
+            while active and active[0][0] <= start:
+                heappop(active)
+            for other_end, other_idx in active:
+                if self.owners[other_idx] != self.owners[idx]:
+                    yield idx, other_idx, start, min(end, other_end)
+            heappush(active, (end, idx))
+
+    def collect_coincidences(self) -> Dict[int, Coincidences]:
+        inodes_to_coincidences = defaultdict(lambda: Coincidences(set(), set()))
+        # report in recording order: the inode which claimed a block later comes first
+        for later, earlier, start, end in sorted((max(idx, other_idx), min(idx, other_idx), start, end)
+                                                 for idx, other_idx, start, end in self.iter_overlaps()):
+            inode, other_inode = self.owners[later], self.owners[earlier]
+            inodes_to_coincidences[inode].blocks.update(range(start, end))
+            inodes_to_coincidences[inode].inodes.add(other_inode)
+            inodes_to_coincidences[other_inode].blocks.update(range(start, end))
+            inodes_to_coincidences[other_inode].inodes.add(inode)
+        return inodes_to_coincidences
 
     def create(self) -> Iterator[SharedBlock]:
-        for inode, coincidence in self.inodes_to_coincidences.items():
+        for inode, coincidence in self.collect_coincidences().items():
             yield SharedBlock(inode, coincidence)
 
 
 class UnconnectedInodeExcFactory:
-    def __init__(self):
-        self.used_inode = set()
+    """
+    Used and connected inodes are bits of two bitmaps indexed by inode number.
+    """
+
+    def __init__(self, inodes_count: int):
+        self.used_inodes = bytearray(inodes_count // 8 + 1)
+        self.connected_inodes = bytearray(inodes_count // 8 + 1)
 
     def record_inode(self, inode_num: int):
-        self.used_inode.add(inode_num)
+        set_bit(self.used_inodes, inode_num, True)
 
     def record_connected_inode(self, inode_num: int):
-        self.used_inode.discard(inode_num)
-
-    def create(self) -> Iterator[SharedBlock]:
-        for inode_num in self.used_inode:
-            if inode_num > 12:  # isn't special?
-                yield UnconnectedInode(inode_num)
+        set_bit(self.connected_inodes, inode_num, True)
 
+    def is_connected(self, inode_num: int) -> bool:
+        return get_bit(self.connected_inodes, inode_num)
 
-# global
-unconnected_factory = UnconnectedInodeExcFactory()
+    def is_used(self, inode_num: int) -> bool:
+        return get_bit(self.used_inodes, inode_num)
 
-
-def fsck(img) -> Iterator[FsckException]:
-    print("pass 0 IN PROGRESS")
-    yield from pass_0(img)
-    print("pass 0 COMPLETED")
-    print("pass 1 IN PROGRESS")
-    yield from pass_1(img)
-    print("pass 1 COMPLETED")
-    print("pass 3")
-    yield from pass_3(img)
-    print("pass 3 COMPLETED")
+    def create(self) -> Iterator[UnconnectedInode]:
+        for start, length in compare_bitmaps(self.used_inodes, self.connected_inodes).missing:
+            for inode_num in range(max(start, 13), start + length):  # inodes up to 12 are special
+                yield UnconnectedInode(inode_num)
 
 
-def pass_0(img: Image) -> Iterator[FsckException]:
+class ReferenceCountExcFactory:
+    """
+    Links counts of inode tables against directory entries referring to each inode ('.' and '..' included),
+    both in `array('H')` indexed by inode number. Counts saturate at 0xffff.
+    """
+
+    def __init__(self, inodes_count: int):
+        self.links_counts = array('H', bytes(2 * (inodes_count + 1)))
+        self.references = array('H', bytes(2 * (inodes_count + 1)))
+
+    def record_links_count(self, inode_num: int, links_count: int):
+        self.links_counts[inode_num] = links_count
+
+    def record_reference(self, inode_num: int):
+        if self.references[inode_num] != 0xffff:
+            self.references[inode_num] += 1
+
+    def create(self, inodes: Iterable[int], dir_nlink: bool = False) -> Iterator[InvalidReferenceCount]:
+        """
+        Args:
+            inodes: inodes to check in ascending order
+            dir_nlink: a links count of 1 stands for "too many" (EXT4_FEATURE_RO_COMPAT_DIR_NLINK)
+        """
+        for inode_num in inodes:
+            links_count, references = self.links_counts[inode_num], self.references[inode_num]
+            if links_count != references and not (dir_nlink and links_count == 1 and references >= EXT4_LINK_MAX):
+                yield InvalidReferenceCount(inode_num, references, links_count)
+
+
+class FsckContext:
+    """
+    State of one fsck run, shared by its passes
+    """
+
+    def __init__(self, img: Image, progress: FsckProgress = None):
+        self.progress = progress or FsckProgress()
+        self.shared_blocks = SharedBlocksExcFactory()
+        self.unconnected = UnconnectedInodeExcFactory(img.sb.s_inodes_count)
+        self.references = ReferenceCountExcFactory(img.sb.s_inodes_count)
+        # used directory inodes
+        self.directories = bytearray(img.sb.s_inodes_count // 8 + 1)
+        # blocks claimed by inodes (data, extent tree and xattr blocks), indexed by block - s_first_data_block
+        self.used_blocks = bytearray(get_groups_count(img) * img.sb.s_blocks_per_group // 8)
+        # found while pass 1 reads extent trees, reported by pass 2
+        self.extent_block_exceptions = []
+
+
+def fsck(img, jobs: int = 1, progress: FsckProgress = None, cache_path: str = None) -> Iterator[FsckException]:
+    """
+    Args:
+        jobs: number of processes checking block groups in pass 1
+        progress: sink of progress and metrics, silent by default
+        cache_path: sidecar file of pass 1 group reports (see `group_cache`), created or updated.
+            Unchanged groups are not checked again
+    """
+    context = FsckContext(img, progress)
+    progress = context.progress
+    cache = GroupCache.load(cache_path, get_image_key(img)) if cache_path else None
+    yield from run_pass(progress, 0, pass_0(img, progress))
+    yield from run_pass(progress, 1, pass_1(img, context, jobs, cache), total=len(img.bg_descriptors))
+    yield from run_pass(progress, 2, pass_2(img, context), total=count_set_bits(context.directories))
+    yield from run_pass(progress, 3, pass_3(img, context))
+    yield from run_pass(progress, 4, pass_4(img, context))
+    yield from run_pass(progress, 5, pass_5(img, context))
+
+
+def run_pass(progress: FsckProgress, pass_no: int, exceptions: Iterator[FsckException],
+             total: int = None) -> Iterator[FsckException]:
+    progress.start_pass(pass_no, total)
+    for exc in exceptions:
+        progress.exception_found(exc)
+        yield exc
+    progress.finish_pass()
+
+
+def pass_0(img: Image, progress: FsckProgress = None) -> Iterator[FsckException]:
     superblock_raw = repack_struct(img.sb, superblock_struct)
     if crc32c(superblock_raw) != 0xff_ff_ff_ff:
         yield WrongSuperBlockChecksum()
@@ -89,76 +223,519 @@ def pass_0(img: Image) -> Iterator[FsckException]:
             if actual_csum != expected_csum:
                 yield WrongBlockGroupDescriptorChecksum(bg_num, expected_csum, actual_csum)
     else:
-        print('Checksum validating skipped due unsupported feature: uninit_bg')
-
-
-def pass_1(img: Image) -> Iterator[FsckException]:
-    global unconnected_factory
-    shared_blocks_factory = SharedBlocksExcFactory()
+        (progress or FsckProgress()).note('Checksum validating skipped due unsupported feature: uninit_bg')
+
+
+def pass_1(img: Image, context: FsckContext, jobs: int = 1, cache: GroupCache = None) -> Iterator[FsckException]:
+    """
+    Args:
+        jobs: number of worker processes, groups are checked in order by the current process if 1
+        cache: reports of the previous run, updated and saved once all groups are done
+    """
+    for bg_num, report in enumerate(iter_group_reports(img, jobs, cache)):
+        yield from report.exceptions
+        context.progress.advance(done=1, inodes=len(report.inodes), bytes_read=report.bytes_read)
+        context.extent_block_exceptions.extend(report.extent_block_exceptions)
+        for inode_no, extents in report.extents:
+            context.shared_blocks.record_inode(inode_no, extents)
+            for start, length in extents:
+                mark_blocks(img, context.used_blocks, start, length)
+        for block_no in report.xattr_blocks:
+            mark_blocks(img, context.used_blocks, block_no, 1)
+        for inode_no, links_count in zip(report.inodes, report.links_counts):
+            context.unconnected.record_inode(inode_no)
+            context.references.record_links_count(inode_no, links_count)
+        for inode_no in report.directories:
+            set_bit(context.directories, inode_no, True)
+
+    if cache is not None:
+        cache.save()
+        context.progress.note('{}/{} groups unchanged since the last run'.format(cache.hits, len(img.bg_descriptors)))
+    yield from context.shared_blocks.create()
+
+
+GroupReport = NamedTuple('GroupReport', [('exceptions', List[FsckException]), ('inodes', List[int]),
+                                         ('links_counts', List[int]), ('directories', List[int]),
+                                         ('extents', List[Tuple[int, List[Tuple[int, int]]]]),
+                                         ('xattr_blocks', List[int]),
+                                         ('extent_block_exceptions', List[FsckException]),
+                                         ('bytes_read', int)])
+
+
+def iter_group_reports(img: Image, jobs: int = 1, cache: GroupCache = None) -> Iterator[GroupReport]:
+    """
+    Args:
+        cache: groups with the cached digest get the cached report, others are checked and cached
+
+    Returns:
+        Iterator over `check_group` reports in group order, whatever the number of `jobs`
+    """
+    groups = range(len(img.bg_descriptors))
+    if cache is None:
+        yield from map_groups(img, jobs, check_group, groups)
+        return
+
+    results = map_groups(img, jobs, check_group_incremental, groups, [cache.get_digest(bg_num) for bg_num in groups])
+    for bg_num, (digest, bytes_read, report) in zip(groups, results):
+        if report is None:
+            report = cache.get_report(bg_num, GroupReport)._replace(bytes_read=bytes_read)
+        else:
+            cache.put(bg_num, digest, report)
+        yield report
+
+
+def check_group_incremental(img: Image, bg_num: int,
+                            cached_digest: Optional[str]) -> Tuple[str, int, Optional[GroupReport]]:
+    """
+    Group metadata is read once: a changed group is checked from the bitmaps and inodes its digest was
+    computed from, only its extent tree blocks are read again.
+
+    Returns:
+        Digest of the group (see `group_cache.digest_group`), bytes read for the group and the report,
+        None if the digest is `cached_digest`
+    """
+    metadata = read_group_metadata(img, bg_num)
+    metadata = metadata._replace(inodes=list(metadata.inodes))
+    digest, bytes_read = digest_group(img, bg_num, metadata)
+    if digest == cached_digest:
+        return digest, bytes_read, None
+    report = check_group(img, bg_num, metadata)
+    # bitmaps and inodes are read once for both, the descriptor and extent tree blocks for the digest too
+    shared = sum(len(bitmap) for bitmap in (metadata.block_bitmap, metadata.inode_bitmap) if bitmap is not None)
+    shared += sum(len(raw) for _, raw in metadata.inodes)
+    report = report._replace(bytes_read=bytes_read + report.bytes_read - shared)
+    return digest, report.bytes_read, report
+
+
+def map_groups(img: Image, jobs: int, func: Callable, groups: range, *iterables) -> Iterator:
+    """
+    Returns:
+        Iterator over `func(img, bg_num, *args)` for groups in order, computed by `jobs` worker processes if > 1
+    """
+    if jobs <= 1:
+        yield from map(partial(func, img), groups, *iterables)
+        return
+
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(img.buffer.name,)) as executor:
+        yield from executor.map(partial(call_in_worker, func), groups, *iterables,
+                                chunksize=max(1, len(groups) // (jobs * 8)))
+
+
+# image opened once per worker process of `map_groups`
+worker_stack = ExitStack()
+worker_img = None
+
+
+def init_worker(img_path: str):
+    global worker_img
+    worker_img = worker_stack.enter_context(open_img(img_path))
+
+
+def call_in_worker(func: Callable, *args):
+    return func(worker_img, *args)
+
+
+GroupMetadata = NamedTuple('GroupMetadata', [('block_bitmap', Optional[bytes]), ('inode_bitmap', Optional[bytes]),
+                                             ('inodes', Iterable[Tuple[int, memoryview]])])
+
+
+def read_group_metadata(img: Image, bg_num: int) -> GroupMetadata:
+    """
+    Returns:
+        Initialized bitmaps of group `bg_num` (None if not) and a lazy iterator over its used inodes
+        `(offset in the inode table, raw inode)`
+    """
+    bg = img.bg_descriptors[bg_num]
+    block_bitmap_raw = read_block_bitmap(img, bg) if not bg.bg_flags & 0x2 else None  # is block bitmap initialized?
+    if bg.bg_flags & 0xf1:
+        return GroupMetadata(block_bitmap_raw, None, [])
+    inode_bitmap_raw = read_inode_bitmap(img, bg)
+    return GroupMetadata(block_bitmap_raw, inode_bitmap_raw,
+                         iter_inode_table(img.buffer, img.sb, bg, iter_used_values_in_bitmap(inode_bitmap_raw)))
+
+
+def check_group(img: Image, bg_num: int, metadata: GroupMetadata = None) -> GroupReport:
+    """
+    Verify bitmap and inode checksums of group `bg_num`.
+
+    Args:
+        metadata: bitmaps and used inodes of the group if already read (`read_group_metadata`)
+
+    Returns:
+        Found exceptions, used inodes with their links counts, used directories, a compact ownership summary:
+        `(inode, [(start block, length)...])` of extents (unwritten ones included) and extent tree blocks,
+        and extended attribute blocks (they can be shared by design). Extent tree blocks are checked
+        on the way, their exceptions belong to pass 2. `bytes_read` counts bitmaps, used inodes and extent tree
+        blocks
+    """
+    exceptions, inodes, links_counts, directories, extents, xattr_blocks = [], [], [], [], [], []
+    extent_block_exceptions = []
+    bytes_read = 0
+    metadata_csum = bool(img.sb.s_feature_ro_compat & RO_COMPAT_METADATA_CSUM)
+    bg = img.bg_descriptors[bg_num]
+    actual_block_bitmap_csum = merge_hi_lo(bg.bg_block_bitmap_csum_hi, bg.bg_block_bitmap_csum_lo, lo_size=16)
+    actual_inode_bitmap_csum = merge_hi_lo(bg.bg_inode_bitmap_csum_hi, bg.bg_inode_bitmap_csum_lo, lo_size=16)
+
+    sb_block_size = get_block_size(img)
+    blocks_count = merge_hi_lo(img.sb.s_blocks_count_hi, img.sb.s_blocks_count_lo)
+    if metadata is None:
+        metadata = read_group_metadata(img, bg_num)
+
+    if metadata.block_bitmap is not None:
+        block_bitmap_raw = metadata.block_bitmap
+        bytes_read += len(block_bitmap_raw)
+        expected_csum = calc_bitmap_checksum(img, block_bitmap_raw)
+        if actual_block_bitmap_csum != expected_csum:
+            exceptions.append(WrongBlockBitmapChecksum(bg_num, expected_csum, actual_block_bitmap_csum))
+
+    if metadata.inode_bitmap is not None:
+        inode_bitmap_raw = metadata.inode_bitmap
+        bytes_read += len(inode_bitmap_raw)
+        expected_csum = calc_bitmap_checksum(img, inode_bitmap_raw)
+        if actual_inode_bitmap_csum != expected_csum:
+            exceptions.append(WrongInodeBitmapChecksum(bg_num, expected_csum, actual_inode_bitmap_csum))
+
+        seed = get_checksum_seed(img.sb)
+        for offset, inode_raw in metadata.inodes:
+            inode = ext4_inode_codec.unpack_from(inode_raw)
+            bytes_read += len(inode_raw)
+
+            has_hi = False
+            if img.sb.s_inode_size > 128:
+                has_hi = bool(ext4_inode_extra_codec.unpack_field(inode_raw, 'i_extra_isize', 0x80))
+            if has_hi:
+                i_checksum_hi = ext4_inode_extra_codec.unpack_field(inode_raw, 'i_checksum_hi', 0x80)
+                actual_csum = merge_hi_lo(i_checksum_hi, inode.i_checksum_lo, lo_size=16)
+            else:
+                actual_csum = inode.i_checksum_lo
+
+            inode_no = img.sb.s_inodes_per_group * bg_num + offset + 1
+            expected_csum = calc_inode_checksum(seed, inode_no, inode.i_generation, inode_raw, has_hi)
 
-    for bg_num, bg in enumerate(img.bg_descriptors):
-        print('Checking group {}/{}'.format(bg_num + 1, get_groups_count(img)))
-        actual_block_bitmap_csum = merge_hi_lo(bg.bg_block_bitmap_csum_hi, bg.bg_block_bitmap_csum_lo, lo_size=16)
-        actual_inode_bitmap_csum = merge_hi_lo(bg.bg_inode_bitmap_csum_hi, bg.bg_inode_bitmap_csum_lo, lo_size=16)
-
-        sb_block_size = get_block_size(img)
-
-        if not bg.bg_flags & 0x2:  # is block bitmap initialized?
-            block_bitmap_raw = read_block_bitmap(img, bg)
-            expected_csum = calc_bitmap_checksum(img, block_bitmap_raw)
-            if actual_block_bitmap_csum != expected_csum:
-                yield WrongBlockBitmapChecksum(bg_num, expected_csum, actual_block_bitmap_csum)
-
-        if not bg.bg_flags & 0xf1:
-            inode_bitmap_raw = read_inode_bitmap(img, bg)
-            expected_csum = calc_bitmap_checksum(img, inode_bitmap_raw)
-            if actual_inode_bitmap_csum != expected_csum:
-                yield WrongInodeBitmapChecksum(bg_num, expected_csum, actual_inode_bitmap_csum)
-
-            bg_inode_table = merge_hi_lo(bg.bg_inode_table_hi, bg.bg_inode_table_lo)
-            img.buffer.seek(bg_inode_table * sb_block_size)
-            prev_offset = 0
-            for offset in iter_used_values_in_bitmap(inode_bitmap_raw):
-                img.buffer.seek((offset - prev_offset) * img.sb.s_inode_size, 1)
-                inode_raw = img.buffer.read(img.sb.s_inode_size)
-                prev_offset = offset + 1
-                inode = parse_struct(ext4_inode_struct, inode_raw[:0x80])
-
-                has_hi = False
-                if img.sb.s_inode_size > 128:
-                    inode_extra_raw = inode_raw[0x80:0xA0]
-                    inode_extra = parse_struct(ext4_inode_extra_struct, inode_extra_raw)
-                    has_hi = bool(inode_extra.i_extra_isize)
-                if has_hi:
-                    actual_csum = merge_hi_lo(inode_extra.i_checksum_hi, inode.i_checksum_lo, lo_size=16)
+            if actual_csum != expected_csum:
+                exceptions.append(
+                    WrongInodeChecksum(inode_no, expected_csum, actual_csum, fmt='<L' if has_hi else '<H'))
+            owned = []
+            inode_seed = get_inode_checksum_seed(seed, inode_no, inode.i_generation) if metadata_csum else None
+
+            def on_node(block_no: int, node, inode_no=inode_no, inode_seed=inode_seed):
+                nonlocal bytes_read
+                bytes_read += len(node)
+                owned.append((block_no, 1))
+                if len(node) < sb_block_size:  # past the end of the filesystem or of the image
+                    extent_block_exceptions.append(CorruptedExtentBlock(inode_no, block_no))
                 else:
-                    actual_csum = inode.i_checksum_lo
-
-                inode_no = img.sb.s_inodes_per_group * bg_num + offset + 1
-                expected_csum = calc_checksum(img, inode_no, inode.i_generation, inode_raw, has_hi)
-
-                if actual_csum != expected_csum:
-                    yield WrongInodeChecksum(inode_no, expected_csum, actual_csum, fmt='<L' if has_hi else '<H')
-                current = img.buffer.tell()
-                try:
-                    shared_blocks_factory.record_inode(inode_no,
-                                                       chain(*[iter_blocks_in_leaf(leaf) for leaf in
-                                                               travers_extent_tree(img.buffer, inode.i_block, sb_block_size)]))
-                except NotImplementedError:
-                    pass
-                finally:
-                    img.buffer.seek(current)
-                unconnected_factory.record_inode(inode_no)
-
-    yield from shared_blocks_factory.create()
-
-
-def traverse_whole_tree(entries):
-    for dir_entry, _, children in entries:
-        unconnected_factory.record_connected_inode(dir_entry.inode)
-        traverse_whole_tree(children)
-
-
-def pass_3(img: Image) -> Iterator[FsckException]:
-    traverse_whole_tree(ls(*img, 2, recursively=True))
-    yield from unconnected_factory.create()
+                    extent_block_exceptions.extend(check_extent_block(node, inode_no, block_no, inode_seed))
+
+            try:
+                for leaf in iter_extents(img.buffer, inode.i_block, sb_block_size, on_node=on_node,
+                                         blocks_count=blocks_count):
+                    owned.append((merge_hi_lo(leaf.ee_start_hi, leaf.ee_start_lo), get_extent_len(leaf)))
+            except NotImplementedError:
+                pass
+            extents.append((inode_no, owned))
+            xattr_block = merge_hi_lo(inode.i_file_acl_high, inode.i_file_acl_lo)
+            if xattr_block:
+                xattr_blocks.append(xattr_block)
+            inodes.append(inode_no)
+            links_counts.append(inode.i_links_count)
+            if inode.i_mode >> 12 == FileType.DIRECTORY.value:
+                directories.append(inode_no)
+
+    return GroupReport(exceptions, inodes, links_counts, directories, extents, xattr_blocks, extent_block_exceptions,
+                       bytes_read)
+
+
+def check_extent_block(node, inode_no: int, block_no: int, inode_seed: int = None) -> Iterator[FsckException]:
+    """
+    Args:
+        inode_seed: `get_inode_checksum_seed` of the owner, None without metadata_csum
+    """
+    header = ext4_extent_header_codec.unpack_from(node)
+    tail_offset = 12 + 12 * header.eh_max
+    if header.eh_magic != EXTENT_MAGIC or tail_offset + 4 > len(node):
+        yield CorruptedExtentBlock(inode_no, block_no)
+        return
+    if inode_seed is not None:
+        expected_csum = ~crc32c(node[:tail_offset], inode_seed) & 0xff_ff_ff_ff
+        actual_csum, = unpack_from('<L', node, tail_offset)
+        if actual_csum != expected_csum:
+            yield WrongExtentBlockChecksum(inode_no, block_no, expected_csum, actual_csum)
+
+
+def pass_2(img: Image, context: FsckContext) -> Iterator[FsckException]:
+    """
+    Check directory blocks (entries, leaf and htree checksums) in a breadth-first walk over directories
+    from the root, every directory block is read once. Connectivity and references to inodes are recorded
+    on the way for passes 3 and 4, entries which can't be followed (see `check_dir_entry`) are reported instead.
+    Extent tree blocks were checked when pass 1 read them.
+    """
+    yield from context.extent_block_exceptions
+    unconnected, progress = context.unconnected, context.progress
+    unconnected.record_connected_inode(2)
+    queue = deque([2])
+    while queue:
+        dir_inode_no = queue.popleft()
+        for dir_entry, name in (yield from iter_checked_dir_entries(img, dir_inode_no, progress)):
+            exc = check_dir_entry(img, context, dir_inode_no, dir_entry, name)
+            if exc is not None:
+                yield exc
+                continue
+            context.references.record_reference(dir_entry.inode)
+            if name == '.' or name == '..' or unconnected.is_connected(dir_entry.inode):
+                continue
+            unconnected.record_connected_inode(dir_entry.inode)
+            if get_bit(context.directories, dir_entry.inode):
+                queue.append(dir_entry.inode)
+        progress.advance(done=1, inodes=1)
+
+    # unconnected directories still refer to inodes (their '..' to the parent...), like in e2fsck
+    for start, length in compare_bitmaps(context.directories, unconnected.connected_inodes).missing:
+        for dir_inode_no in range(start, start + length):
+            for dir_entry, name in (yield from iter_checked_dir_entries(img, dir_inode_no, progress)):
+                exc = check_dir_entry(img, context, dir_inode_no, dir_entry, name)
+                if exc is not None:
+                    yield exc
+                    continue
+                context.references.record_reference(dir_entry.inode)
+            progress.advance(done=1, inodes=1)
+
+
+def check_dir_entry(img: Image, context: FsckContext, dir_inode_no: int, dir_entry,
+                    name: str) -> Optional[FsckException]:
+    """
+    A free inode is still counted as referred to, so pass 5 reports it missing from the inode bitmap.
+
+    Returns:
+        Exception if the entry can't be followed (its inode is out of range or free, or it is typed as
+        a directory while its inode is not one), None otherwise
+    """
+    if not 0 < dir_entry.inode <= img.sb.s_inodes_count:
+        return InvalidDirEntryInode(dir_inode_no, name, dir_entry.inode)
+    if not context.unconnected.is_used(dir_entry.inode):
+        context.references.record_reference(dir_entry.inode)
+        return InvalidDirEntryInode(dir_inode_no, name, dir_entry.inode)
+    if dir_entry.file_type == 2 and not get_bit(context.directories, dir_entry.inode):
+        return WrongDirEntryFileType(dir_inode_no, name, dir_entry.inode)
+    return None
+
+
+def iter_checked_dir_entries(img: Image, dir_inode_no: int, progress: FsckProgress = None):
+    """
+    Generator yielding exceptions of directory `dir_inode_no` blocks, use with `yield from`.
+
+    Returns:
+        Used entries `(dir_entry, name)` of the directory, up to the first corrupted entry of each block
+    """
+    inode = get_inode(*img, dir_inode_no)
+    inode_seed, indexed = None, False
+    if not inode.i_flags & EXT4_INLINE_DATA_FL:
+        indexed = is_indexed(img.sb, inode)
+        if img.sb.s_feature_ro_compat & RO_COMPAT_METADATA_CSUM:
+            inode_seed = get_inode_checksum_seed(get_checksum_seed(img.sb), dir_inode_no, inode.i_generation)
+
+    entries = []
+    for block_idx, block in enumerate(iter_dir_blocks(*img, dir_inode_no)):
+        if inode.i_flags & EXT4_INLINE_DATA_FL:
+            end = len(block)
+        else:
+            exceptions, end = check_dir_block(block, dir_inode_no, block_idx, inode_seed, indexed)
+            yield from exceptions
+        entries.extend(iter_dir_block_entries(block[:end]))
+        if progress is not None:
+            progress.advance(bytes_read=len(block))
+    return entries
+
+
+def check_dir_block(block, inode_no: int, block_idx: int, inode_seed: int = None,
+                    indexed: bool = False) -> Tuple[List[FsckException], int]:
+    """
+    Args:
+        block_idx: logical block number, 0 is the htree root of an indexed directory
+        inode_seed: `get_inode_checksum_seed` of the directory, None without metadata_csum
+        indexed: the directory is an htree (`htree.is_indexed`)
+
+    Returns:
+        Exceptions and the offset where valid entries end
+    """
+    block_size = len(block)
+    first_entry = ext4_dir_entry_2_codec.unpack_from(block)
+    if indexed and (block_idx == 0 or first_entry.inode == 0 and first_entry.rec_len == block_size):
+        return check_dx_node(block, inode_no, block_idx, inode_seed), block_size
+
+    exceptions = []
+    end = block_size
+    if inode_seed is not None:
+        tail = ext4_dir_entry_2_codec.unpack_from(block, block_size - DIR_TAIL_SIZE)
+        if (tail.inode, tail.rec_len, tail.name_len, tail.file_type) != (0, DIR_TAIL_SIZE, 0, DIR_TAIL_FILE_TYPE):
+            exceptions.append(MissingDirBlockTail(inode_no, block_idx))
+        else:
+            end = block_size - DIR_TAIL_SIZE
+            expected_csum = ~crc32c(block[:end], inode_seed) & 0xff_ff_ff_ff
+            actual_csum, = unpack_from('<L', block, end + DIR_ENTRY_HEADER_SIZE)
+            if actual_csum != expected_csum:
+                exceptions.append(WrongDirBlockChecksum(inode_no, block_idx, expected_csum, actual_csum))
+
+    offset = 0
+    while offset < end:
+        if offset + DIR_ENTRY_HEADER_SIZE > end:
+            exceptions.append(CorruptedDirEntry(inode_no, block_idx, offset, 0, 0))
+            return exceptions, offset
+        entry = ext4_dir_entry_2_codec.unpack_from(block, offset)
+        if entry.rec_len < DIR_ENTRY_MIN_SIZE or entry.rec_len % 4 or offset + entry.rec_len > end or \
+                DIR_ENTRY_HEADER_SIZE + entry.name_len > entry.rec_len:
+            exceptions.append(CorruptedDirEntry(inode_no, block_idx, offset, entry.rec_len, entry.name_len))
+            return exceptions, offset
+        offset += entry.rec_len
+    return exceptions, end
+
+
+def check_dx_node(block, inode_no: int, block_idx: int, inode_seed: int = None) -> List[FsckException]:
+    """
+    Check the dx_tail checksum of an htree root (block 0) or interior node: it covers the node up to
+    the last used dx_entry and the tail, its checksum field counted as zeros.
+    """
+    if inode_seed is None:
+        return []
+    if block_idx == 0:
+        countlimit_offset = 0x18 + dx_root_info_codec.unpack_from(block, 0x18).info_length
+    else:
+        countlimit_offset = DIR_ENTRY_HEADER_SIZE
+    countlimit = dx_countlimit_codec.unpack_from(block, countlimit_offset)
+    tail_offset = countlimit_offset + 8 * countlimit.limit
+    if countlimit.count > countlimit.limit or tail_offset + 8 > len(block):
+        return [MissingDirBlockTail(inode_no, block_idx)]
+    crc = crc32c(block[:countlimit_offset + 8 * countlimit.count], inode_seed)
+    crc = crc32c(block[tail_offset:tail_offset + 4], crc)  # dt_reserved
+    expected_csum = ~crc32c(b'\0\0\0\0', crc) & 0xff_ff_ff_ff  # dt_checksum
+    actual_csum, = unpack_from('<L', block, tail_offset + 4)
+    if actual_csum != expected_csum:
+        return [WrongDxNodeChecksum(inode_no, block_idx, expected_csum, actual_csum)]
+    return []
+
+
+def pass_3(img: Image, context: FsckContext) -> Iterator[FsckException]:
+    """
+    Report used inodes which the directory walk of pass 2 didn't reach from the root
+    """
+    yield from context.unconnected.create()
+
+
+def pass_4(img: Image, context: FsckContext) -> Iterator[FsckException]:
+    """
+    Compare links counts with references counted by pass 2. Unconnected inodes (already reported by pass 3)
+    and reserved inodes except the root are skipped.
+    """
+    inodes = (inode_num for inode_num in iter_set_bits(context.unconnected.connected_inodes)
+              if inode_num == 2 or inode_num >= img.sb.s_first_ino)
+    yield from context.references.create(inodes, dir_nlink=bool(img.sb.s_feature_ro_compat & RO_COMPAT_DIR_NLINK))
+
+
+def pass_5(img: Image, context: FsckContext) -> Iterator[FsckException]:
+    """
+    Compare block and inode bitmaps of every group with the usage found by the previous passes.
+    Groups with uninitialized block bitmaps are skipped, an uninitialized inode bitmap is taken as empty.
+    """
+    sb = img.sb
+    if sb.s_feature_incompat & INCOMPAT_META_BG or sb.s_feature_ro_compat & RO_COMPAT_BIGALLOC or \
+            sb.s_feature_compat & COMPAT_SPARSE_SUPER2:
+        context.progress.note('Bitmaps validating skipped due unsupported feature: meta_bg, bigalloc or sparse_super2')
+        return
+
+    used_blocks = context.used_blocks
+    for start, length in iter_metadata_blocks(img):
+        mark_blocks(img, used_blocks, start, length)
+
+    bpg = sb.s_blocks_per_group
+    blocks_count = merge_hi_lo(sb.s_blocks_count_hi, sb.s_blocks_count_lo) - sb.s_first_data_block
+    for bg_num, bg in enumerate(img.bg_descriptors):
+        if bg.bg_flags & BG_BLOCK_UNINIT:
+            continue
+        expected = used_blocks[bg_num * bpg // 8:(bg_num + 1) * bpg // 8]
+        first_block = sb.s_first_data_block + bg_num * bpg
+        difference = compare_bitmaps(expected, read_block_bitmap(img, bg), min(bpg, blocks_count - bg_num * bpg))
+        if difference.missing or difference.extra:
+            yield BlockBitmapDifference(bg_num, shift_runs(difference.missing, first_block),
+                                        shift_runs(difference.extra, first_block))
+
+    ipg = sb.s_inodes_per_group
+    used_inodes = get_used_inodes(img, context)
+    for bg_num, bg in enumerate(img.bg_descriptors):
+        expected = used_inodes[bg_num * ipg // 8:(bg_num + 1) * ipg // 8]
+        actual = bytes(ipg // 8) if bg.bg_flags & BG_INODE_UNINIT else read_inode_bitmap(img, bg)
+        difference = compare_bitmaps(expected, actual, ipg)
+        if difference.missing or difference.extra:
+            yield InodeBitmapDifference(bg_num, shift_runs(difference.missing, bg_num * ipg + 1),
+                                        shift_runs(difference.extra, bg_num * ipg + 1))
+
+
+def mark_blocks(img: Image, used_blocks: bytearray, start: int, length: int):
+    start -= img.sb.s_first_data_block
+    # out of range runs (corrupted extents) are ignored
+    if start >= 0 and (start + length + 7) // 8 <= len(used_blocks):
+        set_range(used_blocks, start, length)
+
+
+def has_super(sb, bg_num: int) -> bool:
+    """
+    Returns:
+        True if group `bg_num` holds a superblock copy (and the group descriptor table with reserved GDT blocks)
+    """
+    if bg_num <= 1 or not sb.s_feature_ro_compat & RO_COMPAT_SPARSE_SUPER:
+        return True
+    for base in (3, 5, 7):
+        power = base
+        while power < bg_num:
+            power *= base
+        if power == bg_num:
+            return True
+    return False
+
+
+def iter_metadata_blocks(img: Image) -> Iterator[Tuple[int, int]]:
+    """
+    Returns:
+        Iterator over `(start block, length)` of blocks not owned by inodes: superblock copies with
+        group descriptor tables, bitmaps and inode tables (wherever flex_bg put them), the resize inode tree root
+    """
+    sb = img.sb
+    sb_block_size = get_block_size(img)
+    groups_count = len(img.bg_descriptors)
+    gdt_blocks = -(-groups_count * sb.s_desc_size // sb_block_size)
+    inode_table_blocks = -(-sb.s_inodes_per_group * sb.s_inode_size // sb_block_size)
+    for bg_num, bg in enumerate(img.bg_descriptors):
+        if has_super(sb, bg_num):
+            first_block = sb.s_first_data_block + bg_num * sb.s_blocks_per_group
+            yield first_block, 1 + gdt_blocks + sb.s_reserved_gdt_blocks
+        yield merge_hi_lo(bg.bg_block_bitmap_hi, bg.bg_block_bitmap_lo), 1
+        yield merge_hi_lo(bg.bg_inode_bitmap_hi, bg.bg_inode_bitmap_lo), 1
+        yield merge_hi_lo(bg.bg_inode_table_hi, bg.bg_inode_table_lo), inode_table_blocks
+
+    if sb.s_feature_compat & COMPAT_RESIZE_INODE:
+        # i_block[EXT2_DIND_BLOCK] of the block mapped resize inode, its leaves are the reserved GDT blocks
+        resize_inode = get_inode(img.buffer, sb, img.bg_descriptors, RESIZE_INODE)
+        dind_block = int.from_bytes(resize_inode.i_block[52:56], 'little')
+        if dind_block:
+            yield dind_block, 1
+
+
+def get_used_inodes(img: Image, context: FsckContext) -> bytearray:
+    """
+    Returns:
+        Bitmap indexed by inode number - 1 (like on-disk inode bitmaps) of reserved inodes, inodes with
+        a non-zero links count and inodes referred to by directory entries
+    """
+    sb = img.sb
+    used_inodes = bytearray(len(img.bg_descriptors) * sb.s_inodes_per_group // 8)
+    set_range(used_inodes, 0, sb.s_first_ino - 1)
+    references = context.references
+    for inode_num in compress(count(), references.links_counts):
+        set_bit(used_inodes, inode_num - 1, True)
+    for inode_num in compress(count(), references.references):
+        if inode_num:
+            set_bit(used_inodes, inode_num - 1, True)
+    return used_inodes
+
+
+def shift_runs(runs: List[Tuple[int, int]], first: int) -> List[Tuple[int, int]]:
+    return [(first + start, length) for start, length in runs]
@@ -0,0 +1,132 @@
+"""
+Sidecar cache of pass 1 group reports for incremental fsck.
+
+Every group gets a digest of its descriptor, bitmaps, used inodes and the extent tree blocks of those
+inodes, everything `check_group` reads. A group whose digest didn't change since the previous run keeps its
+cached report (exceptions, inodes, block ownership summary), so nothing is checked twice and the result is
+the one of a full run. All of it is read for every group either way (the descriptor has no checksum of the
+inode table, an extent tree block can be corrupted without touching its inode): the savings are checking
+work. A changed group is checked from the bitmaps and inodes read for its digest, its extent tree blocks are
+read again.
+"""
+import json
+import os
+from hashlib import blake2b
+from typing import Optional, Tuple, Dict
+
+from ext4 import exceptions
+from ext4.block_group_descriptor import locate_block_group_descriptor
+from ext4.cat import iter_extents
+from ext4.buffers import read_at
+from ext4.core import Image
+from ext4.exceptions import restore_exception
+from ext4.structures import ext4_inode_codec
+from ext4.utils import merge_hi_lo, get_block_size
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.fsck-cache'
+
+
+def get_cache_path(img_path: str) -> str:
+    return img_path + CACHE_SUFFIX
+
+
+def get_image_key(img: Image) -> str:
+    """
+    Returns:
+        Identity of the filesystem: UUID, size and the features which change what pass 1 checks
+    """
+    sb = img.sb
+    size = merge_hi_lo(sb.s_blocks_count_hi, sb.s_blocks_count_lo) * get_block_size(img)
+    return '{}-{}-{:x}-{:x}-{:x}-{}'.format(sb.s_uuid.hex(), size, sb.s_feature_compat, sb.s_feature_incompat,
+                                            sb.s_feature_ro_compat, sb.s_inode_size)
+
+
+def digest_group(img: Image, bg_num: int, metadata) -> Tuple[str, int]:
+    """
+    Hash what `check_group` reads of group `bg_num`: the descriptor and extent tree blocks (read here),
+    initialized bitmaps and used inodes.
+
+    Args:
+        metadata: `fsck.GroupMetadata` of the group, its inodes in a list (they are hashed, then checked
+            if the digest changed)
+
+    Returns:
+        Hex digest and the number of bytes it covers
+    """
+    digest = blake2b(digest_size=16)
+    parts = [read_at(img.buffer, locate_block_group_descriptor(img, bg_num), img.sb.s_desc_size)]
+    parts.extend(bitmap for bitmap in (metadata.block_bitmap, metadata.inode_bitmap) if bitmap is not None)
+    parts.extend(raw for _, raw in metadata.inodes)
+    sb_block_size = get_block_size(img)
+    blocks_count = merge_hi_lo(img.sb.s_blocks_count_hi, img.sb.s_blocks_count_lo)
+    for _, raw in metadata.inodes:
+        try:
+            for _ in iter_extents(img.buffer, ext4_inode_codec.unpack_from(raw).i_block, sb_block_size,
+                                  on_node=lambda block_no, node: parts.append(node), blocks_count=blocks_count):
+                pass
+        except NotImplementedError:
+            pass
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest(), sum(len(part) for part in parts)
+
+
+class GroupCache:
+    """
+    Digests and reports of groups, stored as JSON in a file next to the image.
+    A missing, unreadable or foreign (other key or version) file is an empty cache.
+    """
+
+    def __init__(self, path: str, key: str, groups: Dict[int, Tuple[str, dict]] = None):
+        self.path = path
+        self.key = key
+        self.groups = groups or {}
+        # groups whose report came from the cache
+        self.hits = 0
+
+    @classmethod
+    def load(cls, path: str, key: str) -> 'GroupCache':
+        try:
+            with open(path) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return cls(path, key)
+        if content.get('version') != CACHE_VERSION or content.get('key') != key:
+            return cls(path, key)
+        return cls(path, key, {int(bg_num): (digest, report) for bg_num, (digest, report) in content['groups'].items()})
+
+    def get_digest(self, bg_num: int) -> Optional[str]:
+        digest, _ = self.groups.get(bg_num, (None, None))
+        return digest
+
+    def get_report(self, bg_num: int, report_type):
+        """
+        Args:
+            report_type: the report NamedTuple (`fsck.GroupReport`)
+        """
+        _, report = self.groups[bg_num]
+        self.hits += 1
+        return report_type(**dict(report, exceptions=decode_exceptions(report['exceptions']),
+                                  extent_block_exceptions=decode_exceptions(report['extent_block_exceptions'])))
+
+    def put(self, bg_num: int, digest: str, report):
+        report = report._asdict()
+        report.update(exceptions=encode_exceptions(report['exceptions']),
+                      extent_block_exceptions=encode_exceptions(report['extent_block_exceptions']))
+        self.groups[bg_num] = (digest, report)
+
+    def save(self):
+        # write then rename: an interrupted run leaves the previous cache
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'key': self.key, 'groups': self.groups}, f)
+        os.replace(tmp_path, self.path)
+
+
+def encode_exceptions(excs) -> list:
+    return [(type(exc).__name__, exc.args) for exc in excs]
+
+
+def decode_exceptions(encoded: list) -> list:
+    return [restore_exception(getattr(exceptions, name), tuple(args)) for name, args in encoded]
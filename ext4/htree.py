@@ -0,0 +1,207 @@
+from bisect import bisect_right
+from struct import unpack
+from typing import List, Optional, Tuple
+
+from ext4.cat import get_physical_block
+from ext4.buffers import read_at
+from ext4.structures import dx_root_info_codec, dx_countlimit_codec, dx_entry_codec
+
+MASK = 0xff_ff_ff_ff
+
+DX_HASH_LEGACY = 0
+DX_HASH_HALF_MD4 = 1
+DX_HASH_TEA = 2
+DX_HASH_LEGACY_UNSIGNED = 3
+DX_HASH_HALF_MD4_UNSIGNED = 4
+DX_HASH_TEA_UNSIGNED = 5
+
+EXT4_INDEX_FL = 0x1000
+COMPAT_DIR_INDEX = 0x20
+EXT2_FLAGS_UNSIGNED_HASH = 0x2
+EXT4_HTREE_EOF_32BIT = 0x7fff_ffff
+
+
+def is_indexed(sb, inode) -> bool:
+    return bool(sb.s_feature_compat & COMPAT_DIR_INDEX and inode.i_flags & EXT4_INDEX_FL)
+
+
+def rol32(x: int, s: int) -> int:
+    return ((x << s) | (x >> (32 - s))) & MASK
+
+
+def str2hashbuf(name: bytes, num: int, signed: bool) -> List[int]:
+    length = len(name)
+    pad = length | (length << 8)
+    pad = (pad | (pad << 16)) & MASK
+
+    buf = []
+    val = pad
+    for i, c in enumerate(name[:num * 4]):
+        if signed and c >= 0x80:
+            c -= 0x100
+        val = (c + (val << 8)) & MASK
+        if i % 4 == 3:
+            buf.append(val)
+            val = pad
+    if len(buf) < num:
+        buf.append(val)
+    buf.extend([pad] * (num - len(buf)))
+    return buf
+
+
+def dx_hack_hash(name: bytes, signed: bool) -> int:
+    hash0, hash1 = 0x12a3fe2d, 0x37abe8f9
+    for c in name:
+        if signed and c >= 0x80:
+            c -= 0x100
+        value = (hash1 + (hash0 ^ ((c * 7152373) & MASK))) & MASK
+        if value & 0x8000_0000:
+            value = (value - 0x7fff_ffff) & MASK
+        hash1, hash0 = hash0, value
+    return (hash0 << 1) & MASK
+
+
+def half_md4_transform(buf: List[int], data: List[int]):
+    a, b, c, d = buf
+
+    def f(x, y, z):
+        return z ^ (x & (y ^ z))
+
+    def g(x, y, z):
+        return ((x & y) + ((x ^ y) & z)) & MASK
+
+    def h(x, y, z):
+        return x ^ y ^ z
+
+    k2, k3 = 0o13240474631, 0o15666365641
+    for fn, k, order, shifts in ((f, 0, (0, 1, 2, 3, 4, 5, 6, 7), (3, 7, 11, 19)),
+                                 (g, k2, (1, 3, 5, 7, 0, 2, 4, 6), (3, 5, 9, 13)),
+                                 (h, k3, (3, 7, 2, 6, 1, 5, 0, 4), (3, 9, 11, 15))):
+        for i, idx in enumerate(order):
+            x = (data[idx] + k) & MASK
+            s = shifts[i % 4]
+            if i % 4 == 0:
+                a = rol32((a + fn(b, c, d) + x) & MASK, s)
+            elif i % 4 == 1:
+                d = rol32((d + fn(a, b, c) + x) & MASK, s)
+            elif i % 4 == 2:
+                c = rol32((c + fn(d, a, b) + x) & MASK, s)
+            else:
+                b = rol32((b + fn(c, d, a) + x) & MASK, s)
+
+    buf[0] = (buf[0] + a) & MASK
+    buf[1] = (buf[1] + b) & MASK
+    buf[2] = (buf[2] + c) & MASK
+    buf[3] = (buf[3] + d) & MASK
+
+
+def tea_transform(buf: List[int], data: List[int]):
+    total = 0
+    b0, b1 = buf[0], buf[1]
+    a, b, c, d = data
+    for _ in range(16):
+        total = (total + 0x9E3779B9) & MASK
+        b0 = (b0 + ((((b1 << 4) + a) & MASK) ^ ((b1 + total) & MASK) ^ (((b1 >> 5) + b) & MASK))) & MASK
+        b1 = (b1 + ((((b0 << 4) + c) & MASK) ^ ((b0 + total) & MASK) ^ (((b0 >> 5) + d) & MASK))) & MASK
+    buf[0] = (buf[0] + b0) & MASK
+    buf[1] = (buf[1] + b1) & MASK
+
+
+def dirhash(name: bytes, hash_version: int, seed: bytes = None) -> Tuple[int, int]:
+    """
+    Port of ext4fs_dirhash (fs/ext4/hash.c)
+
+    Args:
+        seed: sb.s_hash_seed
+    Returns:
+        A tuple `(major_hash, minor_hash)`
+    """
+    buf = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+    if seed and any(seed):
+        buf = list(unpack('<4L', seed))
+
+    minor_hash = 0
+    signed = hash_version < DX_HASH_LEGACY_UNSIGNED
+    if hash_version in (DX_HASH_LEGACY, DX_HASH_LEGACY_UNSIGNED):
+        major_hash = dx_hack_hash(name, signed)
+    elif hash_version in (DX_HASH_HALF_MD4, DX_HASH_HALF_MD4_UNSIGNED):
+        for start in range(0, len(name), 32):
+            half_md4_transform(buf, str2hashbuf(name[start:], 8, signed))
+        major_hash, minor_hash = buf[1], buf[2]
+    elif hash_version in (DX_HASH_TEA, DX_HASH_TEA_UNSIGNED):
+        for start in range(0, len(name), 16):
+            tea_transform(buf, str2hashbuf(name[start:], 4, signed))
+        major_hash, minor_hash = buf[0], buf[1]
+    else:
+        raise NotImplementedError('Unsupported directory hash version: {}'.format(hash_version))
+
+    major_hash &= ~1 & MASK
+    if major_hash == EXT4_HTREE_EOF_32BIT << 1:
+        major_hash = (EXT4_HTREE_EOF_32BIT - 1) << 1
+    return major_hash, minor_hash
+
+
+def parse_dx_entries(block, countlimit_offset: int) -> Tuple[List[int], List[int]]:
+    """
+    Returns:
+        Sorted hashes and logical block numbers of dx_entry array (hash of the first entry is 0)
+    """
+    countlimit = dx_countlimit_codec.unpack_from(block, countlimit_offset)
+    hashes, blocks = [], []
+    for entry in dx_entry_codec.iter_unpack(block, countlimit_offset, countlimit.count):
+        hashes.append(entry.hash)
+        blocks.append(entry.block)
+    if hashes:
+        hashes[0] = 0
+    return hashes, blocks
+
+
+def dx_find_leaf_blocks(buffer, sb, inode, name: str) -> Optional[List[int]]:
+    """
+    Walk the htree of directory `inode` down to leaf blocks which can contain `name`.
+
+    Returns:
+        Logical block numbers to scan (several if the hash collides across blocks) or None if the index
+        can't be used (unsupported hash, corrupted root) and the directory has to be scanned linearly
+    """
+    sb_block_size = 1024 << sb.s_log_block_size
+
+    def read_dir_block(lblk: int):
+        phys_block_no = get_physical_block(buffer, inode.i_block, lblk, sb_block_size)
+        if phys_block_no is None:
+            return None
+        return read_at(buffer, phys_block_no * sb_block_size, sb_block_size, category='directory data')
+
+    root = read_dir_block(0)
+    if root is None:
+        return None
+    # '.' entry is 12 bytes, '..' entry header starts at 12; dx_root_info starts at 0x18
+    root_info = dx_root_info_codec.unpack_from(root, 0x18)
+    if root_info.info_length != 8 or root_info.indirect_levels > 2:
+        return None
+    hash_version = root_info.hash_version
+    if hash_version <= DX_HASH_TEA and sb.s_flags & EXT2_FLAGS_UNSIGNED_HASH:
+        hash_version += DX_HASH_LEGACY_UNSIGNED
+    try:
+        target_hash, _ = dirhash(name.encode('utf-8'), hash_version, sb.s_hash_seed)
+    except NotImplementedError:
+        return None
+
+    node, countlimit_offset = root, 0x18 + root_info.info_length
+    for level in range(root_info.indirect_levels + 1):
+        hashes, blocks = parse_dx_entries(node, countlimit_offset)
+        if not blocks:
+            return None
+        idx = max(bisect_right(hashes, target_hash) - 1, 0)
+        if level == root_info.indirect_levels:
+            leaf_blocks = [blocks[idx]]
+            # names with the same hash may continue in the next leaf, marked by the low bit of its hash
+            while idx + 1 < len(blocks) and hashes[idx + 1] & ~1 == target_hash:
+                idx += 1
+                leaf_blocks.append(blocks[idx])
+            return leaf_blocks
+        node = read_dir_block(blocks[idx])
+        if node is None:
+            return None
+        # dx_node: fake dirent (8 bytes) spanning the whole block, then count/limit
+        countlimit_offset = 8
@@ -1,13 +1,17 @@
 import struct
 from enum import Enum
-from typing import Tuple, NamedTuple, List
+from typing import Tuple, NamedTuple, List, Optional, Iterable, Iterator
 import time
 
 from crc32c import crc32c
 
+from ext4.buffers import read_at
 from ext4.core import Image
-from ext4.structures import parse_struct, ext4_inode_struct
-from ext4.utils import zero_range
+from ext4.structures import ext4_inode_codec
+from ext4.utils import merge_hi_lo
+
+# inode tables are scanned by reads of at most this many bytes
+INODE_TABLE_CHUNK = 1 << 20
 
 
 def locate_inode(buffer, sb, bg_descriptors, inode_no: int) -> Tuple[int, int]:
@@ -28,24 +32,58 @@ def get_inode(buffer, sb, bg_descriptors, inode_no: int) -> NamedTuple:
 
     bg_num, inode_table_idx = locate_inode(buffer, sb, bg_descriptors, inode_no)
 
-    buffer.seek(bg_num * sb.s_blocks_per_group * s_block_size)
-    if bg_num == 0:
-        buffer.seek(sb.s_first_data_block * s_block_size, 1)
-    buffer.seek(s_block_size, 1)
-
     bg_desc = bg_descriptors[bg_num]
     bg_inode_table = (bg_desc.bg_inode_table_hi << struct.calcsize('L') * 8) + bg_desc.bg_inode_table_lo
-    buffer.seek(bg_inode_table * s_block_size, 0)
-
     offset_in_inode_table = sb.s_inode_size * inode_table_idx
-    buffer.seek(offset_in_inode_table, 1)
 
-    inode_raw = buffer.read(0x80)
-    inode = parse_struct(ext4_inode_struct, inode_raw)
+    inode_raw = read_at(buffer, bg_inode_table * s_block_size + offset_in_inode_table, 0x80)
+    inode = ext4_inode_codec.unpack_from(inode_raw)
 
     return inode
 
 
+def iter_inode_table(buffer, sb, bg, offsets: Iterable[int],
+                     chunk_size: int = INODE_TABLE_CHUNK) -> Iterator[Tuple[int, memoryview]]:
+    """
+    Read the inode table of group `bg` by large contiguous chunks (up to the last wanted inode)
+    and cut raw inodes out of them.
+
+    Args:
+        offsets: sorted indexes of wanted inodes in the table (e.g. used inodes of the bitmap)
+
+    Returns:
+        Iterator over `(offset, raw inode)`, a raw inode is a view into the current chunk
+    """
+    offsets = list(offsets)
+    if not offsets:
+        return
+    inode_size = sb.s_inode_size
+    table_start = merge_hi_lo(bg.bg_inode_table_hi, bg.bg_inode_table_lo) * (1024 << sb.s_log_block_size)
+    table_end = (offsets[-1] + 1) * inode_size
+    chunk, chunk_start = memoryview(b''), 0
+    for offset in offsets:
+        position = offset * inode_size
+        if position + inode_size > chunk_start + len(chunk):
+            chunk_start = position
+            chunk = memoryview(read_at(buffer, table_start + chunk_start, min(chunk_size, table_end - chunk_start)))
+        yield offset, chunk[position - chunk_start:position - chunk_start + inode_size]
+
+
+def get_inode_size(inode) -> int:
+    return (inode.i_size_high << 32) + inode.i_size_lo
+
+
+def get_inline_content(inode) -> Optional[bytes]:
+    """
+    Returns:
+        Content stored right in `i_block` (inline data or a fast symlink) or None if the inode has data blocks
+    """
+    _, filetype = parse_inode_mode(inode.i_mode)
+    if inode.i_flags == 0x10000000 or (filetype == FileType.SYMBOLIC_LINK and not inode.i_flags & 0x80000):
+        return inode.i_block[:inode.i_size_lo]
+    return None
+
+
 def format_inode_stat(inode, inode_number: int, leaf_extend_nodes: List = None) -> str:
     mode, filetype = parse_inode_mode(inode.i_mode)
     res = f'''Inode: {inode_number}   Type: {str(filetype)}    Mode:  {mode}   Flags: 0x{inode.i_flags:x}
@@ -110,11 +148,37 @@ class FileType(Enum):
 
 
 def calc_checksum(img: Image, inode_no: int, i_generation, raw, has_hi):
-    inode_to_checksum = struct.pack('<16s', img.sb.s_uuid)
-    inode_to_checksum += struct.pack('<L', inode_no)
-    inode_to_checksum += struct.pack('<L', i_generation)
-    inode_raw_zeros = zero_range(raw, 0x7c, 2)
+    return calc_inode_checksum(get_checksum_seed(img.sb), inode_no, i_generation, raw, has_hi)
+
+
+def get_checksum_seed(sb) -> int:
+    """
+    Returns:
+        crc32c of the filesystem UUID, the common prefix of metadata checksums
+    """
+    return crc32c(sb.s_uuid)
+
+
+def get_inode_checksum_seed(seed: int, inode_no: int, i_generation: int) -> int:
+    """
+    Returns:
+        `seed` (see `get_checksum_seed`) continued over inode number and generation, the common prefix of
+        checksums of blocks owned by this inode (extent tree, directory blocks)
+    """
+    return crc32c(struct.pack('<LL', inode_no, i_generation), seed)
+
+
+def calc_inode_checksum(seed: int, inode_no: int, i_generation: int, raw, has_hi: bool) -> int:
+    """
+    Continue `seed` (see `get_checksum_seed`) over inode number, generation and `raw` inode, the checksum fields
+    counted as zeros. `raw` is fed by slices, pass a `memoryview` to avoid any copying.
+    """
+    crc = crc32c(raw[:0x7c], get_inode_checksum_seed(seed, inode_no, i_generation))
+    crc = crc32c(b'\0\0', crc)  # i_checksum_lo
     if has_hi:
-        inode_raw_zeros = zero_range(inode_raw_zeros, 0x82, 2)
-    inode_to_checksum += inode_raw_zeros
-    return ~crc32c(inode_to_checksum) & (0xff_ff_ff_ff if has_hi else 0xff_ff)
+        crc = crc32c(raw[0x7e:0x82], crc)
+        crc = crc32c(b'\0\0', crc)  # i_checksum_hi
+        crc = crc32c(raw[0x84:], crc)
+    else:
+        crc = crc32c(raw[0x7e:], crc)
+    return ~crc & (0xff_ff_ff_ff if has_hi else 0xff_ff)
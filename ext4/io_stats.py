@@ -0,0 +1,173 @@
+"""
+I/O statistics of an image (`--io-stats`).
+
+`IoStatsBuffer` wraps the raw image buffer, under `BlockCache`, so it sees only the accesses which reach the
+image. It counts reads, writes, bytes, seeks (an access not starting where the previous one ended) and seek
+distance, in total and per category of data. Superblock, group descriptors, bitmaps and inode tables are told
+by offset, other blocks by the `category` which their reader passes to `buffers.read_at` and friends
+(extent tree nodes, directory blocks, file data), anything else is 'other'. Copies done by the kernel from
+the image file descriptor are reported with `buffers.note_read`.
+"""
+import threading
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from ext4.buffers import read_at, readinto_at, write_at, io_category
+
+CATEGORIES = ('superblock', 'descriptors', 'bitmaps', 'inode table', 'extent index', 'directory data',
+              'file data', 'other')
+
+
+class CategoryStats:
+    def __init__(self):
+        self.reads = 0
+        self.bytes_read = 0
+        self.writes = 0
+        self.bytes_written = 0
+        self.seeks = 0
+        self.seek_distance = 0
+
+    def add(self, other: 'CategoryStats'):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+IoStats = NamedTuple('IoStats', [('categories', Dict[str, CategoryStats]), ('total', CategoryStats),
+                                 ('read_sizes', Dict[int, int])])
+
+
+class IoStatsBuffer:
+    """
+    Positional wrapper counting accesses to `buffer`. Thread-safe.
+    """
+
+    def __init__(self, buffer):
+        self.name = buffer.name
+        self.buffer = buffer
+        # (start offset, end offset, category) of metadata at fixed places, sorted. The superblock region
+        # covers block 0 (the boot sector with 1 KiB blocks), which `BlockCache` reads whole
+        self._regions: List[Tuple[int, int, str]] = [(0, 0x800, 'superblock')]
+        self._starts = [0]
+        self._categories = {category: CategoryStats() for category in CATEGORIES}
+        # read sizes rounded up to a power of two
+        self._read_sizes = Counter()
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def set_layout(self, sb, bg_descriptors: list, gdt_offset: int):
+        """
+        Places of the group descriptor table, bitmaps and inode tables, once the superblock is parsed
+        """
+        block_size = 1024 << sb.s_log_block_size
+        regions = [(0, 0x800, 'superblock'),
+                   (gdt_offset, gdt_offset + len(bg_descriptors) * sb.s_desc_size, 'descriptors')]
+        inode_table_length = sb.s_inodes_per_group * sb.s_inode_size
+        for bg in bg_descriptors:
+            for hi, lo in ((bg.bg_block_bitmap_hi, bg.bg_block_bitmap_lo),
+                           (bg.bg_inode_bitmap_hi, bg.bg_inode_bitmap_lo)):
+                start = ((hi << 32) + lo) * block_size
+                regions.append((start, start + block_size, 'bitmaps'))
+            start = ((bg.bg_inode_table_hi << 32) + bg.bg_inode_table_lo) * block_size
+            regions.append((start, start + inode_table_length, 'inode table'))
+        regions.sort()
+        self._regions = regions
+        self._starts = [start for start, _, _ in regions]
+
+    def fileno(self) -> int:
+        return self.buffer.fileno()
+
+    def writable(self) -> bool:
+        return self.buffer.writable()
+
+    def read_at(self, offset: int, length: int) -> Union[bytes, memoryview]:
+        data = read_at(self.buffer, offset, length)
+        self.record(offset, len(data), False)
+        return data
+
+    def readinto_at(self, offset: int, view: memoryview) -> int:
+        read = readinto_at(self.buffer, offset, view)
+        self.record(offset, read, False)
+        return read
+
+    def write_at(self, offset: int, data: bytes) -> int:
+        written = write_at(self.buffer, offset, data)
+        self.record(offset, written, True)
+        return written
+
+    def note_read(self, offset: int, length: int):
+        self.record(offset, length, False)
+
+    def classify(self, offset: int) -> str:
+        idx = bisect_right(self._starts, offset) - 1
+        if idx >= 0:
+            start, end, category = self._regions[idx]
+            if offset < end:
+                return category
+        return io_category.get() or 'other'
+
+    def record(self, offset: int, length: int, is_write: bool):
+        category = self.classify(offset)
+        with self._lock:
+            stats = self._categories[category]
+            if offset != self._position:
+                stats.seeks += 1
+                stats.seek_distance += abs(offset - self._position)
+            self._position = offset + length
+            if is_write:
+                stats.writes += 1
+                stats.bytes_written += length
+            else:
+                stats.reads += 1
+                stats.bytes_read += length
+                self._read_sizes[1 << max(length - 1, 0).bit_length()] += 1
+
+    def stats(self) -> IoStats:
+        with self._lock:
+            total = CategoryStats()
+            categories = {}
+            for category, stats in self._categories.items():
+                copy = CategoryStats()
+                copy.add(stats)
+                categories[category] = copy
+                total.add(stats)
+            return IoStats(categories, total, dict(sorted(self._read_sizes.items())))
+
+
+def find_io_stats(buffer) -> Optional[IoStatsBuffer]:
+    """
+    Returns:
+        The `IoStatsBuffer` among `buffer` and the buffers it wraps, None if I/O is not counted
+    """
+    while buffer is not None:
+        if isinstance(buffer, IoStatsBuffer):
+            return buffer
+        buffer = getattr(buffer, 'buffer', None)
+    return None
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return '{} {}'.format(size, unit)
+        size //= 1024
+
+
+def format_io_stats(stats: IoStats, histogram_width: int = 40) -> Iterator[str]:
+    """
+    Returns:
+        Iterator over lines: a table of categories with any access, then a histogram of read sizes
+    """
+    yield '{: <16}{: >10}{: >14}{: >10}{: >14}{: >10}{: >16}'.format(
+        'I/O', 'reads', 'bytes read', 'writes', 'bytes written', 'seeks', 'seek distance')
+    rows = [(category, stats) for category, stats in stats.categories.items() if stats.reads or stats.writes]
+    for category, row in rows + [('total', stats.total)]:
+        yield '{: <16}{: >10}{: >14}{: >10}{: >14}{: >10}{: >16}'.format(
+            category, row.reads, row.bytes_read, row.writes, row.bytes_written, row.seeks, row.seek_distance)
+    if not stats.read_sizes:
+        return
+    yield 'Read sizes:'
+    most = max(stats.read_sizes.values())
+    for size, count in stats.read_sizes.items():
+        yield '{: >12} {: >10} {}'.format('<= ' + format_size(size), count,
+                                          '#' * max(1, round(count / most * histogram_width)))
@@ -1,13 +1,19 @@
 from pathlib import PurePosixPath
+from typing import Optional, Iterator, Tuple, NamedTuple
 
+from ext4.buffers import read_at
+from ext4.dcache import get_dentry_cache
+from ext4.htree import is_indexed, dx_find_leaf_blocks
 from ext4.inode import get_inode, FileType, parse_inode_mode
-from ext4.cat import cat_by_blocks
-from ext4.structures import parse_struct, ext4_dir_entry_2
+from ext4.cat import cat_by_blocks, get_physical_block, iter_extents, get_extent_len, is_extent_initialized
+from ext4.structures import ext4_dir_entry_2_codec
 from ext4.utils import say_when_last
 
 
 def ls(buffer, sb, bg_descriptors, inode_no, recursively=False):
     """
+    Entries are decoded block by block as the directory is read, so memory is bounded by one block
+    and the caller can stop early.
 
     Args:
         buffer:
@@ -16,46 +22,109 @@ def ls(buffer, sb, bg_descriptors, inode_no, recursively=False):
         inode_no:
 
     Returns:
-        List of tuples (dir_entry, entry_name, children_entries)
+        Iterator over tuples (dir_entry, entry_name, children_entries)
+    """
+    for block in iter_dir_blocks(buffer, sb, bg_descriptors, inode_no):
+        for entry_part1, name in iter_dir_block_entries(block):
+            if recursively and entry_part1.file_type == 2:  # if directory
+                if name != '.' and name != '..':
+                    yield entry_part1, name, ls(buffer, sb, bg_descriptors, entry_part1.inode, True)
+            else:
+                yield entry_part1, name, []
+
+
+def iter_dir_blocks(buffer, sb, bg_descriptors, inode_no) -> Iterator:
+    """
+    Returns:
+        Iterator over blocks of directory `inode_no`, one block is read at a time
     """
     inode = get_inode(buffer, sb, bg_descriptors, inode_no)
     _, file_type = parse_inode_mode(inode.i_mode)
     if file_type != FileType.DIRECTORY:
         raise ValueError('inode {} should be directory (not {})'.format(inode_no, str(file_type)))
-    data = b''.join(cat_by_blocks(buffer, sb, bg_descriptors, inode_no))
+    if inode.i_flags & 0x10000000:  # inline data
+        yield from cat_by_blocks(buffer, sb, bg_descriptors, inode_no)
+        return
+    sb_block_size = 1024 << sb.s_log_block_size
+    for extent in iter_extents(buffer, inode.i_block, sb_block_size):
+        if not is_extent_initialized(extent):  # preallocated, holds no entries
+            continue
+        phys_block_no = (extent.ee_start_hi << 32) + extent.ee_start_lo
+        for block_no in range(phys_block_no, phys_block_no + get_extent_len(extent)):
+            yield read_at(buffer, block_no * sb_block_size, sb_block_size, category='directory data')
+
+
+def iter_dir_block_entries(block) -> Iterator[Tuple[NamedTuple, str]]:
+    """
+    Returns:
+        Iterator over used entries `(dir_entry, name)` of one directory block
+    """
     offset = 0
-    while offset < len(data):
-        entry_part1_raw = data[offset:offset + 8]
-        entry_part1 = parse_struct(ext4_dir_entry_2, entry_part1_raw)
+    while offset < len(block):
+        dir_entry_2 = ext4_dir_entry_2_codec.unpack_from(block, offset)
+        if dir_entry_2.inode != 0:
+            # names are bytes on disk, an invalid UTF-8 sequence shouldn't stop a directory walk
+            yield dir_entry_2, str(block[offset + 8:offset + 8 + dir_entry_2.name_len], 'utf-8', 'replace')
+        if dir_entry_2.rec_len == 0:
+            raise ValueError('Corrupted directory block: zero rec_len at offset {}'.format(offset))
+        offset += dir_entry_2.rec_len
 
-        if entry_part1.inode != 0:
-            name_raw = data[offset + 8:offset + 8 + entry_part1.name_len]
-            name = name_raw.decode('utf-8')
 
-            if recursively and entry_part1.file_type == 2:  # if directory
-                if name != '.' and name != '..':
-                    yield entry_part1, name, ls(buffer, sb, bg_descriptors, entry_part1.inode, True)
-            else:
-                yield entry_part1, name, []
-        offset += entry_part1.rec_len
+def lookup_entry(buffer, sb, bg_descriptors, dir_inode_no: int, name: str) -> Optional[int]:
+    """
+    Find `name` in directory `dir_inode_no` through the dentry cache.
+
+    Returns:
+        Inode number or None if there is no such entry
+    """
+    dcache = get_dentry_cache(buffer)
+    hit, inode_no = dcache.lookup(dir_inode_no, name)
+    if hit:
+        return inode_no
+
+    dir_inode = get_inode(buffer, sb, bg_descriptors, dir_inode_no)
+    if is_indexed(sb, dir_inode):
+        leaf_blocks = dx_find_leaf_blocks(buffer, sb, dir_inode, name)
+        sb_block_size = 1024 << sb.s_log_block_size
+        phys_blocks = [get_physical_block(buffer, dir_inode.i_block, logical_block_no, sb_block_size)
+                       for logical_block_no in leaf_blocks or []]
+        # a leaf past the mapped blocks means a corrupted index, the directory is scanned linearly
+        if leaf_blocks is not None and None not in phys_blocks:
+            inode_no = None
+            for phys_block_no in phys_blocks:
+                block = read_at(buffer, phys_block_no * sb_block_size, sb_block_size, category='directory data')
+                for dir_entry_2, entry_name in iter_dir_block_entries(block):
+                    if entry_name == name:
+                        inode_no = dir_entry_2.inode
+                        break
+                if inode_no is not None:
+                    break
+            dcache.add(dir_inode_no, name, inode_no)
+            return inode_no
+
+    names = {}
+    for dir_entry_2, entry_name, _ in ls(buffer, sb, bg_descriptors, dir_inode_no):
+        names.setdefault(entry_name, dir_entry_2.inode)
+    dcache.add_directory(dir_inode_no, names)
+    return names.get(name)
 
 
 def path_to_inode(buffer, sb, bg_descriptors, path: PurePosixPath):
     if path == '/':
         return 2
-    cwd_inode_no = 2
-    cwd = '/'
     if path.root == '/':
         path = path.relative_to('/')
 
-    for part in path.parts:
-        for dir_entry_2, name, _ in ls(buffer, sb, bg_descriptors, cwd_inode_no):
-            if name == part:
-                cwd_inode_no = dir_entry_2.inode
-                cwd = name
-                break
-        else:
-            raise FileNotFoundError("Directory '{}' has no file '{}'".format(cwd, part))
+    dcache = get_dentry_cache(buffer)
+    parts = path.parts
+    cwd_inode_no, resolved = dcache.resolve_prefix(parts)
+    for depth in range(resolved, len(parts)):
+        inode_no = lookup_entry(buffer, sb, bg_descriptors, cwd_inode_no, parts[depth])
+        if inode_no is None:
+            cwd = parts[depth - 1] if depth else '/'
+            raise FileNotFoundError("Directory '{}' has no file '{}'".format(cwd, parts[depth]))
+        cwd_inode_no = inode_no
+        dcache.add_path(parts[:depth + 1], cwd_inode_no)
     return cwd_inode_no
 
 
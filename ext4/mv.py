@@ -83,7 +83,7 @@ def try_insert_into_space(img: Image, dir_entry: bytes, dest_directory_inode: in
         offset += entry_size
     else:
         return False
-    update_file(img, dest_directory_inode, offset, data)
+    update_file(img, dest_directory_inode, offset, data, category='directory data')
     return True
 
 
@@ -0,0 +1,218 @@
+"""
+Progress and metrics of an fsck run.
+
+`fsck` reports to a sink: a pass starts (with the number of work units if known), advances by units, inodes
+and bytes, finds exceptions and ends. `FsckProgress` only records per-pass metrics, `TtyProgress` also draws
+a rate-limited status line, and `write_json_report` dumps exceptions and metrics for monitoring.
+"""
+import json
+import time
+from typing import Optional, List, TextIO, Iterable
+
+from ext4.exceptions import FsckException
+from ext4.utils import format_rate
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+PASS_NAMES = {
+    0: 'superblock and group descriptors',
+    1: 'inodes, blocks and sizes',
+    2: 'directory structure',
+    3: 'directory connectivity',
+    4: 'reference counts',
+    5: 'group summary information',
+}
+# what a work unit of a pass is
+PASS_UNITS = {1: 'groups', 2: 'directories'}
+
+
+class PassMetrics:
+    def __init__(self, pass_no: int, total: Optional[int]):
+        self.pass_no = pass_no
+        self.total = total
+        self.done = 0
+        self.inodes = 0
+        self.bytes = 0
+        self.exceptions = 0
+        self.start = time.perf_counter()
+        self.seconds = 0.
+
+    def elapsed(self) -> float:
+        return self.seconds or time.perf_counter() - self.start
+
+    def eta(self) -> Optional[float]:
+        """
+        Returns:
+            Seconds left, assuming the remaining units take as long as the done ones, None if unknown
+        """
+        if not self.total or not self.done:
+            return None
+        return self.elapsed() * max(self.total - self.done, 0) / self.done
+
+    def as_dict(self) -> dict:
+        seconds = self.elapsed()
+        return {
+            'pass': self.pass_no,
+            'name': PASS_NAMES.get(self.pass_no),
+            'seconds': round(seconds, 6),
+            'done': self.done,
+            'total': self.total,
+            'inodes': self.inodes,
+            'bytes': self.bytes,
+            'inodes_per_second': round(self.inodes / seconds, 1) if seconds > 0 else None,
+            'bytes_per_second': round(self.bytes / seconds, 1) if seconds > 0 else None,
+            'exceptions': self.exceptions,
+        }
+
+
+class FsckProgress:
+    """
+    Silent sink: records metrics of every pass, notes (skipped checks) and the peak memory.
+    Subclasses draw the progress in `render`.
+    """
+
+    def __init__(self):
+        self.passes: List[PassMetrics] = []
+        self.notes: List[str] = []
+
+    @property
+    def current(self) -> Optional[PassMetrics]:
+        return self.passes[-1] if self.passes else None
+
+    def start_pass(self, pass_no: int, total: int = None):
+        """
+        Args:
+            total: number of work units of the pass (see `PASS_UNITS`), None if unknown
+        """
+        self.passes.append(PassMetrics(pass_no, total))
+        self.render()
+
+    def advance(self, done: int = 0, inodes: int = 0, bytes_read: int = 0):
+        metrics = self.current
+        if metrics is None:  # a pass run on its own
+            return
+        metrics.done += done
+        metrics.inodes += inodes
+        metrics.bytes += bytes_read
+        self.render()
+
+    def note(self, msg: str):
+        self.notes.append(msg)
+
+    def exception_found(self, exc: FsckException):
+        if self.current is not None:
+            self.current.exceptions += 1
+
+    def finish_pass(self):
+        self.current.seconds = time.perf_counter() - self.current.start
+        self.render(final=True)
+
+    def render(self, final: bool = False):
+        pass
+
+    def summary(self) -> dict:
+        return {
+            'seconds': round(sum(metrics.elapsed() for metrics in self.passes), 6),
+            'passes': [metrics.as_dict() for metrics in self.passes],
+            'notes': self.notes,
+            'peak_rss_kib': get_peak_rss(),
+        }
+
+
+class TtyProgress(FsckProgress):
+    """
+    Draws the current pass on one line of `stream` (overwritten at most every `interval` seconds) if it is
+    a terminal, and a line per finished pass in any case.
+    """
+
+    def __init__(self, stream: TextIO, interval: float = 0.5):
+        super().__init__()
+        self.stream = stream
+        self.interval = interval
+        self.is_tty = stream.isatty()
+        self.last_render = 0.
+
+    def note(self, msg: str):
+        super().note(msg)
+        self.clear()
+        self.stream.write(msg + '\n')
+
+    def exception_found(self, exc: FsckException):
+        super().exception_found(exc)
+        self.clear()  # the exception is printed next
+
+    def render(self, final: bool = False):
+        metrics = self.current
+        if final:
+            self.clear()
+            self.stream.write(format_pass_summary(metrics) + '\n')
+            self.stream.flush()
+            return
+        now = time.monotonic()
+        if not self.is_tty or now - self.last_render < self.interval:
+            return
+        self.last_render = now
+        self.stream.write('\r\x1b[K' + format_pass_status(metrics))
+        self.stream.flush()
+
+    def clear(self):
+        if self.is_tty and self.last_render:
+            self.stream.write('\r\x1b[K')
+            self.last_render = 0.
+
+
+def format_pass_status(metrics: PassMetrics) -> str:
+    parts = ['pass {}: {}'.format(metrics.pass_no, PASS_NAMES.get(metrics.pass_no, ''))]
+    if metrics.total:
+        parts.append('{}/{} {} ({:.0%})'.format(metrics.done, metrics.total, PASS_UNITS.get(metrics.pass_no, ''),
+                                               min(metrics.done / metrics.total, 1)))
+    seconds = metrics.elapsed()
+    if seconds > 0 and (metrics.inodes or metrics.bytes):
+        parts.append('{:.0f} inodes/s'.format(metrics.inodes / seconds))
+        parts.append(format_rate(metrics.bytes, seconds))
+    eta = metrics.eta()
+    if eta is not None:
+        parts.append('ETA {}'.format(format_seconds(eta)))
+    return ', '.join(parts)
+
+
+def format_pass_summary(metrics: PassMetrics) -> str:
+    seconds = metrics.elapsed()
+    summary = 'pass {}: {} done in {:.3f}s'.format(metrics.pass_no, PASS_NAMES.get(metrics.pass_no, ''), seconds)
+    if metrics.inodes or metrics.bytes:
+        summary += ', {} inodes, {} bytes ({})'.format(metrics.inodes, metrics.bytes,
+                                                       format_rate(metrics.bytes, seconds))
+    if metrics.exceptions:
+        summary += ', {} problems'.format(metrics.exceptions)
+    return summary
+
+
+def format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+
+
+def get_peak_rss() -> Optional[dict]:
+    """
+    Returns:
+        Peak resident set size in KiB of this process and of its finished children (pass 1 workers),
+        None if unknown
+    """
+    if resource is None:
+        return None
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def write_json_report(stream: TextIO, exceptions: Iterable[FsckException], progress: FsckProgress):
+    report = {
+        'exceptions': [{'pass': exc.pass_no, 'type': type(exc).__name__, 'message': str(exc)}
+                       for exc in exceptions],
+        'metrics': progress.summary(),
+    }
+    json.dump(report, stream, indent=2)
+    stream.write('\n')
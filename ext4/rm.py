@@ -1,6 +1,7 @@
 from pathlib import PurePosixPath
 
 from ext4.core import Image
+from ext4.dcache import get_dentry_cache
 from ext4.inode import get_inode, parse_inode_mode, FileType
 from ext4.ls import path_to_inode
 from ext4.tools import free_inode, ls, unlink
@@ -17,5 +18,6 @@ def rm(img: Image, filepath: PurePosixPath):
             if name == '.' or name == '..':
                 continue
             rm(img, filepath / name)
+        get_dentry_cache(img.buffer).invalidate_directory(inode_no)
     free_inode(img, inode_no)
     unlink(img, filepath)
@@ -1,10 +1,10 @@
-from struct import unpack, pack
+from struct import Struct, calcsize
 from collections import namedtuple
-from typing import List, Tuple
+from typing import List, Tuple, Iterator
 
 # Describe structures. None means field don't use in this program
 superblock_struct = (
-    ('<L', None),  # ('<L', 's_inodes_count'),
+    ('<L', 's_inodes_count'),
     ('L', 's_blocks_count_lo'),
     ('L', None),  # ('L', 's_r_blocks_count_lo'),
     ('L', None),  # ('L', 's_free_blocks_count_lo'),
@@ -33,7 +33,7 @@ superblock_struct = (
     ('L', None),  # ('L', 's_rev_level'),
     ('H', None),  # ('H', 's_def_resuid'),
     ('H', None),  # ('H', 's_def_resgid'),
-    ('L', None),  # ('L', None),  # ('L', 's_first_ino'),
+    ('L', 's_first_ino'),
 
     # used in inode addressing algorithm: to locate inode in specific group's inode_table with given index
     # offset_in_group_table |-> offset_in_group_table * sb.s_inode_size
@@ -41,10 +41,10 @@ superblock_struct = (
 
     ('H', None),  # ('H', 's_block_group_nr'),
 
-    ('L', None),  # ('L', None),  # ('L', 's_feature_compat'),
+    ('L', 's_feature_compat'),
 
     ('L', 's_feature_incompat'),
-    ('L', None),  # ('L', None),  # ('L', 's_feature_ro_compat'),
+    ('L', 's_feature_ro_compat'),
 
     ('16s', 's_uuid'),
     ('16s', None),  # ('16s', 's_volume_name'),
@@ -52,13 +52,13 @@ superblock_struct = (
     ('L', None),  # ('L', None),  # ('L', 's_algorithm_usage_bitmap'),
     ('B', None),  # ('B', 's_prealloc_blocks'),
     ('B', None),  # ('B', 's_prealloc_dir_blocks'),
-    ('H', None),  # ('H', 's_reserved_gdt_blocks'),
+    ('H', 's_reserved_gdt_blocks'),
     ('16s', None),  # ('16s', 's_journal_uuid'),
     ('L', None),  # ('L', 's_journal_inum'),
     ('L', None),  # ('L', 's_journal_dev'),
     ('L', None),  # ('L', 's_last_orphan'),
-    ('16s', None),  # ('16s', 's_hash_seed'),
-    ('B', None),  # ('B', 's_def_hash_version'),
+    ('16s', 's_hash_seed'),
+    ('B', 's_def_hash_version'),
     ('B', None),  # ('B', 's_jnl_backup_type'),
     ('H', 's_desc_size'),
     ('L', None),  # ('L', 's_default_mount_opts'),
@@ -70,7 +70,7 @@ superblock_struct = (
     ('L', None),  # ('L', 's_free_blocks_count_hi'),
     ('H', None),  # ('H', 's_min_extra_isize'),
     ('H', None),  # ('H', 's_want_extra_isize'),
-    ('L', None),  # ('L', 's_flags', ''),
+    ('L', 's_flags'),
     ('H', None),  # ('H', 's_raid_stride'),
     ('H', None),  # ('H', 's_mmp_interval'),
     ('Q', None),  # ('Q', 's_mmp_block'),
@@ -152,10 +152,12 @@ ext4_inode_struct = (
     ('4s', None),  # ('4s', 'osd1'),  # 0x24:0x28
     ('60s', 'i_block'),  # 0x28:0x64
     ('L', 'i_generation'),  #
-    ('L', None),  # ('L', 'i_file_acl_lo'),
-    ('L', None),  # ('L', 'i_size_high / i_dir_acl'),
+    ('L', 'i_file_acl_lo'),
+    ('L', 'i_size_high'),  # i_dir_acl in ext2
     ('L', None),  # ('L', 'i_obso_faddr'),
-    ('8s', None),
+    ('H', None),  # ('H', 'i_blocks_high'),
+    ('H', 'i_file_acl_high'),
+    ('4s', None),  # uid/gid high
     ('H', 'i_checksum_lo'),
     ('H', None)
 )
@@ -175,13 +177,13 @@ ext4_inode_extra_struct = (
 ext4_extent_header_struct = (
     ('<2s', 'eh_magic'),
     ('H', 'eh_entries'),
-    ('H', None),  # ('H', 'eh_max'),
+    ('H', 'eh_max'),
     ('H', 'eh_depth'),
     ('L', None),  # ('L', 'eh_generation'),
 )
 
 ext4_extent_idx_struct = (
-    ('<L', None),  # ('L', 'ei_block'),
+    ('<L', 'ei_block'),
     ('L', 'ei_leaf_lo'),
     ('H', 'ei_leaf_hi'),
     ('2s', None),  # ('16B', 'ei_unused'),
@@ -201,6 +203,26 @@ ext4_dir_entry_2 = (
     ('B', 'file_type'),
 )
 
+# htree (dir_index). dx_root_info follows the fake '.' and '..' entries in the first directory block
+dx_root_info_struct = (
+    ('<L', None),  # ('<L', 'reserved_zero'),
+    ('B', 'hash_version'),
+    ('B', 'info_length'),
+    ('B', 'indirect_levels'),
+    ('B', None),  # ('B', 'unused_flags'),
+)
+
+# overlaps the hash of the first dx_entry
+dx_countlimit_struct = (
+    ('<H', 'limit'),
+    ('H', 'count'),
+)
+
+dx_entry_struct = (
+    ('<L', 'hash'),
+    ('L', 'block'),
+)
+
 
 def get_struct_fields(struct: Tuple[Tuple[str, str]]) -> List[str]:
     return [field[1] if field[1] else f'c_{i}' for i, field in enumerate(struct)]
@@ -210,15 +232,76 @@ def get_struct_format(struct: Tuple[Tuple[str, str]]) -> str:
     return ''.join([field[0] for field in struct])
 
 
-cached_namedtuples = {}
+class Codec:
+    """
+    Struct description compiled once into `struct.Struct` and a record type.
+    """
+
+    def __init__(self, struct: Tuple[Tuple[str, str]], name='Struct'):
+        fmt = get_struct_format(struct)
+        self.struct = Struct(fmt)
+        self.size = self.struct.size
+        self.record = namedtuple(name, get_struct_fields(struct))
+        self._make = self.record._make
+
+        # field name -> (offset, Struct), for decoding a single field without the whole record
+        self.fields = {}
+        byte_order = fmt[0] if fmt[0] in '<>!=@' else ''
+        for i, (field_fmt, field_name) in enumerate(struct):
+            if field_name:
+                field_offset = calcsize(get_struct_format(struct[:i])) if i else 0
+                self.fields[field_name] = (field_offset, Struct(byte_order + field_fmt.lstrip('<>!=@')))
+
+    def unpack_from(self, raw, offset: int = 0) -> namedtuple:
+        return self._make(self.struct.unpack_from(raw, offset))
 
+    def iter_unpack(self, raw, offset: int = 0, count: int = None) -> Iterator[namedtuple]:
+        """
+        Decode `count` consecutive records (all remaining if None) in one call
+        """
+        view = memoryview(raw)
+        if count is None:
+            count = (len(view) - offset) // self.size
+        return map(self._make, self.struct.iter_unpack(view[offset:offset + count * self.size]))
 
-def parse_struct(struct: Tuple[Tuple[str, str]], raw: bytes) -> namedtuple:
-    if struct not in cached_namedtuples:
-        cached_namedtuples[struct] = namedtuple('Struct', get_struct_fields(struct))
-    unpacked = unpack(get_struct_format(struct), raw)
-    return cached_namedtuples[struct](*unpacked)
+    def unpack_field(self, raw, field_name: str, offset: int = 0):
+        field_offset, field_struct = self.fields[field_name]
+        return field_struct.unpack_from(raw, offset + field_offset)[0]
+
+    def pack(self, data) -> bytes:
+        return self.struct.pack(*data)
+
+
+# id(struct) -> (struct, codec); struct descriptions are module constants, so identity is a cheap key
+cached_codecs = {}
+
+
+def get_codec(struct: Tuple[Tuple[str, str]]) -> Codec:
+    try:
+        return cached_codecs[id(struct)][1]
+    except KeyError:
+        codec = Codec(struct)
+        cached_codecs[id(struct)] = (struct, codec)
+        return codec
+
+
+def parse_struct(struct: Tuple[Tuple[str, str]], raw: bytes, offset: int = 0) -> namedtuple:
+    """
+    Decode `struct` from `raw` starting at `offset`. `raw` can be any buffer (`bytes`, `memoryview`, `mmap`...)
+    """
+    return get_codec(struct).unpack_from(raw, offset)
 
 
 def repack_struct(data: namedtuple, struct: Tuple[Tuple[str, str]]) -> bytes:
-    return pack(get_struct_format(struct), *data)
+    return get_codec(struct).pack(data)
+
+
+ext4_inode_codec = get_codec(ext4_inode_struct)
+ext4_inode_extra_codec = get_codec(ext4_inode_extra_struct)
+ext4_extent_header_codec = get_codec(ext4_extent_header_struct)
+ext4_extent_idx_codec = get_codec(ext4_extent_idx_struct)
+ext4_extent_codec = get_codec(ext4_extent_struct)
+ext4_dir_entry_2_codec = get_codec(ext4_dir_entry_2)
+dx_root_info_codec = get_codec(dx_root_info_struct)
+dx_countlimit_codec = get_codec(dx_countlimit_struct)
+dx_entry_codec = get_codec(dx_entry_struct)
@@ -1,12 +1,14 @@
 from pathlib import PurePosixPath
 from struct import pack
 
-from ext4.cat import cat_by_blocks
+from ext4.bitmap import get_bit, set_bit
+from ext4.cat import cat_by_blocks, iter_mapped_range
+from ext4.buffers import read_at, write_at
 from ext4.core import Image
+from ext4.dcache import get_dentry_cache
 from ext4.inode import get_inode, locate_inode
 from ext4.ls import path_to_inode, ls as ls_by_inode
 from ext4.structures import get_struct_format, ext4_dir_entry_2
-from ext4.utils import get_value_from_bitmap, set_value_in_bitmap
 
 
 def cat(buffer, sb, bg_descriptors, path: PurePosixPath) -> bytes:
@@ -26,19 +28,24 @@ def stat(buffer, sb, bg_descriptors, path: PurePosixPath):
 
 
 def occupy_block_if_free(img: Image, block_no: int) -> bool:
+    """
+    Mark `block_no` used in its group's block bitmap if it is free. The group is counted from
+    `s_first_data_block` (block 1 on 1 KiB-block images). The bitmap checksum is not updated.
+
+    Returns:
+        True if the block was free and is now marked used, False if it was already used (nothing written)
+    """
     sb_block_size = 1024 << img.sb.s_log_block_size
-    bg_no = block_no // img.sb.s_blocks_per_group
+    bg_no, offset = divmod(block_no - img.sb.s_first_data_block, img.sb.s_blocks_per_group)
     bg = img.bg_descriptors[bg_no]
-    bitmap_blk_no = (bg.bg_block_bitmap_hi << 32) + bg.bg_block_bitmap_lo
-    img.buffer.seek(bitmap_blk_no * sb_block_size)
+    bitmap_offset = ((bg.bg_block_bitmap_hi << 32) + bg.bg_block_bitmap_lo) * sb_block_size
 
-    bitmap = img.buffer.read(sb_block_size)
-    offset = block_no % img.sb.s_blocks_per_group
-    if get_value_from_bitmap(bitmap, offset):
-        img.buffer.seek(-sb_block_size, 1)
-        set_value_in_bitmap(img.buffer, offset, True)
-        return True
-    return False
+    bitmap = bytearray(read_at(img.buffer, bitmap_offset, sb_block_size))
+    if get_bit(bitmap, offset):
+        return False
+    set_bit(bitmap, offset, True)
+    write_at(img.buffer, bitmap_offset + offset // 8, bitmap[offset // 8:offset // 8 + 1])
+    return True
 
 
 def free_inode(img: Image, inode_no: int) -> bool:
@@ -46,35 +53,35 @@ def free_inode(img: Image, inode_no: int) -> bool:
     bg_no, idx = locate_inode(*img, inode_no)
     # TODO checksums!!!
     bg = img.bg_descriptors[bg_no]
-    bitmap_blk_no = (bg.bg_inode_bitmap_hi << 32) + bg.bg_inode_bitmap_lo
-    img.buffer.seek(bitmap_blk_no * sb_block_size)
-    bitmap_raw = img.buffer.read(sb_block_size)
-    img.buffer.seek(-sb_block_size, 1)
-    set_value_in_bitmap(img.buffer, idx, False)
+    bitmap_offset = ((bg.bg_inode_bitmap_hi << 32) + bg.bg_inode_bitmap_lo) * sb_block_size
+    bitmap_raw = bytearray(read_at(img.buffer, bitmap_offset, sb_block_size))
+    set_bit(bitmap_raw, idx, False)
+    write_at(img.buffer, bitmap_offset + idx // 8, bitmap_raw[idx // 8:idx // 8 + 1])
     # TODO set new checksum
     # new_cs = calc_bitmap_checksum(img, bitmap_raw)
-    # locate_block_group_descriptor(img, bg_no)
-    # img.buffer.seek(0x1A, 1)
-    # img.buffer.write(pack('<H', new_cs & 0xffff))
-    # img.buffer.seek(4, 1)
-    # img.buffer.write(pack('<L', new_cs >> 32))
-    # locate_block_group_descriptor(img, bg_no)
-    # new_bg = parse_struct(block_group_descriptor_struct, img.buffer.read(img.sb.s_desc_size))
+    # bg_offset = locate_block_group_descriptor(img, bg_no)
+    # write_at(img.buffer, bg_offset + 0x1A, pack('<H', new_cs & 0xffff))
+    # write_at(img.buffer, bg_offset + 0x3A, pack('<H', new_cs >> 16))
+    # new_bg = parse_struct(block_group_descriptor_struct, read_at(img.buffer, bg_offset, img.sb.s_desc_size))
     # img.bg_descriptors[bg_no] = new_bg
 
 
 
-def update_file(img: Image, inode_no: int, offset: int, data: bytes):
+def update_file(img: Image, inode_no: int, offset: int, data: bytes, category: str = 'file data'):
+    """
+    Args:
+        category: kind of data written, 'directory data' for a directory (see `io_stats`)
+    """
     sb_block_size = (1024 << img.sb.s_log_block_size)
+    inode = get_inode(*img, inode_no)
+    # the file may be a directory
+    get_dentry_cache(img.buffer).invalidate_directory(inode_no)
     left = 0
-    for _ in cat_by_blocks(*img, inode_no):
-        offset -= sb_block_size
-        if offset < 0:
-            img.buffer.seek(offset, 1)
-            img.buffer.write(data[left:min(-offset, len(data))])
-            left = -offset
-        if left >= len(data):
-            return
+    for phys_offset, segment_length in iter_mapped_range(img.buffer, inode.i_block, offset, len(data), sb_block_size):
+        if phys_offset is None:
+            raise NotImplementedError("Can't write into a hole or an unwritten extent")
+        write_at(img.buffer, phys_offset, data[left:left + segment_length], category=category)
+        left += segment_length
 
 
 def unlink(img: Image, path: PurePosixPath):
@@ -101,4 +108,4 @@ def unlink(img: Image, path: PurePosixPath):
     else:
         raise FileNotFoundError(f"File {path.name} not found in directory {path.parent}")
     dir_inode = path_to_inode(*img, path.parent)
-    update_file(img, dir_inode, offset, data)
+    update_file(img, dir_inode, offset, data, category='directory data')
@@ -5,9 +5,13 @@ from os import path
 from pathlib import PurePosixPath
 from typing import ContextManager
 
+from benchmarks.make_image import make_image, pack_inode, BLOCK_SIZE
 from ext4.fsck import fsck
 from ext4.tools import ls
+from ext4.buffers import write_at
 from ext4.core import Image, open_img
+from ext4.inode import get_inode, get_checksum_seed, locate_inode
+from ext4.utils import get_block_size, merge_hi_lo
 
 TEST_IMAGES_FOLDER = path.join('tests', 'images')
 TEST_OUTPUT_FOLDER = path.join('tests', 'outputs')
@@ -44,3 +48,31 @@ def assert_file_exists(img: Image, filepath: PurePosixPath, expect_to_exists: bo
         assert filepath.name in parent_list, "File {} must exist!".format(filepath)
     else:
         assert filepath.name not in parent_list, "File {} must not exist!".format(filepath)
+
+
+def write_inode(img: Image, inode_no: int, raw: bytes):
+    """
+    Overwrite inode `inode_no` in its inode table with `raw`.
+    """
+    bg_num, idx = locate_inode(*img, inode_no)
+    bg = img.bg_descriptors[bg_num]
+    offset = merge_hi_lo(bg.bg_inode_table_hi, bg.bg_inode_table_lo) * get_block_size(img) + idx * img.sb.s_inode_size
+    write_at(img.buffer, offset, raw)
+
+
+def make_image_with_hole(image_path: str, hole_blocks: int = 1) -> str:
+    """
+    Returns:
+        Path of a generated image whose inode 12 (file_0) has 3 runs of `hole_blocks` blocks, the middle run
+        is dropped from its extents and reads as a hole
+    """
+    image = make_image(image_path, files=1, fanout=1, depth=0, file_size=3 * hole_blocks * BLOCK_SIZE,
+                       fragments=3)
+    with open_img(image.path, write=True) as img:
+        inode = get_inode(*img, 12)
+        i_block = bytearray(inode.i_block)
+        i_block[2:4] = (2).to_bytes(2, 'little')  # eh_entries
+        i_block[24:36] = i_block[36:48]  # drop the middle extent
+        write_inode(img, 12, pack_inode(12, get_checksum_seed(img.sb), inode.i_mode, 3 * hole_blocks * BLOCK_SIZE,
+                                        1, 2 * hole_blocks, inode.i_flags, bytes(i_block)))
+    return image.path
@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from ext4 import bitmap
+from ext4.bitmap import iter_set_bits, count_set_bits, iter_runs, compare_bitmaps, get_bit, set_bit, set_range
+
+
+def reference_bits(raw: bytes, limit: int = None):
+    bits = [bool(raw[i // 8] >> (i % 8) & 1) for i in range(len(raw) * 8)]
+    return bits if limit is None else bits[:limit]
+
+
+def reference_runs(bits, value: bool):
+    runs, start = [], None
+    for idx, bit in enumerate(bits + [not value]):
+        if bit == value and start is None:
+            start = idx
+        elif bit != value and start is not None:
+            runs.append((start, idx - start))
+            start = None
+    return runs
+
+
+@pytest.fixture(params=['numpy', 'lookup_table'])
+def engine(request, monkeypatch):
+    if request.param == 'numpy':
+        if bitmap.numpy is None:
+            pytest.skip('require numpy')
+    else:
+        monkeypatch.setattr(bitmap, 'numpy', None)
+    return request.param
+
+
+@pytest.mark.parametrize('raw, limit', [
+    (b'', None),
+    (b'', 5),
+    (b'\xff', 13),  # limit past the end
+    (b'\x00\x00', None),
+    (b'\xff\xff\xff', None),
+    (b'\xff\xff\xff', 20),
+    (bytes([0b1010_0101, 0xff, 0x00, 0b1000_0000]), None),
+    (bytes([0b1010_0101, 0xff, 0x00, 0b1000_0000]), 31),
+    (bytes(random.Random(0).getrandbits(8) for _ in range(1024)), None),
+    (bytes(random.Random(1).choice((0, 0xff, 0x0f)) for _ in range(1024)), 8000),
+])
+def test_bitmap(engine, raw: bytes, limit: int):
+    bits = reference_bits(raw, limit)
+    assert list(iter_set_bits(raw, limit)) == [idx for idx, bit in enumerate(bits) if bit]
+    assert count_set_bits(raw, limit) == sum(bits)
+    assert list(iter_runs(raw, True, limit)) == reference_runs(bits, True)
+    assert list(iter_runs(raw, False, limit)) == reference_runs(bits, False)
+
+
+def test_compare_bitmaps(engine):
+    expected = bytes([0b0000_1111, 0xff, 0x00])
+    actual = bytes([0b0011_1100, 0x0f, 0x01])
+    difference = compare_bitmaps(expected, actual)
+    assert difference.missing == [(0, 2), (12, 4)]
+    assert difference.extra == [(4, 2), (16, 1)]
+    assert compare_bitmaps(expected, expected) == ([], [])
+
+
+def test_get_set_bit():
+    raw = bytearray(2)
+    set_bit(raw, 9, True)
+    assert raw == b'\x00\x02' and get_bit(raw, 9) and not get_bit(raw, 8)
+    set_bit(raw, 9, False)
+    assert raw == bytes(2)
+
+
+@pytest.mark.parametrize('start, length', [(0, 0), (3, 2), (0, 16), (5, 20), (8, 8), (7, 25)])
+def test_set_range(start: int, length: int):
+    raw = bytearray(5)
+    set_range(raw, start, length)
+    assert list(iter_set_bits(raw)) == list(range(start, start + length))
@@ -0,0 +1,37 @@
+from os import path
+from pathlib import PurePosixPath
+
+from ext4.core import open_img
+from ext4.inode import get_inode
+from ext4.ls import path_to_inode
+from ext4.tools import cat, update_file
+from tests.conftest import TEST_IMAGES_FOLDER, open_temp_img
+
+
+def test_cache_hit():
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), cache_size=16) as img:
+        get_inode(*img, 12)
+        misses = img.buffer.misses
+        get_inode(*img, 12)
+        assert img.buffer.misses == misses
+        assert img.buffer.hits >= 1
+
+
+def test_cache_eviction():
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), cache_size=1) as img:
+        for block_no in range(4):
+            img.buffer.get_block(block_no)
+        assert img.buffer.evictions == 3
+        assert img.buffer.stats().size == 1
+
+
+def test_cache_invalidated_on_write():
+    with open_temp_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), write=True) as img:
+        filepath = PurePosixPath('/Test2.txt')
+        inode_no = path_to_inode(*img, filepath)
+        source_content = cat(*img, filepath)
+        cat(*img, filepath)  # warm up the cache
+
+        update_file(img, inode_no, 0, b'new')
+
+        assert cat(*img, filepath) == b'new' + source_content[3:]
@@ -3,7 +3,10 @@ from os import path
 import pytest
 
 from ext4.core import open_img
-from ext4.cat import cat_by_blocks
+from ext4.cat import cat_by_blocks, iter_extents, travers_extent_tree, plan_reads
+from ext4.inode import get_inode
+from ext4.structures import ext4_extent_codec
+from ext4.utils import get_block_size
 
 
 @pytest.mark.parametrize('img, expected_content_file, inode', [
@@ -22,6 +25,18 @@ def test_read_file(img: str, expected_content_file: str, inode: int):
                 assert block == f.read(len(block))
 
 
+@pytest.mark.parametrize('img, expected_content_file, inode', [
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17),
+])
+def test_read_file__mmap(img: str, expected_content_file: str, inode: int):
+    with open(expected_content_file, 'rb') as f:
+        with open_img(img, use_mmap=True) as image_tuple:
+            for block in cat_by_blocks(*image_tuple, inode):
+                assert block == f.read(len(block))
+
+
 @pytest.mark.skipif(not path.exists(path.join('tests', 'images', 'big_1.img')), reason='require big image')
 @pytest.mark.parametrize('img, expected_content_file, inode', [
     (path.join('tests', 'images', 'big_1.img'),
@@ -39,3 +54,38 @@ def test_read_file__big(img: str, expected_content_file: str, inode: int):
         with open_img(img) as image_tuple:
             for block in cat_by_blocks(*image_tuple, inode):
                 assert block == f.read(len(block))
+
+
+@pytest.mark.parametrize('img, inode, start, end', [
+    (path.join('tests', 'images', 'small_1.img'), 17, 0, None),
+    (path.join('tests', 'images', 'small_1.img'), 17, 1, 10),
+    (path.join('tests', 'images', 'small_1.img'), 19, 0, 1),
+])
+def test_iter_extents__range(img: str, inode: int, start: int, end: int):
+    with open_img(img) as image_tuple:
+        inode_data = get_inode(*image_tuple, inode)
+        block_size = get_block_size(image_tuple)
+        all_extents = travers_extent_tree(image_tuple.buffer, inode_data.i_block, block_size)
+        expected = [extent for extent in all_extents
+                    if extent.ee_block + extent.ee_len > start and (end is None or extent.ee_block < end)]
+        assert list(iter_extents(image_tuple.buffer, inode_data.i_block, block_size, start, end)) == expected
+
+
+def test_plan_reads():
+    extents = [
+        ext4_extent_codec.record(ee_block=0, ee_len=2, ee_start_hi=0, ee_start_lo=100),
+        ext4_extent_codec.record(ee_block=2, ee_len=3, ee_start_hi=0, ee_start_lo=102),  # contiguous
+        ext4_extent_codec.record(ee_block=5, ee_len=1, ee_start_hi=0, ee_start_lo=200),
+    ]
+    segments = list(plan_reads(iter(extents), 1024, 5 * 1024 + 10, max_chunk=2048))
+    assert segments == [(100 * 1024, 2048), (102 * 1024, 2048), (104 * 1024, 1024), (200 * 1024, 10)]
+
+
+def test_plan_reads__holes():
+    extents = [
+        ext4_extent_codec.record(ee_block=2, ee_len=1, ee_start_hi=0, ee_start_lo=100),  # blocks 0-1 are a hole
+        ext4_extent_codec.record(ee_block=3, ee_len=32768 + 2, ee_start_hi=0, ee_start_lo=101),  # unwritten
+        ext4_extent_codec.record(ee_block=5, ee_len=1, ee_start_hi=0, ee_start_lo=103),
+    ]
+    segments = list(plan_reads(iter(extents), 1024, 8 * 1024, max_chunk=4096))
+    assert segments == [(None, 2048), (100 * 1024, 1024), (None, 2048), (103 * 1024, 1024), (None, 2048)]
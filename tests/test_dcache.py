@@ -0,0 +1,44 @@
+from os import path
+from pathlib import PurePosixPath
+
+import pytest
+
+import ext4.ls
+from ext4.core import open_img
+from ext4.dcache import get_dentry_cache
+from ext4.ls import path_to_inode
+from ext4.mv import mv
+from tests.conftest import TEST_IMAGES_FOLDER, open_temp_img
+
+
+def test_one_scan_per_directory(monkeypatch):
+    scanned = []
+    ls = ext4.ls.ls
+
+    def counting_ls(buffer, sb, bg_descriptors, inode_no, recursively=False):
+        scanned.append(inode_no)
+        return ls(buffer, sb, bg_descriptors, inode_no, recursively)
+
+    monkeypatch.setattr(ext4.ls, 'ls', counting_ls)
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img')) as img:
+        assert path_to_inode(*img, PurePosixPath('/TestDir1/Test1_1.txt')) == 17
+        assert path_to_inode(*img, PurePosixPath('/TestDir1/TestDir1_1')) == 19
+        with pytest.raises(FileNotFoundError):
+            path_to_inode(*img, PurePosixPath('/TestDir1/missing.txt'))
+        with pytest.raises(FileNotFoundError):
+            path_to_inode(*img, PurePosixPath('/TestDir1/missing.txt'))
+    assert scanned == [2, 15]
+
+
+def test_invalidated_by_mv():
+    with open_temp_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), write=True) as img:
+        inode_no = path_to_inode(*img, PurePosixPath('/Test2.txt'))
+        with pytest.raises(FileNotFoundError):
+            path_to_inode(*img, PurePosixPath('/TestDir2/Test2.txt'))
+
+        mv(img, PurePosixPath('/Test2.txt'), PurePosixPath('/TestDir2'))
+
+        assert path_to_inode(*img, PurePosixPath('/TestDir2/Test2.txt')) == inode_no
+        with pytest.raises(FileNotFoundError):
+            path_to_inode(*img, PurePosixPath('/Test2.txt'))
+        assert get_dentry_cache(img.buffer).lookup(2, 'Test2.txt') == (True, None)
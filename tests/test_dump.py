@@ -0,0 +1,70 @@
+import io
+import tempfile
+from os import path
+
+import pytest
+
+from benchmarks.make_image import BLOCK_SIZE
+from ext4.core import open_img
+from ext4.dump import dump, copy_inode
+from tests.conftest import make_image_with_hole
+
+
+@pytest.mark.parametrize('img, expected_content_file, inode', [
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17),
+])
+def test_dump(img: str, expected_content_file: str, inode: int):
+    with open(expected_content_file, 'rb') as f:
+        expected_content = f.read()
+    with open_img(img) as image_tuple, tempfile.TemporaryDirectory() as temp_dir:
+        dest = path.join(temp_dir, 'dump')
+        dump(*image_tuple, inode, dest)
+        with open(dest, 'rb') as f:
+            assert f.read() == expected_content
+
+
+@pytest.mark.parametrize('img, expected_content_file, inode', [
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17),
+])
+def test_copy_inode__buffered(img: str, expected_content_file: str, inode: int):
+    with open(expected_content_file, 'rb') as f:
+        expected_content = f.read()
+    with open_img(img) as image_tuple:
+        dest = io.BytesIO()  # no file descriptor, falls back to a buffered copy
+        copy_inode(*image_tuple, inode, dest)
+        assert dest.getvalue() == expected_content
+
+
+@pytest.fixture
+def img_with_hole(tmp_path):
+    """
+    Returns:
+        Path of an image whose inode 12 has blocks 0 and 2 of file_0, block 1 is a hole
+    """
+    return make_image_with_hole(str(tmp_path / 'generated.img'))
+
+
+@pytest.mark.parametrize('mode, old_content, position', [
+    ('ab', b'prefix', 6),  # O_APPEND ignores seeks
+    ('r+b', b'x' * 5 * BLOCK_SIZE, 0),  # old content past the position
+    (None, b'x' * 5 * BLOCK_SIZE, 0),  # the same through a buffered copy
+], ids=['append', 'overwrite', 'buffered'])
+def test_copy_inode__holes(img_with_hole: str, tmp_path, mode: str, old_content: bytes, position: int):
+    block = ('{:08}\n'.format(0).encode() * BLOCK_SIZE)[:BLOCK_SIZE]
+    content = block + bytes(BLOCK_SIZE) + block
+    expected = old_content[:position] + content + old_content[position + len(content):]
+    dest_path = tmp_path / 'dest'
+    dest_path.write_bytes(old_content)
+    with open_img(img_with_hole) as img:
+        if mode is None:
+            dest = io.BytesIO(old_content)
+            copy_inode(*img, 12, dest)
+            assert dest.getvalue() == expected
+        else:
+            with open(dest_path, mode) as dest:
+                copy_inode(*img, 12, dest)
+            assert dest_path.read_bytes() == expected
@@ -0,0 +1,50 @@
+import os
+import tempfile
+from os import path
+
+import pytest
+
+from benchmarks.make_image import make_image, pack_inode
+from ext4.cat import get_physical_block
+from ext4.buffers import write_at
+from ext4.core import open_img
+from ext4.extract import extract
+from ext4.inode import get_inode, parse_inode_mode, get_checksum_seed
+from ext4.utils import get_block_size
+from tests.conftest import write_inode
+
+
+@pytest.mark.parametrize('img, expected_content_file, relative_path, inode', [
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     path.join('TestDir1', 'Test1_1.txt'),
+     17),
+])
+def test_extract(img: str, expected_content_file: str, relative_path: str, inode: int):
+    with open(expected_content_file, 'rb') as f:
+        expected_content = f.read()
+    with open_img(img) as image_tuple, tempfile.TemporaryDirectory() as temp_dir:
+        extracted = extract(*image_tuple, 2, temp_dir, jobs=2)
+
+        host_path = path.join(temp_dir, relative_path)
+        assert host_path in [file.path for file in extracted]
+        with open(host_path, 'rb') as f:
+            assert f.read() == expected_content
+        inode_data = get_inode(*image_tuple, inode)
+        mode, _ = parse_inode_mode(inode_data.i_mode)
+        assert os.stat(host_path).st_mode & 0o7777 == int(mode, 8)
+        assert int(os.stat(host_path).st_mtime) == inode_data.i_mtime
+
+
+def test_extract__slow_symlink(tmp_path):
+    target = b'../' + b'long_name/' * 10  # too long for i_block, stored in a data block
+    image = make_image(str(tmp_path / 'generated.img'), files=1, fanout=1, depth=0, file_size=len(target))
+    with open_img(image.path, write=True) as img:
+        inode = get_inode(*img, 12)
+        block_size = get_block_size(img)
+        block_no = get_physical_block(img.buffer, inode.i_block, 0, block_size)
+        write_at(img.buffer, block_no * block_size, target.ljust(block_size, b'\0'))
+        write_inode(img, 12, pack_inode(12, get_checksum_seed(img.sb), 0o120777, len(target), 1, 1, inode.i_flags,
+                                        inode.i_block))
+        extract(*img, 2, str(tmp_path / 'extracted'))
+    assert os.readlink(tmp_path / 'extracted' / 'file_0') == target.decode()
@@ -1,33 +1,239 @@
+import pickle
 from os import path
+from struct import pack, pack_into, unpack_from
 from typing import Set
 
 import pytest
+from crc32c import crc32c
 
+from benchmarks.make_image import make_image, pack_inode, seal_dir_block
+from ext4.bitmap import iter_runs, set_bit
+from ext4.block_group_descriptor import read_block_bitmap
+from ext4.cat import get_physical_block, cat_by_blocks
+from ext4.buffers import read_at, write_at
 from ext4.core import open_img
-from ext4.fsck import fsck
+from ext4.fsck import fsck, SharedBlocksExcFactory, ReferenceCountExcFactory, pass_5, FsckContext, pass_1, \
+    check_dir_block, check_extent_block
+from ext4.inode import calc_inode_checksum, get_inode, get_checksum_seed, get_inode_checksum_seed
 from ext4.exceptions import WrongSuperBlockChecksum, WrongBlockGroupDescriptorChecksum, WrongInodeBitmapChecksum, \
-    WrongBlockBitmapChecksum, WrongInodeChecksum, FsckException, SharedBlock, Coincidences, UnconnectedInode
-from tests.conftest import TEST_IMAGES_FOLDER
+    WrongBlockBitmapChecksum, WrongInodeChecksum, FsckException, SharedBlock, Coincidences, UnconnectedInode, \
+    InvalidReferenceCount, BlockBitmapDifference, WrongDirBlockChecksum, MissingDirBlockTail, \
+    CorruptedDirEntry, WrongExtentBlockChecksum, CorruptedExtentBlock, InvalidDirEntryInode, WrongDirEntryFileType, \
+    InodeBitmapDifference
+from ext4.utils import get_block_size, merge_hi_lo
+from tests.conftest import TEST_IMAGES_FOLDER, open_temp_img, write_inode
 
 
-@pytest.mark.parametrize('test_file, exc_list', [
+@pytest.mark.parametrize('test_file, exc_list, bitmap_leftovers', [
     (path.join(TEST_IMAGES_FOLDER, 'superblock_wrong_checksum.img'),
-     {WrongSuperBlockChecksum()}),
+     {WrongSuperBlockChecksum()}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'block_group_descriptor_wrong_checksum.img'),
-     {WrongBlockGroupDescriptorChecksum(0, 0xcdc1, 0xcd21)}),
+     {WrongBlockGroupDescriptorChecksum(0, 0xcdc1, 0xcd21)}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'inode_bitmap_wrong_checksum.img'),
-     {WrongInodeBitmapChecksum(0, 0x0fd97df6, 0x0f767df6)}),
+     {WrongInodeBitmapChecksum(0, 0x0fd97df6, 0x0f767df6)}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'block_bitmap_wrong_checksum.img'),
-     {WrongBlockBitmapChecksum(0, 0xfa91794d, 0x0091794d)}),
+     {WrongBlockBitmapChecksum(0, 0xfa91794d, 0x0091794d)}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'inode_12_wrong_checksum.img'),
-     {WrongInodeChecksum(12, 0xadf1, 0x64ca, fmt='<H')}),
+     {WrongInodeChecksum(12, 0xadf1, 0x64ca, fmt='<H')}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'shared_blocks.img'),
-     {SharedBlock(13, Coincidences({1366}, {14})), SharedBlock(14, Coincidences({1366}, {13}))}),
+     {SharedBlock(13, Coincidences({1366}, {14})), SharedBlock(14, Coincidences({1366}, {13}))}, 1),
     (path.join(TEST_IMAGES_FOLDER, 'unconnected_inode.img'),
-     {UnconnectedInode(15), *{UnconnectedInode(i) for i in range(17, 22)}}),
+     {UnconnectedInode(15), *{UnconnectedInode(i) for i in range(17, 22)}}, 0),
     (path.join(TEST_IMAGES_FOLDER, 'small_1.img'),
-     set())
+     set(), 0)
 ])
-def test_checksums(test_file, exc_list: Set[FsckException]):
+def test_checksums(test_file, exc_list: Set[FsckException], bitmap_leftovers: int):
+    """
+    Args:
+        bitmap_leftovers: number of groups with blocks still marked after the image was corrupted by hand
+            (a block an inode no longer points to), reported as free blocks marked in the block bitmap
+    """
     with open_img(test_file) as img:
-        assert set(fsck(img)) == exc_list
+        exceptions = set(fsck(img))
+    leftovers = {exc for exc in exceptions if isinstance(exc, BlockBitmapDifference) and ' +' not in str(exc)}
+    assert len(leftovers) == bitmap_leftovers
+    assert exceptions - leftovers == exc_list
+
+
+@pytest.mark.parametrize('test_file', [
+    path.join(TEST_IMAGES_FOLDER, 'shared_blocks.img'),
+    path.join(TEST_IMAGES_FOLDER, 'unconnected_inode.img'),
+    path.join(TEST_IMAGES_FOLDER, 'small_1.img'),
+])
+def test_fsck__jobs(test_file):
+    with open_img(test_file) as img:
+        assert list(fsck(img, jobs=2)) == list(fsck(img))
+
+
+def test_exception_pickle():
+    exc = WrongInodeChecksum(12, 0xadf1, 0x64ca, fmt='<H')
+    assert pickle.loads(pickle.dumps(exc)) == exc
+
+
+def test_shared_blocks_factory():
+    factory = SharedBlocksExcFactory()
+    factory.record_inode(13, [(100, 10), (200, 1)])
+    factory.record_inode(14, [(105, 2), (300, 5)])
+    factory.record_inode(15, [(302, 10), (200, 1)])
+    assert list(factory.collect_coincidences().items()) == [
+        (14, Coincidences({105, 106, 302, 303, 304}, {13, 15})),
+        (13, Coincidences({105, 106, 200}, {14, 15})),
+        (15, Coincidences({200, 302, 303, 304}, {13, 14})),
+    ]
+
+
+@pytest.mark.parametrize('has_hi', [False, True])
+def test_calc_inode_checksum(has_hi: bool):
+    uuid, raw = bytes(range(16)), bytes(range(256))
+    zeroed = bytearray(raw)
+    zeroed[0x7c:0x7e] = bytes(2)
+    if has_hi:
+        zeroed[0x82:0x84] = bytes(2)
+    expected = ~crc32c(uuid + pack('<LL', 12, 7) + zeroed) & (0xff_ff_ff_ff if has_hi else 0xff_ff)
+    assert calc_inode_checksum(crc32c(uuid), 12, 7, memoryview(raw), has_hi) == expected
+
+
+def test_fsck__state_not_shared_between_runs():
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'unconnected_inode.img')) as img:
+        assert list(fsck(img))
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img')) as img:
+        assert list(fsck(img)) == []
+
+
+def test_reference_count_factory():
+    factory = ReferenceCountExcFactory(20)
+    for inode, links_count, references in ((12, 1, 1), (13, 2, 1), (14, 1, 0xffff + 10)):
+        factory.record_links_count(inode, links_count)
+        for _ in range(references):
+            factory.record_reference(inode)
+    assert factory.references[14] == 0xffff
+    assert list(factory.create([12, 13, 14])) == [InvalidReferenceCount(13, 1, 2), InvalidReferenceCount(14, 0xffff, 1)]
+    assert list(factory.create([12, 13, 14], dir_nlink=True)) == [InvalidReferenceCount(13, 1, 2)]
+
+
+def test_pass_5__block_bitmap():
+    with open_temp_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), write=True) as img:
+        bg = img.bg_descriptors[0]
+        block_bitmap = bytearray(read_block_bitmap(img, bg))
+        free_start, _ = next(iter_runs(block_bitmap, False))
+        set_bit(block_bitmap, 0, False)  # the superblock
+        set_bit(block_bitmap, free_start, True)
+        block_bitmap_offset = merge_hi_lo(bg.bg_block_bitmap_hi, bg.bg_block_bitmap_lo) * get_block_size(img)
+        write_at(img.buffer, block_bitmap_offset, block_bitmap)
+
+        context = FsckContext(img)
+        list(pass_1(img, context))
+        first_block = img.sb.s_first_data_block
+        assert list(pass_5(img, context)) == [
+            BlockBitmapDifference(0, [(first_block, 1)], [(first_block + free_start, 1)])
+        ]
+
+
+def make_dir_block(entries, block_size: int = 1024, inode_seed: int = None) -> bytearray:
+    """
+    Args:
+        entries: `(inode, name)`, the last entry spans the block (up to the checksum tail if `inode_seed`)
+    """
+    end = block_size - 12 if inode_seed is not None else block_size
+    block, offset = bytearray(block_size), 0
+    for idx, (inode, name) in enumerate(entries):
+        rec_len = end - offset if idx == len(entries) - 1 else (8 + len(name) + 3) // 4 * 4
+        block[offset:offset + 8 + len(name)] = pack('<LHBB', inode, rec_len, len(name), 1) + name
+        offset += rec_len
+    if inode_seed is not None:
+        block[end:] = pack('<LHBBL', 0, 12, 0, 0xDE, ~crc32c(bytes(block[:end]), inode_seed) & 0xff_ff_ff_ff)
+    return block
+
+
+@pytest.mark.parametrize('inode_seed', [None, 0x1234])
+def test_check_dir_block(inode_seed):
+    block = make_dir_block([(2, b'.'), (2, b'..'), (12, b'file')], inode_seed=inode_seed)
+    assert check_dir_block(block, 2, 0, inode_seed) == ([], 1012 if inode_seed else 1024)
+
+    block[4:6] = pack('<H', 0)
+    exceptions, end = check_dir_block(block, 2, 0, inode_seed)
+    assert end == 0 and exceptions[-1] == CorruptedDirEntry(2, 0, 0, 0, 1)
+    if inode_seed:
+        assert isinstance(exceptions[0], WrongDirBlockChecksum)
+
+
+def test_check_dir_block__missing_tail():
+    block = make_dir_block([(2, b'.'), (2, b'..')])
+    assert check_dir_block(block, 2, 0, 0x1234) == ([MissingDirBlockTail(2, 0)], 1024)
+
+
+def test_check_extent_block():
+    block = bytearray(1024)
+    block[:12] = pack('<2sHHHL', bytes.fromhex('0A F3'), 1, 84, 0, 0)
+    block[12:24] = pack('<LHHL', 0, 1, 0, 100)
+    tail = 12 + 12 * 84
+    block[tail:tail + 4] = pack('<L', ~crc32c(bytes(block[:tail]), 0x1234) & 0xff_ff_ff_ff)
+    assert list(check_extent_block(block, 12, 500, 0x1234)) == []
+    assert list(check_extent_block(block, 12, 500)) == []
+
+    block[20] ^= 1
+    assert isinstance(next(check_extent_block(block, 12, 500, 0x1234)), WrongExtentBlockChecksum)
+    block[0] = 0
+    assert list(check_extent_block(block, 12, 500, 0x1234)) == [CorruptedExtentBlock(12, 500)]
+
+
+@pytest.fixture
+def generated_img(tmp_path):
+    # root entries: lost+found (11), file_0 (12), file_1 (13) and file_2 (14), inodes 15 and 16 are free
+    image = make_image(str(tmp_path / 'generated.img'), files=3, fanout=1, depth=0, file_size=0)
+    with open_img(image.path, write=True) as img:
+        yield img
+
+
+def set_root_entry(img, name: bytes, inode: int, file_type: int):
+    """
+    Point entry `name` of the (linear) root directory to `inode` typed `file_type`, with a valid checksum
+    """
+    block_size = get_block_size(img)
+    block_no = get_physical_block(img.buffer, get_inode(*img, 2).i_block, 0, block_size)
+    block = bytearray(read_at(img.buffer, block_no * block_size, block_size))
+    offset = 0
+    while block[offset + 8:offset + 8 + len(name) + 1] != name + b'\0':
+        offset += unpack_from('<H', block, offset + 4)[0]
+    pack_into('<L', block, offset, inode)
+    block[offset + 7] = file_type
+    seal_dir_block(block, get_inode_checksum_seed(get_checksum_seed(img.sb), 2, 0))
+    write_at(img.buffer, block_no * block_size, block)
+
+
+def test_pass_2__inode_out_of_range(generated_img):
+    set_root_entry(generated_img, b'file_1', 10 ** 9, 1)
+    assert list(fsck(generated_img)) == [InvalidDirEntryInode(2, 'file_1', 10 ** 9), UnconnectedInode(13)]
+
+
+def test_pass_2__free_directory_inode(generated_img):
+    set_root_entry(generated_img, b'file_1', 15, 2)
+    assert list(fsck(generated_img)) == [InvalidDirEntryInode(2, 'file_1', 15), UnconnectedInode(13),
+                                         InodeBitmapDifference(0, [(15, 1)], [])]
+
+
+def test_pass_5__referred_inode_not_marked(generated_img):
+    set_root_entry(generated_img, b'file_1', 16, 1)
+    # links count of the free inode is not checked by pass 4, its bitmap bit is by pass 5
+    assert list(fsck(generated_img)) == [InvalidDirEntryInode(2, 'file_1', 16), UnconnectedInode(13),
+                                         InodeBitmapDifference(0, [(16, 1)], [])]
+
+
+def test_pass_2__symlink_as_directory(generated_img):
+    symlink = pack_inode(13, get_checksum_seed(generated_img.sb), 0o120777, 6, 1, i_block=b'file_2'.ljust(60, b'\0'))
+    write_inode(generated_img, 13, symlink)
+    set_root_entry(generated_img, b'file_1', 13, 2)
+    assert list(fsck(generated_img)) == [WrongDirEntryFileType(2, 'file_1', 13), UnconnectedInode(13)]
+
+
+def test_pass_2__extent_block_out_of_image(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=1, fanout=1, depth=0, file_size=8192, extent_depth=1)
+    with open_img(image.path, write=True) as img:
+        inode = get_inode(*img, 12)
+        i_block = bytearray(inode.i_block)
+        pack_into('<LLH', i_block, 12, 0, 10 ** 6, 0)  # the only index entry
+        write_inode(img, 12, pack_inode(12, get_checksum_seed(img.sb), inode.i_mode, 8192, 1, 3, inode.i_flags,
+                                        bytes(i_block)))
+        exceptions = list(fsck(img))
+        assert CorruptedExtentBlock(12, 10 ** 6) in exceptions
+        assert b''.join(cat_by_blocks(*img, 12)) == bytes(8192)
@@ -0,0 +1,82 @@
+from os import path
+from struct import pack, unpack_from
+
+from benchmarks.make_image import make_image
+from ext4.buffers import write_at
+from ext4.core import open_img
+from ext4.exceptions import InvalidReferenceCount, WrongExtentBlockChecksum
+from ext4.fsck import fsck
+from ext4.group_cache import GroupCache, get_image_key
+from ext4.inode import get_inode, locate_inode
+from ext4.io_stats import find_io_stats
+from ext4.progress import FsckProgress
+from ext4.utils import merge_hi_lo, get_block_size
+from tests.conftest import TEST_IMAGES_FOLDER, open_temp_img
+
+
+def run_incremental(img, cache_path):
+    progress = FsckProgress()
+    exceptions = list(fsck(img, progress=progress, cache_path=cache_path))
+    return exceptions, GroupCache.load(cache_path, get_image_key(img)), progress.notes
+
+
+def test_incremental_fsck(tmp_path):
+    cache_path = str(tmp_path / 'small_1.img.fsck-cache')
+    with open_temp_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img'), write=True) as img:
+        groups_count = len(img.bg_descriptors)
+        exceptions, cache, notes = run_incremental(img, cache_path)
+        assert exceptions == list(fsck(img)) and len(cache.groups) == groups_count
+        assert notes == ['0/{} groups unchanged since the last run'.format(groups_count)]
+        assert run_incremental(img, cache_path)[2] == ['{0}/{0} groups unchanged since the last run'.format(groups_count)]
+
+        # only the group of the changed inode is checked again
+        bg_num, idx = locate_inode(*img, 12)
+        bg = img.bg_descriptors[bg_num]
+        inode_table = merge_hi_lo(bg.bg_inode_table_hi, bg.bg_inode_table_lo) * get_block_size(img)
+        write_at(img.buffer, inode_table + idx * img.sb.s_inode_size + 0x1a, pack('<H', 7))
+        exceptions, _, notes = run_incremental(img, cache_path)
+        assert exceptions == list(fsck(img))
+        assert InvalidReferenceCount(12, 1, 7) in exceptions
+        assert notes == ['{}/{} groups unchanged since the last run'.format(groups_count - 1, groups_count)]
+
+
+def test_group_cache__foreign_key(tmp_path):
+    cache_path = str(tmp_path / 'cache')
+    cache = GroupCache(cache_path, 'key')
+    cache.groups[0] = ('digest', {})
+    cache.save()
+    assert GroupCache.load(cache_path, 'key').get_digest(0) == 'digest'
+    assert GroupCache.load(cache_path, 'other key').get_digest(0) is None
+    assert GroupCache.load(str(tmp_path / 'missing'), 'key').groups == {}
+
+
+def test_incremental_fsck__io(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=50, fanout=2, depth=1, file_size=5000, extent_depth=1)
+    cache_path = str(tmp_path / 'generated.img.fsck-cache')
+
+    def run(cache_path=None):
+        with open_img(image.path, cache_size=0, io_stats=True) as img:
+            list(fsck(img, cache_path=cache_path))
+            return find_io_stats(img.buffer).stats().categories
+
+    full = run()
+    first, again = run(cache_path), run(cache_path)
+    # changed groups are checked from the bitmaps and inodes read for their digest, extent trees are read again
+    for category in ('bitmaps', 'inode table'):
+        assert first[category].bytes_read == again[category].bytes_read == full[category].bytes_read, category
+    assert full['extent index'].bytes_read > 0
+    extent_index = [stats['extent index'].bytes_read for stats in (full, first, again)]
+    assert extent_index[0] > 0 and extent_index == [extent_index[0], 2 * extent_index[0], extent_index[0]]
+
+
+def test_incremental_fsck__extent_block(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=4, fanout=1, depth=0, file_size=5000, extent_depth=1)
+    cache_path = str(tmp_path / 'generated.img.fsck-cache')
+    with open_img(image.path, write=True) as img:
+        assert run_incremental(img, cache_path)[0] == []
+        # the leaf block of file_0 changes, its inode doesn't
+        leaf_block = unpack_from('<L', get_inode(*img, 12).i_block, 16)[0]
+        write_at(img.buffer, leaf_block * get_block_size(img) + 100, b'\xff')
+        exceptions = run_incremental(img, cache_path)[0]
+        assert exceptions == list(fsck(img))
+        assert [type(exc) for exc in exceptions] == [WrongExtentBlockChecksum]
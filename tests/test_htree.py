@@ -0,0 +1,26 @@
+import uuid
+
+import pytest
+
+from ext4.htree import dirhash, DX_HASH_LEGACY, DX_HASH_HALF_MD4, DX_HASH_TEA
+
+SEED = uuid.UUID('7f7ddbb1-2b07-427d-86b3-70b76ae8278f').bytes
+LONG_NAME = 'file_ЖЖЖ_500_long_name_more_than_32_bytes_xxxxxxxxxx.txt'.encode('utf-8')
+
+
+# expected values are computed by `debugfs -R "dx_hash -h <alg> [-s <seed>] <name>"`
+@pytest.mark.parametrize('name, hash_version, seed, expected', [
+    (b'file_500.txt', DX_HASH_LEGACY, SEED, (0x6a4a1be4, 0)),
+    (b'file_500.txt', DX_HASH_HALF_MD4, SEED, (0xd5a70492, 0x3d248a82)),
+    (b'file_500.txt', DX_HASH_TEA, SEED, (0x51743156, 0x8f780669)),
+    (LONG_NAME, DX_HASH_LEGACY, None, (0xa441ea2a, 0)),
+    (LONG_NAME, DX_HASH_HALF_MD4, None, (0x63eed612, 0x4f294460)),
+    (LONG_NAME, DX_HASH_TEA, None, (0x14f2a6e6, 0xc448598c)),
+])
+def test_dirhash(name: bytes, hash_version: int, seed: bytes, expected):
+    assert dirhash(name, hash_version, seed) == expected
+
+
+def test_dirhash__unsupported():
+    with pytest.raises(NotImplementedError):
+        dirhash(b'name', 6)
@@ -0,0 +1,66 @@
+import io
+from pathlib import PurePosixPath
+
+import pytest
+
+from benchmarks.make_image import make_image
+from ext4.buffers import FileBuffer, read_at
+from ext4.core import open_img
+from ext4.dump import copy_inode
+from ext4.io_stats import IoStatsBuffer, find_io_stats, format_io_stats
+from ext4.ls import path_to_inode
+
+
+@pytest.fixture(scope='module')
+def generated_img(tmp_path_factory):
+    return make_image(str(tmp_path_factory.mktemp('io_stats') / 'generated.img'), files=20, fanout=2, depth=1,
+                      file_size=20_000, fragments=2, extent_depth=1).path
+
+
+@pytest.mark.parametrize('cache_size', [0, 16])
+def test_io_stats(generated_img: str, cache_size: int):
+    with open_img(generated_img, cache_size=cache_size, io_stats=True) as img:
+        inode_no = path_to_inode(*img, PurePosixPath('/dir_1/file_2'))
+        copy_inode(*img, inode_no, io.BytesIO())
+        stats = find_io_stats(img.buffer).stats()
+
+    categories = stats.categories
+    for category in ('superblock', 'descriptors', 'inode table', 'extent index', 'directory data'):
+        assert categories[category].reads > 0, category
+    assert categories['file data'].bytes_read >= 20_000  # whole blocks through the cache
+    assert categories['other'].reads == 0 and stats.total.writes == 0
+    assert stats.total.reads == sum(row.reads for row in categories.values()) == sum(stats.read_sizes.values())
+    assert list(format_io_stats(stats))[0].startswith('I/O')
+
+
+def test_io_stats__seeks(tmp_path):
+    image_path = tmp_path / 'raw.img'
+    image_path.write_bytes(bytes(16384))
+    with open(image_path, 'r+b') as f:
+        buffer = IoStatsBuffer(FileBuffer(f))
+        buffer.read_at(0, 1024)
+        buffer.read_at(1024, 1024)  # sequential
+        buffer.read_at(8192, 512)
+        buffer.write_at(4096, b'1234')
+    total = buffer.stats().total
+    assert (total.reads, total.bytes_read, total.writes, total.bytes_written) == (3, 2560, 1, 4)
+    assert (total.seeks, total.seek_distance) == (2, 6144 + 4608)
+    assert buffer.stats().read_sizes == {512: 1, 1024: 2}
+
+
+def test_io_stats__category(tmp_path):
+    image_path = tmp_path / 'raw.img'
+    image_path.write_bytes(bytes(16384))
+    with open(image_path, 'rb') as f:
+        buffer = IoStatsBuffer(FileBuffer(f))
+        read_at(buffer, 8192, 16, category='file data')
+        blocks = (read_at(buffer, 4096 * idx, 16, category='directory data') for idx in (1, 2))
+        next(blocks)
+        read_at(buffer, 12288, 16)  # while the generator is suspended
+    categories = buffer.stats().categories
+    assert [categories[category].reads for category in ('file data', 'directory data', 'other')] == [1, 1, 1]
+
+
+def test_io_stats__off(generated_img: str):
+    with open_img(generated_img) as img:
+        assert find_io_stats(img.buffer) is None
@@ -3,8 +3,14 @@ from pathlib import PurePosixPath
 
 import pytest
 
+from benchmarks.make_image import make_image, pack_inode, BLOCK_SIZE
+from ext4.cat import get_physical_block
+from ext4.buffers import read_at, write_at
 from ext4.core import open_img
-from ext4.ls import ls, path_to_inode, format_ls_output_by_lines
+from ext4.inode import get_inode, get_checksum_seed
+from ext4.htree import is_indexed
+from ext4.ls import ls, path_to_inode, format_ls_output_by_lines, lookup_entry
+from tests.conftest import write_inode
 
 
 @pytest.mark.parametrize('img, expected_content_file, inode, recursively', [
@@ -49,3 +55,33 @@ def test_path_to_inode__big(img: str, path: str, expected_inode: int):
     with open_img(img) as image_tuple:
         actual_inode = path_to_inode(*image_tuple, path)
         assert actual_inode == expected_inode
+
+
+def test_ls__uninitialized_extent(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=1, fanout=1, depth=0, file_size=BLOCK_SIZE)
+    with open_img(image.path, write=True) as img:
+        root = get_inode(*img, 2)
+        data_block = get_physical_block(img.buffer, get_inode(*img, 12).i_block, 0, BLOCK_SIZE)
+        i_block = bytearray(root.i_block)
+        i_block[2:4] = (2).to_bytes(2, 'little')  # eh_entries
+        # preallocated block 1 over file data, ee_len with the uninitialized flag
+        i_block[24:36] = (1).to_bytes(4, 'little') + (32768 + 1).to_bytes(2, 'little') + bytes(2) + \
+            data_block.to_bytes(4, 'little')
+        write_inode(img, 2, pack_inode(2, get_checksum_seed(img.sb), root.i_mode, 2 * BLOCK_SIZE,
+                                       root.i_links_count, 2, root.i_flags, bytes(i_block)))
+        assert [name for _, name, _ in ls(*img, 2)] == ['.', '..', 'lost+found', 'file_0']
+
+
+def test_lookup_entry__leaf_out_of_directory(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=400, fanout=1, depth=0, file_size=0, htree=True)
+    with open_img(image.path, write=True) as img:
+        root = get_inode(*img, 2)
+        assert is_indexed(img.sb, root)
+        root_offset = get_physical_block(img.buffer, root.i_block, 0, BLOCK_SIZE) * BLOCK_SIZE
+        dx_root = bytearray(read_at(img.buffer, root_offset, BLOCK_SIZE))
+        assert dx_root[0x1e] == 0  # indirect_levels, the root points at leaves
+        count = int.from_bytes(dx_root[0x22:0x24], 'little')
+        for idx in range(count):  # every leaf past the blocks of the directory
+            dx_root[0x24 + 8 * idx:0x28 + 8 * idx] = (100_000).to_bytes(4, 'little')
+        write_at(img.buffer, root_offset, bytes(dx_root))
+        assert lookup_entry(*img, 2, 'file_7') == 12 + 7
@@ -0,0 +1,43 @@
+import io
+import shutil
+import subprocess
+from pathlib import PurePosixPath
+
+import pytest
+
+from benchmarks.make_image import make_image, plan_tree, get_file_path, BLOCK_SIZE
+from ext4.core import open_img
+from ext4.dump import copy_inode
+from ext4.fsck import fsck
+from ext4.htree import is_indexed
+from ext4.inode import get_inode
+from ext4.ls import ls, path_to_inode
+
+
+@pytest.mark.parametrize('spec', [
+    dict(files=50, fanout=3, depth=2, file_size=10_000, fragments=1, extent_depth=0, htree=True),
+    dict(files=40, fanout=1, depth=1, file_size=100_000, fragments=6, extent_depth=2, htree=True),
+    dict(files=1500, fanout=1, depth=0, file_size=1, fragments=1, extent_depth=0, htree=True),
+    dict(files=1500, fanout=1, depth=0, file_size=0, fragments=1, extent_depth=0, htree=False),
+])
+def test_make_image(tmp_path, spec: dict):
+    image = make_image(str(tmp_path / 'generated.img'), **spec)
+    with open_img(image.path) as img:
+        assert list(fsck(img)) == []
+        assert is_indexed(img.sb, get_inode(*img, 2)) == (spec['htree'] and spec['files'] > 300)
+
+        dirs = plan_tree(spec['fanout'], spec['depth'])
+        for file_idx in (0, spec['files'] - 1):
+            inode_no = path_to_inode(*img, PurePosixPath(get_file_path(dirs, file_idx)))
+            content = io.BytesIO()
+            copy_inode(*img, inode_no, content)
+            block = ('{:08}\n'.format(file_idx).encode() * BLOCK_SIZE)[:BLOCK_SIZE]
+            assert content.getvalue() == (block * (spec['file_size'] // BLOCK_SIZE + 1))[:spec['file_size']]
+
+        def count(entries) -> int:
+            return sum(1 + count(children) for _, name, children in entries if name not in ('.', '..'))
+
+        assert count(ls(*img, 2, recursively=True)) == len(dirs) + spec['files']  # lost+found instead of root
+
+    if shutil.which('e2fsck'):
+        assert subprocess.run(['e2fsck', '-fn', image.path], capture_output=True).returncode == 0
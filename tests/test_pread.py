@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from pathlib import PurePosixPath
+
+import pytest
+
+from benchmarks.make_image import make_image, pack_inode, BLOCK_SIZE
+from ext4.cat import pread, iter_mapped_range
+from ext4.core import open_img
+from ext4.inode import get_inode, get_checksum_seed
+from ext4.tools import cat, ls
+from tests.conftest import make_image_with_hole, write_inode
+
+
+@pytest.mark.parametrize('img, expected_content_file, inode, offset, length', [
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17, 0, 20),
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17, 8, 100),
+    (path.join('tests', 'images', 'small_1.img'),
+     path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'),
+     17, 100, 10),
+])
+def test_pread(img: str, expected_content_file: str, inode: int, offset: int, length: int):
+    with open(expected_content_file, 'rb') as f:
+        expected_content = f.read()
+    with open_img(img) as image_tuple:
+        assert pread(*image_tuple, inode, offset, length) == expected_content[offset:offset + length]
+
+
+@pytest.mark.skipif(not path.exists(path.join('tests', 'images', 'big_1.img')), reason='require big image')
+@pytest.mark.parametrize('img, expected_content_file, inode', [
+    (path.join('tests', 'images', 'big_1.img'),
+     path.join('tests', 'outputs', 'cat__big_1__etc_passwd'),
+     540745),
+])
+def test_pread__big_tail(img: str, expected_content_file: str, inode: int):
+    with open(expected_content_file, 'rb') as f:
+        expected_content = f.read()
+    with open_img(img) as image_tuple:
+        offset = max(len(expected_content) - 4096, 0)
+        assert pread(*image_tuple, inode, offset, 4096) == expected_content[offset:]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_concurrent_reads(use_mmap: bool):
+    with open(path.join('tests', 'outputs', 'cat__small_1__TestDir1_Test1_1'), 'rb') as f:
+        expected_content = f.read()
+    with open_img(path.join('tests', 'images', 'small_1.img'), use_mmap=use_mmap, cache_size=4) as image_tuple:
+        def read(i: int):
+            if i % 2:
+                return cat(*image_tuple, PurePosixPath('/TestDir1/Test1_1.txt'))
+            return [name for _, name, _ in ls(*image_tuple, PurePosixPath('/TestDir1'))]
+
+        expected_names = read(0)
+        with ThreadPoolExecutor(8) as executor:
+            for i, result in enumerate(executor.map(read, range(200))):
+                assert result == (expected_content if i % 2 else expected_names)
+
+
+def test_pread__hole(tmp_path):
+    with open_img(make_image_with_hole(str(tmp_path / 'generated.img'), hole_blocks=3)) as img:
+        block = ('{:08}\n'.format(0).encode() * BLOCK_SIZE)[:BLOCK_SIZE]
+        assert pread(*img, 12, BLOCK_SIZE, 7 * BLOCK_SIZE) == block * 2 + bytes(3 * BLOCK_SIZE) + block * 2
+        segments = list(iter_mapped_range(img.buffer, get_inode(*img, 12).i_block, 10, 9 * BLOCK_SIZE - 20,
+                                          BLOCK_SIZE))
+        # the hole is one segment, not a segment per block
+        assert [length for _, length in segments] == [3 * BLOCK_SIZE - 10, 3 * BLOCK_SIZE, 3 * BLOCK_SIZE - 10]
+        assert segments[1][0] is None and None not in (segments[0][0], segments[2][0])
+
+
+def test_pread__fast_symlink(tmp_path):
+    image = make_image(str(tmp_path / 'generated.img'), files=1, fanout=1, depth=0, file_size=0)
+    with open_img(image.path, write=True) as img:
+        write_inode(img, 12, pack_inode(12, get_checksum_seed(img.sb), 0o120777, 6, 1,
+                                        i_block=b'file_2'.ljust(60, b'\0')))
+        assert pread(*img, 12, 2, 10) == b'le_2'
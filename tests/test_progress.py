@@ -0,0 +1,50 @@
+import io
+import json
+from os import path
+
+from ext4.core import open_img
+from ext4.exceptions import UnconnectedInode
+from ext4.fsck import fsck
+from ext4.progress import FsckProgress, TtyProgress, PassMetrics, format_pass_status, write_json_report
+from tests.conftest import TEST_IMAGES_FOLDER
+
+
+def test_fsck_progress():
+    progress = FsckProgress()
+    with open_img(path.join(TEST_IMAGES_FOLDER, 'small_1.img')) as img:
+        assert list(fsck(img, progress=progress)) == []
+        groups_count = len(img.bg_descriptors)
+    assert [metrics.pass_no for metrics in progress.passes] == [0, 1, 2, 3, 4, 5]
+    pass_1 = progress.passes[1]
+    assert pass_1.done == pass_1.total == groups_count
+    assert pass_1.inodes > 0 and pass_1.bytes > 0 and pass_1.seconds > 0
+
+
+def test_format_pass_status():
+    metrics = PassMetrics(1, 8)
+    metrics.done, metrics.inodes = 2, 100
+    metrics.start -= 10
+    assert format_pass_status(metrics) == \
+        'pass 1: inodes, blocks and sizes, 2/8 groups (25%), 10 inodes/s, 0.0 MiB/s, ETA 0:00:30'
+
+
+def test_tty_progress__not_a_tty():
+    stream = io.StringIO()
+    progress = TtyProgress(stream, interval=0)
+    progress.start_pass(1, 2)
+    progress.advance(done=1, inodes=10, bytes_read=1024)
+    assert stream.getvalue() == ''
+    progress.finish_pass()
+    assert stream.getvalue().startswith('pass 1: inodes, blocks and sizes done in ')
+
+
+def test_write_json_report():
+    progress = FsckProgress()
+    progress.start_pass(3)
+    progress.exception_found(UnconnectedInode(15))
+    progress.finish_pass()
+    stream = io.StringIO()
+    write_json_report(stream, [UnconnectedInode(15)], progress)
+    report = json.loads(stream.getvalue())
+    assert report['exceptions'] == [{'pass': 3, 'type': 'UnconnectedInode', 'message': '[Inode 15] unconnected!'}]
+    assert report['metrics']['passes'][0]['exceptions'] == 1
@@ -0,0 +1,33 @@
+from struct import pack
+
+import pytest
+
+from ext4.structures import ext4_extent_codec, ext4_dir_entry_2_codec, ext4_inode_codec, parse_struct, \
+    ext4_extent_struct, repack_struct
+
+
+@pytest.mark.parametrize('offset', [0, 12])
+def test_codec_unpack_from(offset: int):
+    raw = bytes(offset) + pack('<LHHL', 5, 3, 1, 100)
+    extent = ext4_extent_codec.unpack_from(raw, offset)
+    assert (extent.ee_block, extent.ee_len, extent.ee_start_hi, extent.ee_start_lo) == (5, 3, 1, 100)
+    assert extent == parse_struct(ext4_extent_struct, raw, offset)
+
+
+def test_codec_iter_unpack():
+    raw = bytes(12) + b''.join(pack('<LHHL', i, 1, 0, 1000 + i) for i in range(4))
+    extents = list(ext4_extent_codec.iter_unpack(raw, 12, 3))
+    assert [extent.ee_start_lo for extent in extents] == [1000, 1001, 1002]
+
+
+def test_codec_unpack_field():
+    raw = pack('<LHBB', 12, 16, 5, 1)
+    assert ext4_dir_entry_2_codec.unpack_field(raw, 'rec_len') == 16
+    assert ext4_dir_entry_2_codec.unpack_field(raw, 'file_type') == 1
+    inode_raw = bytes(0x7c) + pack('<H', 0xabcd) + bytes(2)
+    assert ext4_inode_codec.unpack_field(inode_raw, 'i_checksum_lo') == 0xabcd
+
+
+def test_codec_repack():
+    raw = pack('<LHHL', 5, 3, 1, 100)
+    assert repack_struct(parse_struct(ext4_extent_struct, raw), ext4_extent_struct) == raw